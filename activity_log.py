@@ -0,0 +1,176 @@
+"""Activity log storage, partitioned by month.
+
+``activities`` is the newest partition: every ``log_activity`` call appends
+to it, and the dashboard and the first page of the feed read only it,
+through the ``(user_id, timestamp)`` index. Older months live in tables of
+their own (``activities_2026_09``, ...) with the same columns and index, so
+the hot table holds about one month of rows however long the log gets.
+
+``flask --app app rotate-activities`` (run it daily, or at least monthly):
+
+- moves rows from before the current month into their month's table, in
+  batches (``INSERT ... SELECT`` then ``DELETE``, like ``archive.py``)
+- rolls month tables older than ``ACTIVITY_RETENTION_MONTHS`` up into
+  ``activity_rollups`` (one count per user, role, action and month) and
+  drops them
+
+Rows are never updated, so nothing else has to know about the partitions.
+Sellers with a database of their own (``TENANT_DATABASE_URLS``) have their
+partitions there and are rotated too.
+"""
+import re
+from collections import defaultdict
+from datetime import date, datetime
+
+import click
+from sqlalchemy import MetaData, Table, delete, func, insert, inspect, literal, select, tuple_
+
+import tenants
+from models import db, Activity, ActivityRollup, time_ago
+
+PARTITION_NAME = re.compile(r'^activities_(\d{4})_(\d{2})$')
+FEED_COLUMNS = ('id', 'user_id', 'user_role', 'action_type', 'description', 'timestamp')
+
+_partition_metadata = MetaData()
+
+
+def month_start(moment):
+    return datetime(moment.year, moment.month, 1)
+
+
+def add_months(month, months):
+    index = month.year * 12 + month.month - 1 + months
+    return datetime(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(month):
+    return f'{Activity.__tablename__}_{month.year:04d}_{month.month:02d}'
+
+
+def partition_table(name):
+    """The ``Table`` for a month partition (not created, just described)."""
+    if name in _partition_metadata.tables:
+        return _partition_metadata.tables[name]
+    columns = [column._copy() for column in Activity.__table__.columns]
+    return Table(name, _partition_metadata, *columns,
+                 db.Index(f'ix_{name}_user_time', 'user_id', 'timestamp'))
+
+
+def partitions(bind):
+    """Month partition names in ``bind``'s database, newest first."""
+    return sorted((name for name in inspect(bind).get_table_names() if PARTITION_NAME.match(name)),
+                  reverse=True)
+
+
+def _page(table, user_id, before, limit):
+    stmt = select(*[table.c[name] for name in FEED_COLUMNS]).where(table.c.user_id == user_id)
+    if before is not None:
+        stmt = stmt.where(tuple_(table.c.timestamp, table.c.id) < tuple_(*before))
+    return db.session.execute(stmt.order_by(table.c.timestamp.desc(), table.c.id.desc()).limit(limit)).all()
+
+
+def recent(user_id, limit=5):
+    """A user's latest activities. Only reaches past the hot partition just after a rotation."""
+    rows = _page(Activity.__table__, user_id, None, limit)
+    if len(rows) < limit:
+        older = partitions(db.session.connection())
+        if older:
+            rows += _page(partition_table(older[0]), user_id, None, limit - len(rows))
+    return rows
+
+
+def feed(user_id, limit, cursor=None):
+    """One page of a user's activity, newest first. Returns ``(rows, next_cursor)``.
+
+    A cursor is ``[partition or None, timestamp, id]``; every page reads a single partition, starting
+    with the hot one. A page that reaches the end of its partition is short, and its cursor points at the
+    start of the next older one.
+    """
+    partition, before = None, None
+    if cursor is not None:
+        partition, timestamp, row_id = cursor
+        before = (datetime.fromisoformat(timestamp), int(row_id)) if timestamp is not None else None
+    if partition is None:
+        table = Activity.__table__
+    else:
+        if not PARTITION_NAME.match(partition) or partition not in partitions(db.session.connection()):
+            raise ValueError(f'unknown partition {partition!r}')
+        table = partition_table(partition)
+
+    rows = _page(table, user_id, before, limit + 1)
+    if len(rows) > limit:
+        rows = rows[:limit]
+        return rows, [partition, rows[-1].timestamp.isoformat(), rows[-1].id]
+    older = [name for name in partitions(db.session.connection()) if partition is None or name < partition]
+    return rows, [older[0], None, None] if older else None
+
+
+def move_to_partitions(connection, before, batch_size=1000):
+    """Move rows older than ``before`` out of the hot table into their month's table. Returns rows moved."""
+    hot = Activity.__table__
+    moved = 0
+    while True:
+        with connection.begin():
+            batch = connection.execute(
+                select(hot.c.id, hot.c.timestamp).where(hot.c.timestamp < before).order_by(hot.c.id).limit(batch_size)
+            ).all()
+            if not batch:
+                return moved
+            by_month = defaultdict(list)
+            for row_id, timestamp in batch:
+                by_month[month_start(timestamp)].append(row_id)
+            columns = [column.name for column in hot.columns]
+            for month, ids in by_month.items():
+                table = partition_table(partition_name(month))
+                table.create(connection, checkfirst=True)
+                connection.execute(insert(table).from_select(columns, select(*hot.columns).where(hot.c.id.in_(ids))))
+            connection.execute(delete(hot).where(hot.c.id.in_([row_id for row_id, _ in batch])))
+        moved += len(batch)
+
+
+def roll_up(connection, before):
+    """Replace month tables older than ``before`` with per-user, per-action counts. Returns tables dropped."""
+    dropped = 0
+    for name in partitions(connection.engine):
+        year, month = map(int, PARTITION_NAME.match(name).groups())
+        if datetime(year, month, 1) >= before:
+            continue
+        table = partition_table(name)
+        rollups = ActivityRollup.__table__
+        with connection.begin():
+            connection.execute(delete(rollups).where(rollups.c.month == date(year, month, 1)))
+            connection.execute(insert(rollups).from_select(
+                ['month', 'user_id', 'user_role', 'action_type', 'count'],
+                select(literal(date(year, month, 1), rollups.c.month.type), table.c.user_id, table.c.user_role,
+                       table.c.action_type, func.count())
+                .group_by(table.c.user_id, table.c.user_role, table.c.action_type),
+            ))
+            table.drop(connection)
+        dropped += 1
+    return dropped
+
+
+def rotate(retention_months, batch_size=1000, now=None):
+    """Partition and expire the log in every database. Returns ``(rows moved, partitions rolled up)``."""
+    current = month_start(now or datetime.utcnow())
+    moved = dropped = 0
+    for engine in [db.engine, *tenants.tenant_engines().values()]:
+        with engine.connect() as connection:
+            moved += move_to_partitions(connection, current, batch_size)
+            dropped += roll_up(connection, add_months(current, -retention_months))
+    return moved, dropped
+
+
+def init_app(app):
+    app.add_template_filter(time_ago, 'time_ago')
+
+    @app.cli.command('rotate-activities')
+    @click.option('--months', type=int, default=None, help='Keep this many months of detailed activity.')
+    @click.option('--batch-size', type=int, default=1000, show_default=True)
+    def rotate_activities_command(months, batch_size):
+        """Move last month's activity out of the hot table and roll up expired months."""
+        if months is None:
+            months = app.config['ACTIVITY_RETENTION_MONTHS']
+        moved, dropped = rotate(months, batch_size)
+        click.echo(f"Moved {moved} activit{'y' if moved == 1 else 'ies'} into monthly partitions; "
+                   f"rolled up {dropped} month(s) older than {months} months.")
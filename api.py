@@ -0,0 +1,537 @@
+"""Versioned JSON API (``/api/v1``) for integrations.
+
+Invoices, invoice items, customers and products are exposed as plain
+JSON, with no HTML rendering. Requests authenticate with the same session
+cookie as the web app: log in once with ``POST /login`` and reuse the
+cookie.
+
+Query parameters:
+
+- ``fields=id,amount,...`` returns only those fields. Pages are read with
+  a column-projected ``select()`` of just the matching columns, into
+  named-tuple rows rather than ORM objects.
+- ``include=customer,items`` nests related resources. Each include is one
+  more ``IN`` query over the page's keys (item names and prices come from
+  a join to products in the same query), so a page costs one query plus
+  one per include, however many rows it has.
+- ``limit`` and ``cursor`` page through results in primary-key order. Each
+  response carries ``next_cursor`` until the last page. Pages are fetched
+  with a keyset ``WHERE pk > :last`` rather than ``OFFSET``.
+
+``/changes?since=<cursor>`` is the delta sync feed (see ``changes.py``): the
+rows created, updated or deleted since the client's last cursor.
+
+``/drafts`` saves the invoice form as it is filled in and finalizes it into
+an invoice (see ``drafts.py``).
+
+``/activities`` is the signed-in seller's activity log, newest first. Each
+page reads one monthly partition (see ``activity_log.py``).
+
+Responses are compressed like every other page (see ``compression.py``).
+"""
+import base64
+import json
+from collections import defaultdict
+from datetime import datetime
+from functools import wraps
+
+from flask import Blueprint, abort, g, jsonify, request, session
+from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm.exc import StaleDataError
+
+import activity_log
+import archive
+import changes
+import drafts
+from models import db, Customer, Invoice, InvoiceDraft, InvoiceItem, Product
+from replicas import read_replica
+
+DEFAULT_LIMIT = 100
+MAX_LIMIT = 500
+
+bp = Blueprint('api_v1', __name__, url_prefix='/api/v1')
+
+
+def _money(value):
+    return float(value) if value is not None else None
+
+
+def _iso(value):
+    return value.isoformat() if value is not None else None
+
+
+class Resource:
+    """How a model is exposed: public field name -> (attribute, serializer).
+
+    Listings select only the columns behind the requested fields and get back named-tuple rows, like the
+    seller listing pages (see ``read_models.py``). ``computed`` fields are worked out from other projected
+    columns, so an item's price and total need no ORM objects either.
+    """
+
+    def __init__(self, model, key, fields, includes=None, scope=None, computed=None, joins=()):
+        self.model = model
+        self.key = key
+        self.fields = fields
+        self.includes = includes or {}
+        self.scope = scope
+        self.computed = computed or {}  # attribute -> (columns it reads, function of the row)
+        self.joins = joins  # (model, on clause) for the tables computed fields read from
+
+    def selected_fields(self):
+        requested = request.args.get('fields')
+        if not requested:
+            return list(self.fields)
+        names = [name.strip() for name in requested.split(',') if name.strip()]
+        unknown = [name for name in names if name not in self.fields]
+        if unknown:
+            abort(400, description=f"Unknown field(s): {', '.join(unknown)}")
+        return names
+
+    def selected_includes(self):
+        requested = request.args.get('include')
+        if not requested:
+            return []
+        names = [name.strip() for name in requested.split(',') if name.strip()]
+        unknown = [name for name in names if name not in self.includes]
+        if unknown:
+            abort(400, description=f"Unknown include(s): {', '.join(unknown)}")
+        return names
+
+    def column(self, attribute):
+        return getattr(self.model, attribute)
+
+    def statement(self, fields, includes=(), extra=(), scoped=True):
+        """``select()`` of the key, the columns behind ``fields`` and those ``includes`` are matched on."""
+        attributes = [self.key, *extra, *(self.fields[name][0] for name in fields),
+                      *(self.includes[name][2] for name in includes)]
+        columns = {}
+        for attribute in attributes:
+            for column in self.computed[attribute][0] if attribute in self.computed else (self.column(attribute),):
+                columns.setdefault(column.key, column)
+        stmt = select(*columns.values()).select_from(self.model)
+        for model, onclause in self.joins:
+            stmt = stmt.join(model, onclause)
+        if scoped and self.scope is not None:
+            stmt = stmt.where(self.scope())
+        return stmt
+
+    def rows(self, fields, includes, *filters):
+        """The rows matching ``filters`` in key order, with ``includes`` loaded (one query per include)."""
+        rows = db.session.execute(
+            self.statement(fields, includes).where(*filters).order_by(self.column(self.key).asc())).all()
+        return rows, self.load_includes(rows, includes)
+
+    def load_includes(self, rows, includes):
+        """``{include: {matched value: [serialized related rows]}}`` with one ``IN`` query per include."""
+        loaded = {}
+        for name in includes:
+            resource, _, attribute, link = self.includes[name]
+            values = {getattr(row, attribute) for row in rows} - {None}
+            related = defaultdict(list)
+            if values:
+                fields = list(resource.fields)
+                stmt = resource.statement(fields, extra=(link,), scoped=False).where(
+                    resource.column(link).in_(values)).order_by(resource.column(resource.key).asc())
+                for row in db.session.execute(stmt):
+                    related[getattr(row, link)].append(resource.serialize(row, fields))
+            loaded[name] = related
+        return loaded
+
+    def serialize(self, obj, fields, includes=(), loaded=None):
+        """``obj`` is a row from ``statement`` (with ``loaded`` from ``load_includes``) or a model instance."""
+        row = not isinstance(obj, db.Model)
+        data = {}
+        for name in fields:
+            attribute, serializer = self.fields[name]
+            if row and attribute in self.computed:
+                value = self.computed[attribute][1](obj)
+            else:
+                value = getattr(obj, attribute)
+            data[name] = serializer(value) if serializer else value
+        for name in includes:
+            resource, relationship, attribute, _ = self.includes[name]
+            many = getattr(self.model, relationship).property.uselist
+            if row:
+                related = loaded[name].get(getattr(obj, attribute), [])
+                data[name] = related if many else (related[0] if related else None)
+                continue
+            related = getattr(obj, relationship)
+            if many:
+                data[name] = [resource.serialize(item, list(resource.fields)) for item in related]
+            else:
+                data[name] = resource.serialize(related, list(resource.fields)) if related is not None else None
+        return data
+
+
+def _seller_id():
+    return g.api_seller_id
+
+
+def _item_price(row):
+    """Unit price in the invoice's currency, as ``InvoiceItem.price`` computes it"""
+    return row.p_price * row.exchange_rate
+
+
+customers = Resource(Customer, 'c_id', {
+    'id': ('c_id', None),
+    'name': ('c_name', None),
+    'email': ('c_email', None),
+    'phone': ('c_phone_no', None),
+    'address': ('c_address', None),
+}, scope=lambda: Customer.s_id == _seller_id())
+
+products = Resource(Product, 'p_id', {
+    'id': ('p_id', None),
+    'name': ('p_name', None),
+    'price': ('p_price', _money),
+    'stock': ('p_stock', None),
+    'description': ('p_description', None),
+    'tax_class': ('tax_class', None),
+}, scope=lambda: Product.s_id == _seller_id())
+
+items = Resource(InvoiceItem, 'item_id', {
+    'id': ('item_id', None),
+    'product_id': ('p_id', None),
+    'product_name': ('product_name', None),
+    'quantity': ('item_quantity', None),
+    'discount': ('discount', _money),
+    'price': ('price', _money),
+    'total': ('total', _money),
+}, computed={
+    'product_name': ((Product.p_name,), lambda row: row.p_name),
+    'price': ((Product.p_price, Invoice.exchange_rate), _item_price),
+    'total': ((Product.p_price, Invoice.exchange_rate, InvoiceItem.item_quantity, InvoiceItem.discount),
+              lambda row: _item_price(row) * row.item_quantity - row.discount),
+}, joins=(
+    (Product, Product.p_id == InvoiceItem.p_id),
+    (Invoice, Invoice.invoice_no == InvoiceItem.invoice_no),
+))
+
+invoices = Resource(Invoice, 'invoice_no', {
+    'id': ('invoice_no', None),
+    'date': ('invoice_datetime', _iso),
+    'status': ('status', None),
+    'tax': ('tax', _money),
+    'amount': ('amount', _money),
+    'amount_paid': ('amount_paid', _money),
+    'currency': ('currency', None),
+    'exchange_rate': ('exchange_rate', _money),
+    'tax_region': ('tax_region', None),
+    'customer_id': ('c_id', None),
+}, includes={
+    # name: (resource, relationship, attribute of the invoice row, resource attribute it matches)
+    'customer': (customers, 'customer', 'c_id', 'c_id'),
+    'items': (items, 'invoice_items', 'invoice_no', 'invoice_no'),
+}, scope=lambda: Invoice.s_id == _seller_id())
+
+
+def encode_cursor(value):
+    return base64.urlsafe_b64encode(json.dumps(value).encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        return json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    except ValueError:
+        abort(400, description='Invalid cursor')
+
+
+def api_seller_required(f):
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        if session.get('user_role') != 'seller':
+            return jsonify({'error': 'Authentication required'}), 401
+        g.api_seller_id = session['user_id']
+        return f(*args, **kwargs)
+    return decorated_function
+
+
+def list_resource(resource, *filters):
+    fields = resource.selected_fields()
+    includes = resource.selected_includes()
+    try:
+        limit = min(max(int(request.args.get('limit', DEFAULT_LIMIT)), 1), MAX_LIMIT)
+    except ValueError:
+        abort(400, description='limit must be an integer')
+
+    key = resource.column(resource.key)
+    stmt = resource.statement(fields, includes).where(*filters)
+    cursor = request.args.get('cursor')
+    if cursor:
+        stmt = stmt.where(key > decode_cursor(cursor))
+    rows = db.session.execute(stmt.order_by(key.asc()).limit(limit + 1)).all()
+
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    loaded = resource.load_includes(rows, includes)
+    return jsonify({
+        'data': [resource.serialize(row, fields, includes, loaded) for row in rows],
+        'next_cursor': encode_cursor(getattr(rows[-1], resource.key)) if has_more else None,
+    })
+
+
+def get_resource(resource, obj, loaded=None):
+    if obj is None:
+        abort(404, description='Not found')
+    fields = resource.selected_fields()
+    return jsonify({'data': resource.serialize(obj, fields, resource.selected_includes(), loaded)})
+
+
+@bp.route('/invoices')
+@api_seller_required
+@read_replica
+def list_invoices():
+    filters = []
+    if request.args.get('status'):
+        filters.append(Invoice.status == request.args['status'])
+    if request.args.get('customer_id'):
+        filters.append(Invoice.c_id == request.args['customer_id'])
+    return list_resource(invoices, *filters)
+
+
+@bp.route('/invoices/<invoice_id>')
+@api_seller_required
+@read_replica
+def get_invoice(invoice_id):
+    rows, loaded = invoices.rows(invoices.selected_fields(), invoices.selected_includes(),
+                                 Invoice.invoice_no == invoice_id)
+    if rows:
+        return get_resource(invoices, rows[0], loaded)
+    # Old paid invoices live in the archive tables
+    invoice = archive.find_invoice(invoice_id)
+    if invoice is not None and invoice.s_id != _seller_id():
+        invoice = None
+    return get_resource(invoices, invoice)
+
+
+@bp.route('/invoices/<invoice_id>/items')
+@api_seller_required
+@read_replica
+def list_invoice_items(invoice_id):
+    if not Invoice.query.filter_by(invoice_no=invoice_id, s_id=_seller_id()).count():
+        abort(404, description='Not found')
+    return list_resource(items, InvoiceItem.invoice_no == invoice_id)
+
+
+@bp.route('/customers')
+@api_seller_required
+@read_replica
+def list_customers():
+    return list_resource(customers)
+
+
+@bp.route('/customers/<customer_id>')
+@api_seller_required
+@read_replica
+def get_customer(customer_id):
+    return get_resource(customers, db.session.get(Customer, customer_id))
+
+
+@bp.route('/products')
+@api_seller_required
+@read_replica
+def list_products():
+    return list_resource(products)
+
+
+@bp.route('/products/<product_id>')
+@api_seller_required
+@read_replica
+def get_product(product_id):
+    rows, _ = products.rows(products.selected_fields(), [], Product.p_id == product_id)
+    return get_resource(products, rows[0] if rows else None)
+
+
+SYNC_RESOURCES = {
+    # feed resource name: (API resource, includes sent with each row)
+    'customer': (customers, []),
+    'invoice': (invoices, ['items']),
+    'product': (products, []),
+}
+
+
+@bp.route('/changes')
+@api_seller_required
+def list_changes():
+    """Everything created, updated or deleted after ``since``, oldest first.
+
+    Each entry is ``{"type", "id", "op", "changed_at", "data"}``. ``op`` is ``upsert`` (``data`` is the
+    full row), ``delete`` or ``archive`` (``data`` is null; an archived invoice is still readable at
+    ``/invoices/<id>`` but no longer listed). Store ``next_cursor`` and send it back as ``since``.
+    """
+    try:
+        limit = min(max(int(request.args.get('limit', DEFAULT_LIMIT)), 1), MAX_LIMIT)
+    except ValueError:
+        abort(400, description='limit must be an integer')
+    since = request.args.get('since')
+    position = None
+    if since:
+        try:
+            changed_at, resource, key = decode_cursor(since)
+            position = (datetime.fromisoformat(changed_at), resource, key)
+        except (TypeError, ValueError):
+            abort(400, description='Invalid cursor')
+
+    rows = changes.changed_rows(_seller_id(), position, limit)
+
+    # One IN query per resource (plus its includes) for the rows that still exist
+    keys = defaultdict(set)
+    for _, resource, key in rows:
+        if resource != changes.TOMBSTONE:
+            keys[resource].add(key)
+    loaded = {}
+    for resource, wanted in keys.items():
+        api_resource, includes = SYNC_RESOURCES[resource]
+        fields = list(api_resource.fields)
+        found, related = api_resource.rows(fields, includes, api_resource.column(api_resource.key).in_(wanted))
+        for row in found:
+            loaded[resource, getattr(row, api_resource.key)] = api_resource.serialize(row, fields, includes, related)
+
+    data = []
+    for changed_at, resource, key in rows:
+        if resource == changes.TOMBSTONE:
+            entry = {'type': key.resource, 'id': key.key, 'op': 'archive' if key.archived else 'delete', 'data': None}
+        elif (resource, key) in loaded:
+            entry = {'type': resource, 'id': key, 'op': 'upsert', 'data': loaded[resource, key]}
+        else:
+            # Deleted since it was listed; its tombstone comes later in the feed
+            continue
+        entry['changed_at'] = _iso(changed_at)
+        data.append(entry)
+
+    if rows:
+        changed_at, resource, key = rows[-1]
+        since = encode_cursor([changed_at.isoformat(), resource,
+                               str(key.id) if resource == changes.TOMBSTONE else key])
+    return jsonify({'data': data, 'next_cursor': since or None, 'has_more': len(rows) == limit})
+
+
+def _draft(draft_id):
+    draft = db.session.execute(
+        select(InvoiceDraft).where(InvoiceDraft.id == draft_id, InvoiceDraft.s_id == _seller_id())
+    ).scalar_one_or_none()
+    if draft is None:
+        abort(404, description='Not found')
+    return draft
+
+
+def _draft_summary(draft):
+    totals = drafts.totals(draft)
+    return {'id': draft.id, 'version': draft.version_id, 'invoice_id': draft.invoice_no,
+            'subtotal': _money(totals.subtotal), 'tax': _money(totals.tax), 'total': _money(totals.amount)}
+
+
+def _draft_data(draft):
+    return {**_draft_summary(draft), 'customer_id': draft.c_id, 'currency': draft.currency,
+            'tax_region': draft.tax_region, 'manual_tax': _money(draft.tax),
+            'lines': [{'id': line.line_id, 'product_id': line.p_id, 'quantity': line.item_quantity,
+                       'discount': _money(line.discount), 'position': line.position} for line in draft.lines]}
+
+
+def _draft_conflict(draft_id, error):
+    db.session.rollback()
+    return jsonify({'error': str(error) or 'This draft was saved somewhere else',
+                    'data': _draft_data(_draft(draft_id))}), 409
+
+
+@bp.route('/drafts', methods=['POST'])
+@api_seller_required
+def create_draft():
+    try:
+        draft = drafts.create_draft(_seller_id(), request.get_json(silent=True) or {})
+        db.session.commit()
+    except ValueError as error:
+        db.session.rollback()
+        abort(400, description=str(error))
+    return jsonify({'data': _draft_data(draft)}), 201
+
+
+@bp.route('/drafts/<draft_id>')
+@api_seller_required
+def get_draft(draft_id):
+    return jsonify({'data': _draft_data(_draft(draft_id))})
+
+
+@bp.route('/drafts/<draft_id>', methods=['PATCH'])
+@api_seller_required
+def update_draft(draft_id):
+    """Autosave: apply the changed fields and lines and return the new version and totals (409 if stale)."""
+    draft = _draft(draft_id)
+    try:
+        drafts.apply_changes(draft, request.get_json(silent=True) or {})
+        db.session.commit()
+    except ValueError as error:
+        db.session.rollback()
+        abort(400, description=str(error))
+    except (drafts.DraftConflict, StaleDataError) as error:
+        return _draft_conflict(draft_id, error if isinstance(error, drafts.DraftConflict) else '')
+    return jsonify({'data': _draft_summary(draft)})
+
+
+@bp.route('/drafts/<draft_id>', methods=['DELETE'])
+@api_seller_required
+def delete_draft(draft_id):
+    draft = _draft(draft_id)
+    if draft.invoice_no is None:
+        db.session.delete(draft)
+        db.session.commit()
+    return '', 204
+
+
+@bp.route('/drafts/<draft_id>/finalize', methods=['POST'])
+@api_seller_required
+def finalize_draft(draft_id):
+    """Create the invoice (201), or return the one this ``Idempotency-Key`` already created (200)."""
+    key = request.headers.get('Idempotency-Key', '').strip()
+    draft = _draft(draft_id)
+    try:
+        invoice, created = drafts.finalize(draft, key)
+        if created:
+            db.session.commit()
+    except ValueError as error:
+        db.session.rollback()
+        abort(400, description=str(error))
+    except drafts.DraftConflict as error:
+        return _draft_conflict(draft_id, error)
+    except (StaleDataError, IntegrityError):
+        # A concurrent attempt won; answer as a retry of it if it used the same key
+        db.session.rollback()
+        draft = _draft(draft_id)
+        if draft.invoice_no is None or draft.idempotency_key != key:
+            abort(409, description='This draft or Idempotency-Key was used by another request; try again')
+        invoice, created = drafts.finalize(draft, key)
+    fields = invoices.selected_fields()
+    return jsonify({'data': invoices.serialize(invoice, fields, ['items'])}), 201 if created else 200
+
+
+@bp.route('/activities')
+@api_seller_required
+@read_replica
+def list_activities():
+    """The seller's activity, newest first. Pages end at month boundaries, so keep following ``next_cursor``."""
+    try:
+        limit = min(max(int(request.args.get('limit', DEFAULT_LIMIT)), 1), MAX_LIMIT)
+    except ValueError:
+        abort(400, description='limit must be an integer')
+    cursor = request.args.get('cursor')
+    try:
+        rows, next_cursor = activity_log.feed(_seller_id(), limit, decode_cursor(cursor) if cursor else None)
+    except (TypeError, ValueError):
+        abort(400, description='Invalid cursor')
+    return jsonify({
+        'data': [{'id': row.id, 'action_type': row.action_type, 'description': row.description,
+                  'timestamp': _iso(row.timestamp)} for row in rows],
+        'next_cursor': encode_cursor(next_cursor) if next_cursor else None,
+    })
+
+
+@bp.errorhandler(400)
+@bp.errorhandler(404)
+@bp.errorhandler(409)
+def api_error(error):
+    return jsonify({'error': error.description}), error.code
+
+
+def init_app(app):
+    app.register_blueprint(bp)
@@ -1,35 +1,108 @@
-from flask import Flask, render_template, request, redirect, url_for, session, flash, jsonify, send_file
-from datetime import datetime
+from flask import Flask, Response, render_template, request, redirect, url_for, session, flash, jsonify, send_file
+from datetime import datetime, date
 from config import Config
-from models import db, Seller, Customer, Product, Invoice, InvoiceItem, Activity
+from models import (db, Seller, Customer, Product, Invoice, InvoiceItem, ArchivedInvoice, ArchivedInvoiceItem,
+                    Activity, RecurringInvoice, RecurringInvoiceItem)
 from decimal import Decimal
-import io
+from sqlalchemy import exists, func, select
+from sqlalchemy.exc import IntegrityError, InvalidRequestError
+from sqlalchemy.orm.exc import StaleDataError
+from werkzeug.security import generate_password_hash
+import activity_log
+import api
+import archive
+import assets
+import compression
+import constraints
+import fragments
+import integrity
+import numbering
+import payments
+import portal
+import ratelimit
+import read_models
+import recurring
+import replicas
+import reports
+import schema
+import statements
+import taxes
+import tenants
+import webhooks
+from ratelimit import limited
+from replicas import read_replica
 
-app = Flask(__name__)
-app.config.from_object(Config)
+# Views below are collected here and attached to each app by create_app(). Unlike a
+# blueprint this keeps endpoint names unprefixed (url_for('login')).
+_routes = []
+_error_handlers = []
 
-# Initialize database0
-db.init_app(app)
 
-# Ensure tables exist when the app starts
-with app.app_context():
-    db.create_all()
+def route(rule, **options):
+    def decorator(f):
+        _routes.append((rule, options, f))
+        return f
+    return decorator
+
+
+def errorhandler(code):
+    def decorator(f):
+        _error_handlers.append((code, f))
+        return f
+    return decorator
+
+
+def create_app(config_object=Config):
+    """Build the application.
+
+    Nothing here touches the database. Create or upgrade the schema
+    separately with ``flask --app app upgrade-db``.
+    """
+    app = Flask(__name__)
+    app.config.from_object(config_object)
+
+    db.init_app(app)
+    compression.init_app(app)  # registered first, so it runs after every other after_request
+    tenants.init_app(app)
+    taxes.init_app(app)
+    fragments.init_app(app)
+    assets.init_app(app)
+    archive.init_app(app)
+    activity_log.init_app(app)
+    integrity.init_app(app)
+    numbering.init_app(app)
+    reports.init_app(app)
+    replicas.init_app(app)
+    ratelimit.init_app(app)
+    recurring.init_app(app)
+    payments.init_app(app)
+    portal.init_app(app)
+    api.init_app(app)
+    webhooks.init_app(app)
+    schema.init_app(app)
+
+    for rule, options, view in _routes:
+        app.add_url_rule(rule, view_func=view, **options)
+    for code, handler in _error_handlers:
+        app.register_error_handler(code, handler)
+    return app
 
 # Helper utilities
 import re
 
 def generate_next_product_id():
-    existing_ids = [pid for (pid,) in db.session.query(Product.p_id).all()]
+    prefix = tenants.key_prefix(session['user_id'], 'P')
+    existing_ids = [pid for (pid,) in db.session.query(Product.p_id).filter(Product.p_id.startswith(prefix, autoescape=True)).all()]
     max_num = 0
     for pid in existing_ids:
-        m = re.match(r'^P(\d+)$', pid)
+        m = re.match(rf'^{re.escape(prefix)}(\d+)$', pid)
         if m:
             num = int(m.group(1))
             if num > max_num:
                 max_num = num
     while True:
         max_num += 1
-        candidate = f"P{max_num:03d}"
+        candidate = f"{prefix}{max_num:03d}"
         if candidate not in existing_ids:
             return candidate
 
@@ -42,12 +115,12 @@ def login_required(f):
         return f(*args, **kwargs)
     return decorated_function
 
-def role_required(role):
+def role_required(*roles):
     def decorator(f):
         from functools import wraps
         @wraps(f)
         def decorated_function(*args, **kwargs):
-            if 'user_role' not in session or session['user_role'] != role:
+            if 'user_role' not in session or session['user_role'] not in roles:
                 flash('Access denied. Insufficient permissions.', 'error')
                 return redirect(url_for('login'))
             return f(*args, **kwargs)
@@ -66,13 +139,34 @@ def log_activity(action_type, description):
         db.session.add(activity)
         db.session.commit()
 
-@app.route('/')
+def stale_form(obj):
+    """True if the submitted edit form was rendered from an older version of ``obj`` than the stored one"""
+    version = request.form.get('version', type=int)
+    return version is not None and version != obj.version_id
+
+def edit_conflict(obj, name, template, back):
+    """Show the edit form again with the stored values after someone else saved ``obj`` first (409)"""
+    db.session.rollback()
+    try:
+        db.session.refresh(obj)
+    except InvalidRequestError:
+        flash(f'This {name} was deleted while you were editing it', 'error')
+        return redirect(url_for(back))
+    flash(f'This {name} was changed by someone else while you were editing it. '
+          'The form now shows the saved values; make your changes again and save.', 'error')
+    return render_template(template, **{name: obj}), 409
+
+def dashboard_endpoint():
+    """The signed-in user's home page"""
+    return 'customer_dashboard' if session.get('user_role') == 'customer' else 'seller_dashboard'
+
+@route('/')
 def index():
     if 'user_id' in session:
-        return redirect(url_for('seller_dashboard'))
+        return redirect(url_for(dashboard_endpoint()))
     return redirect(url_for('login'))
 
-@app.route('/login', methods=['GET', 'POST'])
+@route('/login', methods=['GET', 'POST'])
 def login():
     if request.method == 'POST':
         email = request.form['email']
@@ -88,11 +182,22 @@ def login():
             session['user_role'] = 'seller'
             return redirect(url_for('seller_dashboard'))
         
+        # Otherwise a customer, with a record at one or more sellers
+        accounts = portal.find_accounts(email, password)
+        if accounts:
+            session.permanent = False
+            session['user_id'] = accounts[0].c_id
+            session['user_name'] = accounts[0].c_name
+            session['user_email'] = accounts[0].c_email
+            session['user_role'] = 'customer'
+            session['customer_accounts'] = [[customer.c_id, customer.s_id] for customer in accounts]
+            return redirect(url_for('customer_dashboard'))
+        
         flash('Invalid email or password', 'error')
     
     return render_template('auth/login.html')
 
-@app.route('/register', methods=['GET', 'POST'])
+@route('/register', methods=['GET', 'POST'])
 def register():
     if request.method == 'POST':
         name = request.form['name']
@@ -104,32 +209,23 @@ def register():
         
         try:
             if role == 'seller':
-                # Check if seller email already exists
-                existing_seller = Seller.query.filter_by(s_email=email).first()
-                if existing_seller:
+                # Create new seller; the unique email index turns away duplicates
+                seller_id = constraints.insert_numbered(Seller, 's_id', 'S', {
+                    's_name': name,
+                    's_email': email,
+                    's_address': address,
+                    's_phone': phone,
+                    'password': generate_password_hash(password)
+                }, unique=('s_email',))
+                if seller_id is None:
                     flash('Seller email already exists', 'error')
                     return render_template('auth/register.html')
-                
-                # Generate unique seller ID
-                seller_count = Seller.query.count()
-                seller_id = f"S{seller_count + 1:03d}"
-                
-                # Create new seller
-                seller = Seller(
-                    s_id=seller_id,
-                    s_name=name,
-                    s_email=email,
-                    s_address=address,
-                    s_phone=phone
-                )
-                seller.set_password(password)
-                db.session.add(seller)
                 db.session.commit()
                 
                 # Auto-login
-                session['user_id'] = seller.s_id
-                session['user_name'] = seller.s_name
-                session['user_email'] = seller.s_email
+                session['user_id'] = seller_id
+                session['user_name'] = name
+                session['user_email'] = email
                 session['user_role'] = 'seller'
                 
             
@@ -142,56 +238,49 @@ def register():
     
     return render_template('auth/register.html')
 
-@app.route('/logout')
+@route('/logout')
 def logout():
     session.clear()
     flash('You have been logged out', 'info')
     return redirect(url_for('login'))
 
-@app.route('/seller')
+@route('/seller')
 @login_required
 @role_required('seller')
+@read_replica
 def seller_dashboard():
     total_products = Product.query.filter_by(s_id=session['user_id']).count()
     total_customers = Customer.query.count()
-    total_invoices = Invoice.query.filter_by(s_id=session['user_id']).count()
-    paid_invoices_qs = Invoice.query.filter_by(s_id=session['user_id'], status='paid')
-    pending_invoices_qs = Invoice.query.filter_by(s_id=session['user_id'], status='pending')
-    overdue_invoices_qs = Invoice.query.filter_by(s_id=session['user_id'], status='overdue')
-    paid_invoices_count = paid_invoices_qs.count()
-    unpaid_invoices_count = pending_invoices_qs.count() + overdue_invoices_qs.count()
-    revenue_collected = sum(float(inv.amount) for inv in paid_invoices_qs.all())
-    revenue_due = sum(float(inv.amount) for inv in pending_invoices_qs.all()) + \
-                   sum(float(inv.amount) for inv in overdue_invoices_qs.all())
+    totals = payments.seller_totals(session['user_id'])
     
     # Get recent activities for this seller
-    recent_activities = Activity.query.filter_by(user_id=session['user_id']).order_by(Activity.timestamp.desc()).limit(5).all()
+    recent_activities = activity_log.recent(session['user_id'])
     
     stats = {
         'total_products': total_products,
         'total_customers': total_customers,
-        'total_invoices': total_invoices,
-        'paid_invoices': paid_invoices_count,
-        'unpaid_invoices': unpaid_invoices_count,
-        'revenue_collected': revenue_collected,
-        'revenue_due': revenue_due
+        'total_invoices': totals['total_invoices'],
+        'paid_invoices': totals['paid_invoices'],
+        'unpaid_invoices': totals['unpaid_invoices'],
+        'revenue_collected': float(totals['revenue_collected']),
+        'revenue_due': float(totals['revenue_due'])
     }
     
     return render_template('seller/dashboard.html', stats=stats, activities=recent_activities)
 
-@app.route('/seller/products')
+@route('/seller/products')
 @login_required
 @role_required('seller')
+@read_replica
 def seller_products():
     q = request.args.get('q', '').strip()
-    base_query = Product.query.filter_by(s_id=session['user_id'])
+    stmt = read_models.product_list_query(session['user_id'])
     if q:
-        products = base_query.filter(Product.p_name.ilike(f"%{q}%")).all()
-    else:
-        products = base_query.all()
+        stmt = stmt.filter(Product.p_name.ilike(f"%{q}%"))
+    products = read_models.product_rows(stmt)
     return render_template('seller/products.html', products=products, q=q)
 
-@app.route('/seller/products/add', methods=['GET', 'POST'])
+@route('/seller/products/add', methods=['GET', 'POST'])
 @login_required
 @role_required('seller')
 def add_product():
@@ -201,6 +290,7 @@ def add_product():
             price = Decimal(request.form['price'])
             description = request.form['description']
             stock = int(request.form['stock'])
+            tax_class = request.form.get('tax_class', 'standard')
             
             # Generate product ID safely (avoid duplicates)
             product_id = generate_next_product_id()
@@ -211,6 +301,7 @@ def add_product():
                 p_price=price,
                 p_description=description,
                 p_stock=stock,
+                tax_class=tax_class,
                 s_id=session['user_id']
             )
             
@@ -229,7 +320,7 @@ def add_product():
     
     return render_template('seller/add_product.html')
 
-@app.route('/seller/products/edit/<product_id>', methods=['GET', 'POST'])
+@route('/seller/products/edit/<product_id>', methods=['GET', 'POST'])
 @login_required
 @role_required('seller')
 def edit_product(product_id):
@@ -240,23 +331,28 @@ def edit_product(product_id):
         return redirect(url_for('seller_products'))
     
     if request.method == 'POST':
+        if stale_form(product):
+            return edit_conflict(product, 'product', 'seller/edit_product.html', 'seller_products')
         try:
             product.p_name = request.form['name']
             product.p_price = Decimal(request.form['price'])
             product.p_description = request.form['description']
             product.p_stock = int(request.form['stock'])
+            product.tax_class = request.form.get('tax_class', product.tax_class)
             
             db.session.commit()
             flash('Product updated successfully!', 'success')
             return redirect(url_for('seller_products'))
             
+        except StaleDataError:
+            return edit_conflict(product, 'product', 'seller/edit_product.html', 'seller_products')
         except Exception as e:
             db.session.rollback()
             flash('Failed to update product', 'error')
     
     return render_template('seller/edit_product.html', product=product)
 
-@app.route('/seller/products/delete/<product_id>')
+@route('/seller/products/delete/<product_id>')
 @login_required
 @role_required('seller')
 def delete_product(product_id):
@@ -266,10 +362,19 @@ def delete_product(product_id):
             flash('Product not found', 'error')
             return redirect(url_for('seller_products'))
         
-        # Check if product is referenced in any invoice items
-        invoice_items = InvoiceItem.query.filter_by(p_id=product_id).all()
-        if invoice_items:
-            flash(f'Cannot delete product "{product.name}" because it is referenced in {len(invoice_items)} invoice(s). Please delete the invoices first.', 'error')
+        # Check if product is referenced in any invoice items (one indexed query)
+        invoice_count, recurring = db.session.execute(select(
+            select(func.count(func.distinct(InvoiceItem.invoice_no))).where(InvoiceItem.p_id == product_id)
+            .scalar_subquery()
+            + select(func.count(func.distinct(ArchivedInvoiceItem.invoice_no))).where(ArchivedInvoiceItem.p_id == product_id)
+            .scalar_subquery(),
+            exists().where(RecurringInvoiceItem.p_id == product_id)
+        )).one()
+        if invoice_count:
+            flash(f'Cannot delete product "{product.name}" because it is referenced in {invoice_count} invoice(s). Please delete the invoices first.', 'error')
+            return redirect(url_for('seller_products'))
+        if recurring:
+            flash(f'Cannot delete product "{product.name}" because a recurring invoice bills it.', 'error')
             return redirect(url_for('seller_products'))
         
         db.session.delete(product)
@@ -282,7 +387,7 @@ def delete_product(product_id):
     
     return redirect(url_for('seller_products'))
 
-@app.route('/api/products/add', methods=['POST'])
+@route('/api/products/add', methods=['POST'])
 @login_required
 @role_required('seller')
 def api_add_product():
@@ -293,6 +398,7 @@ def api_add_product():
         price = Decimal(data.get('price', 0))
         description = data.get('description', '')
         stock = int(data.get('stock', 0))
+        tax_class = data.get('tax_class', 'standard')
         
         if not name or price <= 0:
             return jsonify({'success': False, 'error': 'Invalid product data'}), 400
@@ -306,6 +412,7 @@ def api_add_product():
             p_price=price,
             p_description=description,
             p_stock=stock,
+            tax_class=tax_class,
             s_id=session['user_id']
         )
         
@@ -324,31 +431,70 @@ def api_add_product():
         db.session.rollback()
         return jsonify({'success': False, 'error': 'Internal server error'}), 500
 
-@app.route('/seller/customers')
+@route('/seller/customers')
 @login_required
 @role_required('seller')
+@limited('search')
+@read_replica
 def seller_customers():
     # Show all customers with optional search by name
     q = request.args.get('q', '').strip()
-    base = Customer.query
+    stmt = read_models.customer_list_query()
     if q:
-        base = base.filter(Customer.c_name.ilike(f"%{q}%"))
-    customers = base.order_by(Customer.c_name.asc()).all()
+        stmt = stmt.filter(Customer.c_name.ilike(f"%{q}%"))
+    customers = read_models.customer_rows(stmt.order_by(Customer.c_name.asc()))
     return render_template('seller/customers.html', customers=customers, q=q)
 
-@app.route('/seller/customers/<customer_id>/invoices')
+@route('/seller/customers/<customer_id>/invoices')
 @login_required
 @role_required('seller')
+@read_replica
 def view_customer_invoices(customer_id):
-    customer = Customer.query.get(customer_id)
+    customer = read_models.get_customer(customer_id)
     if not customer:
         flash('Customer not found', 'error')
         return redirect(url_for('seller_customers'))
     
-    invoices = Invoice.query.filter_by(c_id=customer_id, s_id=session['user_id']).all()
+    invoices = read_models.customer_invoice_rows(
+        read_models.customer_invoice_list_query(session['user_id'], customer_id)
+    )
     return render_template('seller/customer_invoices.html', customer=customer, invoices=invoices)
 
-@app.route('/seller/customers/add', methods=['POST'])
+@route('/seller/statements')
+@route('/seller/customers/<customer_id>/statement')
+@login_required
+@role_required('seller')
+@limited('export')
+@read_replica
+def customer_statement(customer_id=None):
+    """Statement for one customer, or for every customer of the seller in one pass."""
+    today = date.today()
+    try:
+        start = datetime.strptime(request.args.get('start_date', ''), '%Y-%m-%d').date()
+    except ValueError:
+        start = today.replace(day=1)
+    try:
+        end = datetime.strptime(request.args.get('end_date', ''), '%Y-%m-%d').date()
+    except ValueError:
+        end = today
+
+    report = statements.build_statements(session['user_id'], start, end, customer_id)
+    lines = statements.statement_lines(session['user_id'], customer_id, start, end) if customer_id else None
+    filename = f"statement-{customer_id or 'all'}-{start:%Y%m%d}-{end:%Y%m%d}"
+
+    output = request.args.get('format', 'html')
+    if output == 'csv':
+        return Response(statements.statements_csv(report), mimetype='text/csv',
+                        headers={'Content-Disposition': f'attachment; filename={filename}.csv'})
+    if output == 'pdf':
+        pdf_file = statements.statements_pdf(report, start, end, lines)
+        return send_file(pdf_file, as_attachment=True, download_name=f'{filename}.pdf', mimetype='application/pdf')
+
+    customer = read_models.get_customer(customer_id) if customer_id else None
+    return render_template('seller/statement.html', statements=report, lines=lines, customer=customer,
+                           start_date=start.strftime('%Y-%m-%d'), end_date=end.strftime('%Y-%m-%d'))
+
+@route('/seller/customers/add', methods=['POST'])
 @login_required
 @role_required('seller')
 def add_customer():
@@ -358,26 +504,18 @@ def add_customer():
         phone = request.form['phone']
         address = request.form['address']
         
-        # Check if customer email already exists
-        existing_customer = Customer.query.filter_by(c_email=email).first()
-        if existing_customer:
+        # Create new customer; the unique (seller, email) index turns away duplicates
+        customer_id = constraints.insert_numbered(Customer, 'c_id', tenants.key_prefix(session['user_id'], 'C'), {
+            'c_name': name,
+            'c_email': email,
+            'c_phone_no': phone,
+            'c_address': address,
+            'password': '',  # Avoid DB default issues
+            's_id': session['user_id']
+        }, unique=('s_id', 'c_email'))
+        if customer_id is None:
             flash('Customer with this email already exists', 'error')
             return redirect(url_for('seller_customers'))
-        
-        # Generate customer ID
-        customer_count = Customer.query.count()
-        customer_id = f"C{customer_count + 1:03d}"
-        
-        # Create new customer
-        customer = Customer(
-            c_id=customer_id,
-            c_name=name,
-            c_email=email,
-            c_phone_no=phone,
-            c_address=address,
-            password=''  # Avoid DB default issues
-        )
-        db.session.add(customer)
         db.session.commit()
         
         # Log activity
@@ -391,7 +529,7 @@ def add_customer():
         flash('Failed to add customer', 'error')
         return redirect(url_for('seller_customers'))
 
-@app.route('/seller/customers/edit/<customer_id>', methods=['GET', 'POST'])
+@route('/seller/customers/edit/<customer_id>', methods=['GET', 'POST'])
 @login_required
 @role_required('seller')
 def edit_customer(customer_id):
@@ -401,23 +539,39 @@ def edit_customer(customer_id):
         return redirect(url_for('seller_customers'))
 
     if request.method == 'POST':
+        if stale_form(customer):
+            return edit_conflict(customer, 'customer', 'seller/edit_customer.html', 'seller_customers')
         try:
             customer.c_name = request.form.get('name', customer.c_name)
             customer.c_email = request.form.get('email', customer.c_email)
             customer.c_phone_no = request.form.get('phone', customer.c_phone_no)
             customer.c_address = request.form.get('address', customer.c_address)
+            if request.form.get('portal_password'):
+                customer.set_password(request.form['portal_password'])
+            elif request.form.get('revoke_portal'):
+                customer.set_password('')
             db.session.commit()
             log_activity('customer_updated', f'Updated customer "{customer.c_name}"')
             flash('Customer updated successfully!', 'success')
             return redirect(url_for('seller_customers'))
+        except IntegrityError as e:
+            db.session.rollback()
+            if constraints.violates_unique(e, Customer.c_email):
+                flash('Customer with this email already exists', 'error')
+            else:
+                flash('Failed to update customer', 'error')
+        except StaleDataError:
+            return edit_conflict(customer, 'customer', 'seller/edit_customer.html', 'seller_customers')
         except Exception:
             db.session.rollback()
             flash('Failed to update customer', 'error')
     return render_template('seller/edit_customer.html', customer=customer)
 
-@app.route('/seller/invoices')
+@route('/seller/invoices')
 @login_required
 @role_required('seller')
+@limited('search')
+@read_replica
 def seller_invoices():
     q = request.args.get('q', '').strip()
     customer_q = request.args.get('customer', '').strip()
@@ -426,50 +580,69 @@ def seller_invoices():
     end_date_str = request.args.get('end_date', '').strip()
     min_amount_str = request.args.get('min_amount', '').strip()
     max_amount_str = request.args.get('max_amount', '').strip()
+    payment = request.args.get('payment', '').strip()
 
-    query = Invoice.query.filter_by(s_id=session['user_id'])
+    include_archived = request.args.get('archived') == '1'
 
-    if q:
-        query = query.filter(Invoice.invoice_no.ilike(f"%{q}%"))
+    def apply_filters(query, inv):
+        if q:
+            query = query.filter(inv.invoice_no.ilike(f"%{q}%"))
 
-    if customer_q:
-        query = query.join(Customer).filter(
-            (Customer.c_name.ilike(f"%{customer_q}%")) | (Customer.c_email.ilike(f"%{customer_q}%"))
-        )
+        if customer_q:
+            query = query.filter(
+                (Customer.c_name.ilike(f"%{customer_q}%")) | (Customer.c_email.ilike(f"%{customer_q}%"))
+            )
 
-    if status:
-        query = query.filter(Invoice.status == status)
+        if status:
+            query = query.filter(inv.status == status)
 
-    # Date range filter (expects YYYY-MM-DD)
-    try:
-        if start_date_str:
-            start_dt = datetime.strptime(start_date_str, '%Y-%m-%d')
-            query = query.filter(Invoice.invoice_datetime >= start_dt)
-    except ValueError:
-        pass
+        # Date range filter (expects YYYY-MM-DD)
+        try:
+            if start_date_str:
+                start_dt = datetime.strptime(start_date_str, '%Y-%m-%d')
+                query = query.filter(inv.invoice_datetime >= start_dt)
+        except ValueError:
+            pass
 
-    try:
-        if end_date_str:
-            # include entire end day by adding one day and using < next day
-            end_dt = datetime.strptime(end_date_str, '%Y-%m-%d')
-            end_dt_inclusive = end_dt.replace(hour=23, minute=59, second=59, microsecond=999999)
-            query = query.filter(Invoice.invoice_datetime <= end_dt_inclusive)
-    except ValueError:
-        pass
+        try:
+            if end_date_str:
+                # include entire end day by adding one day and using < next day
+                end_dt = datetime.strptime(end_date_str, '%Y-%m-%d')
+                end_dt_inclusive = end_dt.replace(hour=23, minute=59, second=59, microsecond=999999)
+                query = query.filter(inv.invoice_datetime <= end_dt_inclusive)
+        except ValueError:
+            pass
 
-    # Amount range filter
-    try:
-        if min_amount_str:
-            query = query.filter(Invoice.amount >= Decimal(min_amount_str))
-    except Exception:
-        pass
-    try:
-        if max_amount_str:
-            query = query.filter(Invoice.amount <= Decimal(max_amount_str))
-    except Exception:
-        pass
+        # Amount range filter
+        try:
+            if min_amount_str:
+                query = query.filter(inv.amount >= Decimal(min_amount_str))
+        except Exception:
+            pass
+        try:
+            if max_amount_str:
+                query = query.filter(inv.amount <= Decimal(max_amount_str))
+        except Exception:
+            pass
 
-    invoices = query.order_by(Invoice.invoice_datetime.desc()).all()
+        # Payment progress, from the amount_paid rollup
+        if payment == 'unpaid':
+            query = query.filter(inv.amount_paid <= 0)
+        elif payment == 'partial':
+            query = query.filter(inv.amount_paid > 0, inv.amount_paid < inv.amount)
+        elif payment == 'settled':
+            query = query.filter(inv.amount_paid >= inv.amount)
+        return query
+
+    query = apply_filters(read_models.invoice_list_query(session['user_id']), Invoice)
+    if include_archived:
+        # Old paid invoices live in the archive tables; only search them on request
+        archived = apply_filters(read_models.archived_invoice_list_query(session['user_id']), ArchivedInvoice)
+        combined = query.union_all(archived).subquery()
+        query = select(combined).order_by(combined.c.invoice_datetime.desc())
+    else:
+        query = query.order_by(Invoice.invoice_datetime.desc())
+    invoices = read_models.invoice_rows(query)
     return render_template(
         'seller/invoices.html',
         invoices=invoices,
@@ -480,16 +653,19 @@ def seller_invoices():
         end_date=end_date_str,
         min_amount=min_amount_str,
         max_amount=max_amount_str,
+        payment=payment,
+        include_archived=include_archived,
     )
 
-@app.route('/seller/invoices/create', methods=['GET', 'POST'])
+@route('/seller/invoices/create', methods=['GET', 'POST'])
 @login_required
 @role_required('seller')
 def create_invoice():
     if request.method == 'POST':
         try:
             customer_id = request.form['customer_id']
-            tax = Decimal(request.form.get('tax', 0))
+            tax_region = request.form.get('tax_region') or None  # empty: tax entered by hand
+            currency = request.form.get('currency') or None
             
             # Check if this is a new customer being created
             if customer_id.startswith('temp_'):
@@ -499,28 +675,19 @@ def create_invoice():
                 customer_phone = request.form['temp_customer_phone']
                 customer_address = request.form['temp_customer_address']
                 
-                # Check if customer email already exists
-                existing_customer = Customer.query.filter_by(c_email=customer_email).first()
-                if existing_customer:
+                # The unique (seller, email) index turns away duplicates
+                customer_id = constraints.insert_numbered(Customer, 'c_id', tenants.key_prefix(session['user_id'], 'C'), {
+                    'c_name': customer_name,
+                    'c_email': customer_email,
+                    'c_phone_no': customer_phone,
+                    'c_address': customer_address,
+                    'password': '',  # Avoid DB default issues
+                    's_id': session['user_id']
+                }, unique=('s_id', 'c_email'))
+                if customer_id is None:
                     flash('Customer with this email already exists', 'error')
                     return redirect(url_for('create_invoice'))
                 
-                # Generate customer ID
-                customer_count = Customer.query.count()
-                customer_id = f"C{customer_count + 1:03d}"
-                
-                # Create new customer
-                customer = Customer(
-                    c_id=customer_id,
-                    c_name=customer_name,
-                    c_email=customer_email,
-                    c_phone_no=customer_phone,
-                    c_address=customer_address,
-                    password=''  # Avoid DB default issues
-                )
-                db.session.add(customer)
-                db.session.flush()  # Get the customer ID
-                
                 # Log activity
                 log_activity('customer_created', f'Created new customer "{customer_name}" during invoice creation')
             else:
@@ -529,10 +696,10 @@ def create_invoice():
                 if not customer:
                     flash('Customer not found', 'error')
                     return redirect(url_for('create_invoice'))
+                customer_name = customer.c_name
             
             # Process items
             items = []
-            subtotal = Decimal('0')
             
             item_indices = sorted(list(set([key.split('_')[1] for key in request.form if key.startswith('product_') and key.endswith('_id')]))) # noqa: E501
 
@@ -565,31 +732,35 @@ def create_invoice():
                     product = Product.query.get(product_id)
 
                 if product:
-                    item_total = (product.p_price * quantity) - discount
-                    subtotal += item_total
                     items.append({
                         'product': product,
                         'quantity': quantity,
-                        'discount': discount,
-                        'total': item_total
+                        'discount': discount
                     })
             
             if not items:
                 flash('Please add at least one item', 'error')
                 return redirect(url_for('create_invoice'))
             
-            total = subtotal + tax
+            totals = taxes.compute_totals(
+                [(item['product'].tax_class, item['product'].p_price, item['quantity'], item['discount']) for item in items],
+                tax_region,
+                currency
+            )
+            tax = totals.tax if tax_region else Decimal(request.form.get('tax', 0))
             
-            # Create invoice
-            invoice_count = Invoice.query.count()
-            invoice_id = f"INV-{invoice_count + 1:03d}"
+            # Create invoice; the number locks this seller's counter until the commit below
+            invoice_id = numbering.next_number(session['user_id'])
             
             new_invoice = Invoice(
                 invoice_no=invoice_id,
                 invoice_datetime=datetime.utcnow(),
                 status='pending',
                 tax=tax,
-                amount=total,
+                amount=totals.subtotal + tax,
+                currency=totals.currency,
+                exchange_rate=totals.exchange_rate,
+                tax_region=tax_region,
                 s_id=session['user_id'],
                 c_id=customer_id
             )
@@ -607,10 +778,11 @@ def create_invoice():
                 )
                 db.session.add(invoice_item)
             
+            webhooks.publish('invoice.created', [new_invoice])
             db.session.commit()
             
             # Log activity
-            log_activity('invoice_created', f'Created invoice {invoice_id} for {customer.c_name}')
+            log_activity('invoice_created', f'Created invoice {invoice_id} for {customer_name}')
             
             flash(f'Invoice {invoice_id} created successfully!', 'success')
             return redirect(url_for('seller_invoices'))
@@ -619,13 +791,12 @@ def create_invoice():
             db.session.rollback()
             flash('Failed to create invoice', 'error')
     
-    products = Product.query.filter_by(s_id=session['user_id']).all()
-    customers = Customer.query.all()
-    # Convert products to dictionaries for JSON serialization
-    products_data = [product.to_dict() for product in products]
-    return render_template('seller/create_invoice.html', products=products_data, customers=customers)
+    products_data = read_models.product_options(session['user_id'])
+    customers = read_models.customer_options()
+    return render_template('seller/create_invoice.html', products=products_data, customers=customers,
+                           rates=taxes.rate_tables())
 
-@app.route('/seller/invoices/edit/<invoice_id>', methods=['GET', 'POST'])
+@route('/seller/invoices/edit/<invoice_id>', methods=['GET', 'POST'])
 @login_required
 @role_required('seller')
 def edit_invoice(invoice_id):
@@ -636,37 +807,44 @@ def edit_invoice(invoice_id):
         return redirect(url_for('seller_invoices'))
     
     if request.method == 'POST':
+        if stale_form(invoice):
+            return edit_conflict(invoice, 'invoice', 'seller/edit_invoice.html', 'seller_invoices')
         try:
             # Update invoice status
             new_status = request.form.get('status', invoice.status)
             old_status = invoice.status
             invoice.status = new_status
             
-            # Update tax
-            invoice.tax = Decimal(request.form.get('tax', invoice.tax))
-            
             # Update discounts for each item
-            subtotal = Decimal('0')
             for item in invoice.invoice_items:
                 discount_key = f'discount_{item.item_id}'
                 if discount_key in request.form:
                     item.discount = Decimal(request.form[discount_key])
-                subtotal += (item.product.p_price * item.item_quantity) - item.discount
             
-            # Recalculate total
-            invoice.amount = subtotal + invoice.tax
+            # Recalculate totals at the rate the invoice was issued at
+            totals = taxes.compute_totals(
+                [(item.product.tax_class, item.product.p_price, item.item_quantity, item.discount)
+                 for item in invoice.invoice_items],
+                invoice.tax_region,
+                invoice.currency,
+                invoice.exchange_rate
+            )
+            if invoice.tax_region:
+                invoice.tax = totals.tax
+            else:
+                invoice.tax = Decimal(request.form.get('tax', invoice.tax))
+            invoice.amount = totals.subtotal + invoice.tax
             
-            # If status changed to 'paid', update product stock
-            if old_status != 'paid' and new_status == 'paid':
-                for item in invoice.invoice_items:
-                    product = item.product
-                    product.p_stock = max(0, product.p_stock - item.item_quantity)
+            # Keep stock and the payments ledger in step with the status
+            payments.adjust_stock(invoice, old_status, new_status)
+            if new_status == 'paid':
+                payments.settle(invoice)
+            elif old_status == 'paid':
+                payments.reverse(invoice)
             
-            # If status changed from 'paid' to something else, restore product stock
-            if old_status == 'paid' and new_status != 'paid':
-                for item in invoice.invoice_items:
-                    product = item.product
-                    product.p_stock = product.p_stock + item.item_quantity
+            webhooks.publish('invoice.updated', [invoice])
+            if new_status == 'paid' and old_status != 'paid':
+                webhooks.publish('invoice.paid', [invoice])
             
             db.session.commit()
             
@@ -676,130 +854,231 @@ def edit_invoice(invoice_id):
             flash('Invoice updated successfully!', 'success')
             return redirect(url_for('seller_invoices'))
             
+        except StaleDataError:
+            # Rolls back the stock and payment changes made above along with the invoice
+            return edit_conflict(invoice, 'invoice', 'seller/edit_invoice.html', 'seller_invoices')
         except Exception as e:
             db.session.rollback()
             flash('Failed to update invoice', 'error')
     
-    products = Product.query.filter_by(s_id=session['user_id']).all()
-    customers = Customer.query.all()
-    products_data = [product.to_dict() for product in products]
-    
-    return render_template('seller/edit_invoice.html', invoice=invoice, products=products_data, customers=customers)
+    return render_template('seller/edit_invoice.html', invoice=invoice)
+
+@route('/seller/recurring')
+@login_required
+@role_required('seller')
+def seller_recurring():
+    templates = (
+        RecurringInvoice.query.filter_by(s_id=session['user_id'])
+        .options(db.joinedload(RecurringInvoice.customer), db.selectinload(RecurringInvoice.items))
+        .order_by(RecurringInvoice.created_at.desc())
+        .all()
+    )
+    return render_template('seller/recurring.html', templates=templates)
+
+@route('/seller/invoices/<invoice_id>/recurring', methods=['POST'])
+@login_required
+@role_required('seller')
+def make_recurring(invoice_id):
+    invoice = archive.find_invoice(invoice_id)
+    if not invoice or invoice.s_id != session['user_id']:
+        flash('Invoice not found', 'error')
+        return redirect(url_for('seller_invoices'))
+
+    try:
+        interval_months = int(request.form.get('interval_months', 1))
+        day_of_month = int(request.form.get('day_of_month', 1))
+        if interval_months not in (1, 3, 12) or not 1 <= day_of_month <= 28:
+            raise ValueError('invalid schedule')
+
+        template = RecurringInvoice(
+            s_id=invoice.s_id,
+            c_id=invoice.c_id,
+            tax=invoice.tax,
+            interval_months=interval_months,
+            day_of_month=day_of_month,
+            start_date=date.today()
+        )
+        for item in invoice.invoice_items:
+            template.items.append(RecurringInvoiceItem(
+                p_id=item.p_id,
+                item_quantity=item.item_quantity,
+                discount=item.discount
+            ))
+        db.session.add(template)
+        db.session.commit()
+
+        log_activity('recurring_created', f'Set up recurring billing from invoice {invoice_id} ({template.schedule})')
+        flash('Recurring invoice created. It will be billed from the next scheduled date.', 'success')
+        return redirect(url_for('seller_recurring'))
+
+    except Exception:
+        db.session.rollback()
+        flash('Failed to create recurring invoice', 'error')
+        return redirect(url_for('view_invoice', invoice_id=invoice_id))
+
+@route('/seller/recurring/<int:recurring_id>/toggle', methods=['POST'])
+@login_required
+@role_required('seller')
+def toggle_recurring(recurring_id):
+    template = RecurringInvoice.query.filter_by(id=recurring_id, s_id=session['user_id']).first()
+    if not template:
+        flash('Recurring invoice not found', 'error')
+        return redirect(url_for('seller_recurring'))
+
+    template.active = not template.active
+    db.session.commit()
+    flash('Recurring invoice resumed' if template.active else 'Recurring invoice paused', 'success')
+    return redirect(url_for('seller_recurring'))
 
 
-@app.route('/invoice/<invoice_id>')
+@route('/seller/reports')
 @login_required
 @role_required('seller')
+def seller_reports():
+    # Read from the nightly Parquet export only, never from the database
+    exporting = reports.refresh_if_stale()
+    return render_template('seller/reports.html', report=reports.seller_report(session['user_id']),
+                           pyarrow_available=reports.available(), exporting=exporting)
+
+@route('/customer')
+@login_required
+@role_required('customer')
+@read_replica
+def customer_dashboard():
+    # Served from the customer_summaries read model, never by aggregating invoices
+    stats, invoices = portal.dashboard()
+    return render_template('customer/dashboard.html', stats=stats, invoices=invoices)
+
+@route('/customer/invoices')
+@login_required
+@role_required('customer')
+@read_replica
+def customer_invoices():
+    return render_template('customer/invoices.html', invoices=portal.invoices())
+
+@route('/invoice/<invoice_id>')
+@login_required
+@role_required('seller', 'customer')
+@read_replica
 def view_invoice(invoice_id):
-    invoice = Invoice.query.get(invoice_id)
+    if session['user_role'] == 'customer':
+        invoice = portal.customer_invoice(invoice_id)
+    else:
+        invoice = archive.find_invoice(invoice_id)
     
     if not invoice:
         flash('Invoice not found', 'error')
-        return redirect(url_for('seller_dashboard'))
+        return redirect(url_for(dashboard_endpoint()))
     
     # Check if seller has access to this invoice
-    if invoice.s_id != session['user_id']:
+    if session['user_role'] == 'seller' and invoice.s_id != session['user_id']:
         flash('Access denied', 'error')
         return redirect(url_for('seller_dashboard'))
     
-    return render_template('invoice/view.html', invoice=invoice)
+    return render_template('invoice/view.html', invoice=invoice,
+                           payments=payments.invoice_payments(invoice.invoice_no))
+
+
+@route('/seller/invoices/<invoice_id>/payments', methods=['POST'])
+@login_required
+@role_required('seller')
+def record_payment(invoice_id):
+    invoice = Invoice.query.filter_by(invoice_no=invoice_id, s_id=session['user_id']).first()
+    if not invoice:
+        flash('Invoice not found', 'error')
+        return redirect(url_for('seller_invoices'))
+
+    try:
+        amount = Decimal(request.form.get('amount', '0')).quantize(Decimal('0.01'))
+        if amount <= 0:
+            raise ValueError('amount must be positive')
+        paid_on = request.form.get('paid_on', '').strip()
+        payments.record_payments(session['user_id'], [{
+            'invoice_no': invoice.invoice_no,
+            'amount': amount,
+            'paid_at': datetime.strptime(paid_on, '%Y-%m-%d') if paid_on else None,
+            'method': 'manual',
+            'reference': request.form.get('reference', '').strip() or None,
+        }])
+        db.session.commit()
+
+        log_activity('payment_recorded', f'Recorded payment of {taxes.format_money(amount, invoice.currency)} for invoice {invoice_id}')
+        flash('Payment recorded', 'success')
+    except StaleDataError:
+        db.session.rollback()
+        flash('The invoice was updated while the payment was being recorded. Please record it again.', 'error')
+    except Exception:
+        db.session.rollback()
+        flash('Failed to record payment', 'error')
+    return redirect(url_for('view_invoice', invoice_id=invoice_id))
 
 
-@app.route('/invoice/<invoice_id>/download')
+@route('/seller/payments/reconcile', methods=['GET', 'POST'])
 @login_required
 @role_required('seller')
+def reconcile_payments():
+    result = None
+    if request.method == 'POST':
+        upload = request.files.get('statement')
+        if not upload or not upload.filename:
+            flash('Choose a bank statement CSV to upload', 'error')
+            return redirect(url_for('reconcile_payments'))
+        try:
+            lines, errors = payments.parse_bank_csv(upload.read().decode('utf-8-sig'))
+            matched, unmatched, duplicates = payments.reconcile(session['user_id'], lines)
+            db.session.commit()
+        except StaleDataError:
+            db.session.rollback()
+            flash('Some of these invoices were updated during the import, so nothing was recorded. '
+                  'Please upload the statement again.', 'error')
+            return redirect(url_for('reconcile_payments'))
+        except Exception:
+            db.session.rollback()
+            flash('Failed to import bank statement', 'error')
+            return redirect(url_for('reconcile_payments'))
+
+        if matched:
+            log_activity('payments_reconciled', f'Matched {len(matched)} bank payment(s) from {upload.filename}')
+        result = {'matched': matched, 'unmatched': unmatched, 'duplicates': duplicates, 'errors': errors}
+    return render_template('seller/reconcile.html', result=result)
+
+
+@route('/invoice/<invoice_id>/download')
+@login_required
+@role_required('seller', 'customer')
+@limited('pdf')
+@read_replica
 def download_invoice(invoice_id):
-    """Generate a simple PDF of the invoice and prompt download."""
+    """Generate a PDF of the invoice and stream it as a download."""
     try:
-        from reportlab.lib.pagesizes import A4
-        from reportlab.pdfgen import canvas
-        from reportlab.lib.units import mm
-        from reportlab.lib import colors
+        from invoice_pdf import render_invoice_pdf
     except Exception:
         flash('PDF generation dependency missing. Please install reportlab.', 'error')
         return redirect(url_for('view_invoice', invoice_id=invoice_id))
 
-    invoice = Invoice.query.get(invoice_id)
-    if not invoice or invoice.s_id != session.get('user_id'):
-        flash('Invoice not found or access denied', 'error')
-        return redirect(url_for('seller_invoices'))
-
-    buffer = io.BytesIO()
-    pdf = canvas.Canvas(buffer, pagesize=A4)
-    width, height = A4
-
-    y = height - 30 * mm
-    pdf.setFont('Helvetica-Bold', 16)
-    pdf.drawString(20 * mm, y, f'Invoice #{invoice.invoice_no}')
-    y -= 10 * mm
+    if session['user_role'] == 'customer':
+        invoice = portal.customer_invoice(invoice_id)
+        if not invoice:
+            flash('Invoice not found or access denied', 'error')
+            return redirect(url_for('customer_invoices'))
+    else:
+        invoice = archive.find_invoice(invoice_id)
+        if not invoice or invoice.s_id != session.get('user_id'):
+            flash('Invoice not found or access denied', 'error')
+            return redirect(url_for('seller_invoices'))
 
-    pdf.setFont('Helvetica', 11)
-    pdf.drawString(20 * mm, y, f'Date: {invoice.invoice_datetime.strftime("%Y-%m-%d %H:%M")}')
-    y -= 6 * mm
     customer = Customer.query.get(invoice.c_id)
-    if customer:
-        pdf.drawString(20 * mm, y, f'Bill To: {customer.c_name}  <{customer.c_email}>')
-        y -= 10 * mm
-
-    # Table headers
-    pdf.setFont('Helvetica-Bold', 11)
-    pdf.drawString(20 * mm, y, 'Product')
-    pdf.drawString(100 * mm, y, 'Qty')
-    pdf.drawString(120 * mm, y, 'Price (₹)')
-    pdf.drawString(155 * mm, y, 'Total (₹)')
-    y -= 5 * mm
-    pdf.setStrokeColor(colors.black)
-    pdf.line(20 * mm, y, 190 * mm, y)
-    y -= 6 * mm
-
-    pdf.setFont('Helvetica', 11)
-    subtotal = Decimal('0')
-    for item in invoice.invoice_items:
-        product = item.product
-        price = product.p_price
-        line_total = (price * item.item_quantity) - item.discount
-        subtotal += line_total
-        pdf.drawString(20 * mm, y, f'{product.p_name}')
-        pdf.drawRightString(115 * mm, y, str(item.item_quantity))
-        pdf.drawRightString(145 * mm, y, f'{price:.2f}')
-        pdf.drawRightString(190 * mm, y, f'{line_total:.2f}')
-        y -= 6 * mm
-        if y < 40 * mm:
-            pdf.showPage()
-            y = height - 20 * mm
-
-    # Summary
-    y -= 4 * mm
-    pdf.line(120 * mm, y, 190 * mm, y)
-    y -= 8 * mm
-    pdf.setFont('Helvetica-Bold', 12)
-    pdf.drawRightString(170 * mm, y, 'Subtotal:')
-    pdf.setFont('Helvetica', 12)
-    pdf.drawRightString(190 * mm, y, f'{subtotal:.2f}')
-    y -= 6 * mm
-    pdf.setFont('Helvetica-Bold', 12)
-    pdf.drawRightString(170 * mm, y, 'Tax:')
-    pdf.setFont('Helvetica', 12)
-    pdf.drawRightString(190 * mm, y, f'{invoice.tax:.2f}')
-    y -= 8 * mm
-    pdf.setFont('Helvetica-Bold', 13)
-    pdf.drawRightString(170 * mm, y, 'Total:')
-    pdf.setFont('Helvetica-Bold', 13)
-    pdf.drawRightString(190 * mm, y, f'{invoice.amount:.2f}')
-
-    pdf.showPage()
-    pdf.save()
-
-    buffer.seek(0)
+    pdf_file = render_invoice_pdf(invoice, customer)
     filename = f"{invoice.invoice_no}.pdf"
-    return send_file(buffer, as_attachment=True, download_name=filename, mimetype='application/pdf')
+    return send_file(pdf_file, as_attachment=True, download_name=filename, mimetype='application/pdf')
 
-@app.errorhandler(500)
+@errorhandler(500)
 def handle_internal_error(error):
     flash('An unexpected error occurred. Please try again later.', 'error')
-    return redirect(url_for('seller_dashboard'))
+    return redirect(url_for(dashboard_endpoint()))
 
 if __name__ == '__main__':
+    app = create_app()
     with app.app_context():
-        db.create_all()
+        schema.upgrade_database()
     app.run(debug=False, host='0.0.0.0', port=5000)
\ No newline at end of file
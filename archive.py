@@ -0,0 +1,77 @@
+"""Invoice history archive.
+
+Paid invoices older than ``ARCHIVE_AFTER_DAYS`` are moved, together with
+their items, from ``invoices``/``invoice_items`` into ``invoices_archive``/
+``invoice_items_archive``. Each batch is copied and deleted with set-based
+``INSERT ... SELECT``/``DELETE`` statements in its own transaction, so the
+hot tables (and their indexes) only ever hold recent or open invoices. The
+same transaction leaves an ``archived`` tombstone per invoice, so sync
+clients (see changes.py) learn that it left the live set.
+
+Run it from cron or a scheduled job:
+
+    flask --app app archive-invoices --days 365
+"""
+from datetime import datetime, timedelta
+
+import click
+from sqlalchemy import delete, insert, literal, select, true
+
+from models import db, Invoice, InvoiceItem, ArchivedInvoice, ArchivedInvoiceItem, Tombstone
+
+INVOICE_COLUMNS = ('invoice_no', 'invoice_datetime', 'status', 'tax', 'amount', 'amount_paid', 'currency',
+                   'exchange_rate', 'tax_region', 's_id', 'c_id')
+ITEM_COLUMNS = ('item_id', 'invoice_no', 'p_id', 'item_quantity', 'discount')
+
+
+def archive_paid_invoices(older_than_days, batch_size=1000):
+    """Move paid invoices older than ``older_than_days`` into the archive tables.
+
+    Returns the number of invoices moved.
+    """
+    cutoff = datetime.utcnow() - timedelta(days=older_than_days)
+    moved = 0
+    while True:
+        numbers = list(db.session.execute(
+            select(Invoice.invoice_no)
+            .where(Invoice.status == 'paid', Invoice.invoice_datetime < cutoff)
+            .limit(batch_size)
+        ).scalars())
+        if not numbers:
+            break
+
+        db.session.execute(insert(ArchivedInvoice).from_select(
+            INVOICE_COLUMNS,
+            select(*[getattr(Invoice, c) for c in INVOICE_COLUMNS]).where(Invoice.invoice_no.in_(numbers)),
+        ))
+        db.session.execute(insert(ArchivedInvoiceItem).from_select(
+            ITEM_COLUMNS,
+            select(*[getattr(InvoiceItem, c) for c in ITEM_COLUMNS]).where(InvoiceItem.invoice_no.in_(numbers)),
+        ))
+        db.session.execute(insert(Tombstone).from_select(
+            ['resource', 'key', 's_id', 'deleted_at', 'archived'],
+            select(literal('invoice'), Invoice.invoice_no, Invoice.s_id, literal(datetime.utcnow()), true())
+            .where(Invoice.invoice_no.in_(numbers)),
+        ))
+        db.session.execute(delete(InvoiceItem).where(InvoiceItem.invoice_no.in_(numbers)))
+        db.session.execute(delete(Invoice).where(Invoice.invoice_no.in_(numbers)))
+        db.session.commit()
+        moved += len(numbers)
+    return moved
+
+
+def find_invoice(invoice_no):
+    """Look up an invoice in the hot table first, then in the archive."""
+    return db.session.get(Invoice, invoice_no) or db.session.get(ArchivedInvoice, invoice_no)
+
+
+def init_app(app):
+    @app.cli.command('archive-invoices')
+    @click.option('--days', type=int, default=None, help='Archive paid invoices older than this many days.')
+    @click.option('--batch-size', type=int, default=1000, show_default=True)
+    def archive_invoices_command(days, batch_size):
+        """Move old paid invoices into the archive tables."""
+        if days is None:
+            days = app.config['ARCHIVE_AFTER_DAYS']
+        moved = archive_paid_invoices(days, batch_size)
+        click.echo(f"Archived {moved} invoice(s) older than {days} days.")
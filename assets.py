@@ -0,0 +1,216 @@
+"""Static asset pipeline.
+
+``flask --app app build-assets`` reads the stylesheets and scripts under
+``static/`` and writes ``static/dist/``:
+
+- a minified copy of each, named by its content hash (``css/style.3f2a9c1e0b.css``)
+- ``.gz`` and ``.br`` siblings, compressed once at build time (``.br`` needs the
+  optional ``brotli`` package)
+- ``manifest.json``, mapping each source path to its built file
+- ``critical.css``, the rules the page shell in ``base.html`` needs. It is
+  inlined in ``<head>`` so the first paint doesn't wait for the stylesheet.
+
+With a build present, ``url_for('static', filename='css/style.css')`` returns
+the hashed file. Hashed files never change, so they are served with
+``Cache-Control: public, max-age=31536000, immutable`` and browsers stop
+asking for them until the next deploy changes the hash. The precompressed
+variant matching the request's ``Accept-Encoding`` is sent as is. Without a
+build, the source files are served unchanged.
+"""
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import posixpath
+import re
+import shutil
+
+import click
+from flask import request, send_from_directory
+
+DIST = 'dist'
+SOURCE_EXTENSIONS = ('.css', '.js')
+ONE_YEAR = 365 * 24 * 3600
+
+# Selectors every page needs before first paint, whatever base.html contains
+ALWAYS_CRITICAL = {'*', 'html', 'body', ':root'}
+
+
+def minify_css(css):
+    css = re.sub(r'/\*.*?\*/', '', css, flags=re.S)
+    css = re.sub(r'\s+', ' ', css)
+    css = re.sub(r'\s*([{};,>])\s*', r'\1', css)
+    css = re.sub(r':\s+', ':', css)
+    return css.replace(';}', '}').strip()
+
+
+def minify_js(js):
+    """Drop indentation, blank lines and whole-line ``//`` comments. Line breaks stay, so ASI is untouched."""
+    lines = (line.strip() for line in js.splitlines())
+    return '\n'.join(line for line in lines if line and not line.startswith('//')) + '\n'
+
+
+MINIFIERS = {'.css': minify_css, '.js': minify_js}
+
+
+def _split_rules(css):
+    """Top-level ``(prelude, body)`` pairs of minified CSS."""
+    rules, depth, start, prelude = [], 0, 0, None
+    for position, char in enumerate(css):
+        if char == '{':
+            if depth == 0:
+                prelude, start = css[start:position], position + 1
+            depth += 1
+        elif char == '}':
+            depth -= 1
+            if depth == 0:
+                rules.append((prelude, css[start:position]))
+                start = position + 1
+    return rules
+
+
+def _shell_names(html):
+    """Tags, classes and ids that appear in a template (ignoring the Jinja inside attributes)."""
+    html = re.sub(r'{%.*?%}|{{.*?}}', ' ', html, flags=re.S)
+    classes = {name for value in re.findall(r'class="([^"]*)"', html) for name in value.split()}
+    ids = set(re.findall(r'id="([^"]*)"', html))
+    tags = {tag.lower() for tag in re.findall(r'<([a-zA-Z][a-zA-Z0-9]*)', html)}
+    return tags | ALWAYS_CRITICAL, classes, ids
+
+
+def _selector_needed(selector, names):
+    tags, classes, ids = names
+    if selector.strip() in ALWAYS_CRITICAL:
+        return True
+    selector = re.sub(r'::?[\w-]+(\([^)]*\))?', '', selector)  # pseudo-classes don't change what matches
+    wanted_classes = re.findall(r'\.([\w-]+)', selector)
+    wanted_ids = re.findall(r'#([\w-]+)', selector)
+    wanted_tags = re.findall(r'(?:^|[\s>+~])([a-z][a-z0-9]*)', selector)
+    if not (wanted_classes or wanted_ids or wanted_tags):
+        return False
+    return (all(name in classes for name in wanted_classes) and all(name in ids for name in wanted_ids)
+            and all(tag in tags for tag in wanted_tags))
+
+
+def critical_css(css, html):
+    """The rules of minified ``css`` that can match something in ``html``."""
+    names = _shell_names(html)
+    kept = []
+    for prelude, body in _split_rules(css):
+        if prelude.startswith('@media'):
+            inner = critical_css(body, html)
+            if inner:
+                kept.append(f'{prelude}{{{inner}}}')
+        elif not prelude.startswith('@') and any(_selector_needed(part, names) for part in prelude.split(',')):
+            kept.append(f'{prelude}{{{body}}}')
+    return ''.join(kept)
+
+
+def _compressors():
+    compressors = {'.gz': lambda data: gzip.compress(data, compresslevel=9, mtime=0)}
+    try:
+        import brotli
+    except ImportError:
+        return compressors
+    compressors['.br'] = lambda data: brotli.compress(data, quality=11)
+    return compressors
+
+
+def build(static_folder, shell_template):
+    """Write ``static/dist``. Returns the manifest."""
+    dist = os.path.join(static_folder, DIST)
+    shutil.rmtree(dist, ignore_errors=True)
+    compressors = _compressors()
+    manifest, stylesheets = {}, []
+    for root, dirs, files in os.walk(static_folder):
+        dirs[:] = sorted(d for d in dirs if os.path.join(root, d) != dist)
+        for name in sorted(files):
+            stem, extension = os.path.splitext(name)
+            if extension not in SOURCE_EXTENSIONS:
+                continue
+            source = os.path.relpath(os.path.join(root, name), static_folder).replace(os.sep, '/')
+            with open(os.path.join(root, name), encoding='utf-8') as f:
+                minified = MINIFIERS[extension](f.read())
+            data = minified.encode('utf-8')
+            digest = hashlib.sha256(data).hexdigest()[:10]
+            built = posixpath.join(DIST, posixpath.dirname(source), f'{stem}.{digest}{extension}')
+            path = os.path.join(static_folder, built)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'wb') as f:
+                f.write(data)
+            for suffix, compress in compressors.items():
+                with open(path + suffix, 'wb') as f:
+                    f.write(compress(data))
+            manifest[source] = built
+            if extension == '.css':
+                stylesheets.append(minified)
+
+    with open(shell_template, encoding='utf-8') as f:
+        shell = f.read()
+    with open(os.path.join(dist, 'critical.css'), 'w', encoding='utf-8') as f:
+        f.write(''.join(critical_css(css, shell) for css in stylesheets))
+    with open(os.path.join(dist, 'manifest.json'), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    return manifest
+
+
+class Assets:
+    """The built manifest and critical CSS, read once when the app is created."""
+
+    def __init__(self, static_folder):
+        self.static_folder = static_folder
+        dist = os.path.join(static_folder, DIST)
+        try:
+            with open(os.path.join(dist, 'manifest.json'), encoding='utf-8') as f:
+                self.manifest = json.load(f)
+            with open(os.path.join(dist, 'critical.css'), encoding='utf-8') as f:
+                self.critical_css = f.read()
+        except FileNotFoundError:
+            self.manifest, self.critical_css = {}, ''
+        # built file -> {'br': 'x.css.br', 'gzip': 'x.css.gz'}
+        self.encoded = {
+            built: {encoding: built + suffix for encoding, suffix in (('br', '.br'), ('gzip', '.gz'))
+                    if os.path.exists(os.path.join(static_folder, built + suffix))}
+            for built in self.manifest.values()
+        }
+
+    def send(self, filename):
+        """Serve a hashed file, precompressed when the client accepts it."""
+        variants = self.encoded.get(filename, {})
+        encoding = next((name for name in ('br', 'gzip') if name in variants and request.accept_encodings[name]), None)
+        mimetype = mimetypes.guess_type(filename)[0]
+        response = send_from_directory(self.static_folder, variants[encoding] if encoding else filename,
+                                       mimetype=mimetype, max_age=ONE_YEAR)
+        if encoding:
+            response.content_encoding = encoding
+        response.vary.add('Accept-Encoding')
+        response.cache_control.public = True
+        response.cache_control.immutable = True
+        return response
+
+
+def init_app(app):
+    app.extensions['assets'] = Assets(app.static_folder)
+    app.jinja_env.globals['critical_css'] = app.extensions['assets'].critical_css
+
+    @app.url_defaults
+    def hashed_static_url(endpoint, values):
+        manifest = app.extensions['assets'].manifest
+        if endpoint == 'static' and values.get('filename') in manifest:
+            values['filename'] = manifest[values['filename']]
+
+    def static(filename):
+        assets = app.extensions['assets']
+        if filename in assets.encoded:
+            return assets.send(filename)
+        return app.send_static_file(filename)
+
+    app.view_functions['static'] = static
+
+    @app.cli.command('build-assets')
+    def build_assets_command():
+        """Minify, fingerprint and precompress static/ into static/dist."""
+        manifest = build(app.static_folder, os.path.join(app.root_path, app.template_folder, 'base.html'))
+        for source, built in sorted(manifest.items()):
+            click.echo(f'{source} -> {built}')
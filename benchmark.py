@@ -0,0 +1,812 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmarks for the Invoice Management System.
+
+Each benchmark seeds a throwaway SQLite database, so it never touches
+invoice.db. Run one by name:
+
+    python benchmark.py listing_render [rows]
+    python benchmark.py listing_memory [rows]
+    python benchmark.py recurring_generate [templates]
+    python benchmark.py pdf_memory [lines]
+    python benchmark.py startup [runs]
+    python benchmark.py unique_inserts [threads]
+    python benchmark.py tenant_pages [other_customers]
+    python benchmark.py admission [noisy_threads] [seconds]
+    python benchmark.py assets
+    python benchmark.py compression [rows] [mbps]
+    python benchmark.py integrity [rows] [workers]
+    python benchmark.py concurrent_edits [threads]
+    python benchmark.py activity_log [rows] [months]
+    python benchmark.py drafts [lines] [threads]
+    python benchmark.py reports [rows]
+    python benchmark.py numbering [rows] [threads] [per_thread]
+    python benchmark.py portal [rows] [customers]
+"""
+
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+
+# Point the app at a scratch database before it is imported
+_tmpdir = tempfile.mkdtemp(prefix='invoice-bench-')
+os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(_tmpdir, 'bench.db')}"
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from app import create_app, db
+from sqlalchemy import event, func, select, text
+
+from models import Seller, Customer, Product, Invoice, InvoiceItem, RecurringInvoice, RecurringInvoiceItem
+import read_models
+import recurring
+
+SELLER_ID = 'S001'
+app = create_app()
+
+
+def seed(invoice_count, customer_count=None, product_count=50):
+    """Insert one seller plus the requested number of customers, products and invoices."""
+    customer_count = customer_count or max(1, invoice_count // 10)
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        seller = Seller(s_id=SELLER_ID, s_name='Bench Seller', s_email='bench@example.com',
+                        s_address='1 Bench Road', s_phone='000')
+        seller.set_password('password')
+        db.session.add(seller)
+        db.session.bulk_insert_mappings(Customer, [
+            {'c_id': f'C{i:06d}', 'c_name': f'Customer {i}', 'c_email': f'c{i}@example.com',
+             'c_phone_no': '555-0000', 'c_address': 'Somewhere ' * 20, 'password': '', 's_id': SELLER_ID}
+            for i in range(customer_count)
+        ])
+        db.session.bulk_insert_mappings(Product, [
+            {'p_id': f'P{i:03d}', 'p_name': f'Product {i}', 'p_price': Decimal('10.00') + i,
+             'p_description': 'Description ' * 20, 'p_stock': 100, 's_id': SELLER_ID}
+            for i in range(product_count)
+        ])
+        start = datetime(2024, 1, 1)
+        db.session.bulk_insert_mappings(Invoice, [
+            {'invoice_no': f'INV-{i:06d}', 'invoice_datetime': start + timedelta(hours=i),
+             'status': ('paid', 'pending', 'overdue')[i % 3], 'tax': Decimal('1.00'),
+             'amount': Decimal('11.00') + (i % product_count), 's_id': SELLER_ID,
+             'c_id': f'C{i % customer_count:06d}'}
+            for i in range(invoice_count)
+        ])
+        db.session.bulk_insert_mappings(InvoiceItem, [
+            {'invoice_no': f'INV-{i:06d}', 'p_id': f'P{i % product_count:03d}',
+             'item_quantity': 1, 'discount': Decimal('0')}
+            for i in range(invoice_count)
+        ])
+        db.session.commit()
+
+
+def timed(label, fn, repeat=3):
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    print(f"   {label:<40} {best * 1000:10.1f} ms")
+    return best
+
+
+# The invoice table body as it was rendered before read models: one ORM
+# entity per row, with customer_name/date resolved through model properties.
+LEGACY_INVOICE_ROWS = '''
+{% for invoice in invoices %}
+<tr>
+    <td><div class="invoice-id"><strong>{{ invoice.id }}</strong></div></td>
+    <td>
+        <div class="customer-info">
+            <div class="customer-name">{{ invoice.customer_name }}</div>
+            <div class="customer-email">{{ invoice.customer_email }}</div>
+        </div>
+    </td>
+    <td><div class="date-info"><i class="fas fa-calendar"></i> {{ invoice.date }}</div></td>
+    <td><div class="amount-info">₹{{ "%.2f"|format(invoice.amount) }}</div></td>
+    <td><span class="status-badge status-{{ invoice.status }}">{{ invoice.status.title() }}</span></td>
+    <td>
+        <div class="action-buttons">
+            <a href="{{ url_for('view_invoice', invoice_id=invoice.id) }}" class="btn btn-outline btn-sm"><i class="fas fa-eye"></i></a>
+            {% if invoice.status != 'paid' %}
+            <a href="{{ url_for('edit_invoice', invoice_id=invoice.id) }}" class="btn btn-primary btn-sm"><i class="fas fa-edit"></i></a>
+            {% endif %}
+            <a href="{{ url_for('download_invoice', invoice_id=invoice.id) }}" class="btn btn-success btn-sm"><i class="fas fa-download"></i></a>
+        </div>
+    </td>
+</tr>
+{% endfor %}
+'''
+
+
+def bench_listing_render(rows=5000):
+    """ORM entities through the legacy loop vs. projected rows with cached fragments."""
+    rows = int(rows)
+    print(f"Invoice listing render, {rows} rows")
+    seed(rows)
+    legacy = app.jinja_env.from_string(LEGACY_INVOICE_ROWS)
+    cache = app.extensions['row_fragments']
+
+    def orm_path():
+        db.session.expunge_all()
+        invoices = Invoice.query.filter_by(s_id=SELLER_ID).order_by(Invoice.invoice_datetime.desc()).all()
+        legacy.render(invoices=invoices)
+
+    def projected(clear):
+        def run():
+            if clear:
+                cache.clear()
+            stmt = read_models.invoice_list_query(SELLER_ID).order_by(Invoice.invoice_datetime.desc())
+            app.jinja_env.globals['render_rows']('seller/_invoice_row.html', read_models.invoice_rows(stmt))
+        return run
+
+    with app.test_request_context():
+        base = timed('ORM entities + legacy loop', orm_path)
+        cold = timed('projection + row partial (cold cache)', projected(True))
+        warm = timed('projection + row partial (warm cache)', projected(False))
+    print(f"   speedup: {base / cold:.1f}x cold, {base / warm:.1f}x warm")
+
+
+def bench_listing_memory(rows=100000):
+    """Peak memory and time to load the customer listing as entities vs. read-model rows."""
+    rows = int(rows)
+    print(f"Customer listing hydration, {rows} rows")
+    seed(0, customer_count=rows)
+
+    def measure(label, load):
+        db.session.expunge_all()
+        tracemalloc.start()
+        started = time.perf_counter()
+        result = load()
+        elapsed = time.perf_counter() - started
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print(f"   {label:<40} {elapsed * 1000:10.1f} ms {peak / 1024 / 1024:10.1f} MiB peak"
+              f" ({peak / len(result):.0f} B/row)")
+        return peak
+
+    with app.app_context():
+        orm = measure('Customer.query.all()', lambda: Customer.query.order_by(Customer.c_name.asc()).all())
+        rows_peak = measure('read_models.customer_rows()', lambda: read_models.customer_rows(
+            read_models.customer_list_query().order_by(Customer.c_name.asc())))
+        options = measure('read_models.customer_options()', read_models.customer_options)
+    print(f"   memory: {orm / rows_peak:.1f}x less for listing rows, {orm / options:.1f}x less for picker options")
+
+
+def bench_recurring_generate(templates=100000):
+    """One scheduler run over N monthly templates, then an idempotent re-run."""
+    templates = int(templates)
+    print(f"Recurring invoice generation, {templates} monthly templates")
+    seed(0, customer_count=templates)
+    with app.app_context():
+        db.session.bulk_insert_mappings(RecurringInvoice, [
+            {'id': i + 1, 's_id': SELLER_ID, 'c_id': f'C{i:06d}', 'tax': Decimal('1.00'),
+             'interval_months': 1, 'day_of_month': 1, 'start_date': date(2024, 1, 1), 'active': True}
+            for i in range(templates)
+        ])
+        db.session.bulk_insert_mappings(RecurringInvoiceItem, [
+            {'recurring_id': i // 2 + 1, 'p_id': f'P{i % 50:03d}', 'item_quantity': 2, 'discount': Decimal('0')}
+            for i in range(templates * 2)
+        ])
+        db.session.commit()
+
+        started = time.perf_counter()
+        created = recurring.generate_due_invoices(date(2024, 6, 1))
+        elapsed = time.perf_counter() - started
+        print(f"   first run: {created} invoices in {elapsed:.1f} s ({created / elapsed:.0f} invoices/s)")
+        started = time.perf_counter()
+        created = recurring.generate_due_invoices(date(2024, 6, 15))
+        print(f"   re-run same period: {created} invoices in {time.perf_counter() - started:.2f} s")
+
+
+def bench_pdf_memory(lines=20000):
+    """Peak Python memory while rendering invoice PDFs of growing length."""
+    from invoice_pdf import render_invoice_pdf
+
+    lines = int(lines)
+    print(f"Invoice PDF rendering, up to {lines} lines")
+    seed(0, customer_count=1)
+    with app.app_context():
+        sizes = sorted({max(1, lines // 20), max(1, lines // 4), lines})
+        for size in sizes:
+            invoice_no = f'BIG-{size}'
+            db.session.add(Invoice(invoice_no=invoice_no, invoice_datetime=datetime(2024, 1, 1), status='pending',
+                                   tax=Decimal('0'), amount=Decimal('0'), s_id=SELLER_ID, c_id='C000000'))
+            db.session.bulk_insert_mappings(InvoiceItem, [
+                {'invoice_no': invoice_no, 'p_id': f'P{i % 50:03d}', 'item_quantity': 1 + i % 5, 'discount': Decimal('0')}
+                for i in range(size)
+            ])
+        db.session.commit()
+
+        for size in sizes:
+            db.session.expunge_all()
+            invoice = db.session.get(Invoice, f'BIG-{size}')
+            customer = db.session.get(Customer, invoice.c_id)
+            tracemalloc.start()
+            started = time.perf_counter()
+            pdf_file = render_invoice_pdf(invoice, customer)
+            elapsed = time.perf_counter() - started
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            pdf_file.seek(0, os.SEEK_END)
+            print(f"   {size:>7} lines {elapsed * 1000:10.1f} ms {peak / 1024 / 1024:8.1f} MiB peak"
+                  f" {pdf_file.tell() / 1024:10.1f} KiB pdf")
+
+
+# Run in a fresh interpreter per sample, so nothing is already imported
+STARTUP_PROBE = '''
+import json, sys, time
+started = time.perf_counter()
+from app import create_app
+imported = time.perf_counter()
+app = create_app()
+created = time.perf_counter()
+response = app.test_client().get('/login')
+served = time.perf_counter()
+assert response.status_code == 200, response.status_code
+print(json.dumps({'import': imported - started, 'create_app': created - imported,
+                  'first_request': served - created, 'reportlab': 'reportlab' in sys.modules}))
+'''
+
+
+def bench_startup(runs=5):
+    """Cold start of one worker: interpreter launch to the first response, median of N fresh processes."""
+    runs = int(runs)
+    print(f"Worker cold start, median of {runs} runs")
+    with app.app_context():
+        db.create_all()
+    samples = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        output = subprocess.run([sys.executable, '-c', STARTUP_PROBE], check=True, capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__)), env=os.environ).stdout
+        sample = json.loads(output.strip().splitlines()[-1])
+        sample['total'] = time.perf_counter() - started
+        samples.append(sample)
+    for key, label in (('import', 'import app'), ('create_app', 'create_app()'),
+                       ('first_request', 'first request (GET /login)'), ('total', 'process start to first response')):
+        print(f"   {label:<40} {statistics.median(s[key] for s in samples) * 1000:10.1f} ms")
+    print(f"   reportlab imported at startup: {'yes' if any(s['reportlab'] for s in samples) else 'no'}")
+
+
+def bench_unique_inserts(threads=20):
+    """Concurrent sign-ups with one email, then with distinct emails, plus queries per customer insert."""
+    threads = int(threads)
+    print(f"Concurrent registrations, {threads} threads")
+    seed(0, customer_count=1)
+    form = {'name': 'Racer', 'phone': '000', 'address': 'Track', 'password': 'pw', 'role': 'seller'}
+
+    def race(email_for):
+        barrier = threading.Barrier(threads)
+        statuses = []
+
+        def register(n):
+            client = app.test_client()
+            barrier.wait()
+            response = client.post('/register', data={**form, 'email': email_for(n)})
+            statuses.append(response.status_code)
+
+        workers = [threading.Thread(target=register, args=(n,)) for n in range(threads)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        return statuses
+
+    race(lambda n: 'same@example.com')
+    race(lambda n: f'racer{n}@example.com')
+    with app.app_context():
+        same = db.session.execute(select(func.count()).where(Seller.s_email == 'same@example.com')).scalar()
+        distinct = db.session.execute(select(func.count()).where(Seller.s_email.like('racer%'))).scalar()
+        keys = db.session.execute(select(func.count(func.distinct(Seller.s_id)))).scalar()
+        sellers = db.session.execute(select(func.count()).select_from(Seller)).scalar()
+    print(f"   same email: {same} seller stored from {threads} attempts")
+    print(f"   distinct emails: {distinct}/{threads} stored, {keys} unique ids for {sellers} sellers")
+
+    statements = []
+    with app.app_context():
+        event.listen(db.engine, 'before_cursor_execute', lambda *args: statements.append(args[2]))
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session.update(user_id=SELLER_ID, user_role='seller')
+    customer = {'name': 'New', 'phone': '1', 'address': 'Here'}
+    for label, email in (('new customer', 'fresh@example.com'), ('duplicate email', 'fresh@example.com')):
+        statements.clear()
+        client.post('/seller/customers/add', data={**customer, 'email': email})
+        writes = sum(1 for sql in statements if not sql.lstrip().upper().startswith('SELECT'))
+        print(f"   add customer ({label}): {len(statements)} statements, {writes} writes")
+
+
+def bench_tenant_pages(other_customers=100000):
+    """One seller's dashboard and customer list while other sellers' customers pile up."""
+    other_customers = int(other_customers)
+    print(f"Tenant pages, 200 own customers, up to {other_customers} belonging to another seller")
+    seed(0, customer_count=200)
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session.update(user_id=SELLER_ID, user_role='seller')
+    with app.app_context():
+        db.session.add(Seller(s_id='S002', s_name='Other Seller', s_email='other@example.com',
+                              s_address='2 Other Road', s_phone='000', password=''))
+        db.session.commit()
+    added = 0
+    for target in (0, other_customers // 10, other_customers):
+        with app.app_context():
+            db.session.bulk_insert_mappings(Customer, [
+                {'c_id': f'S002-C{i:06d}', 'c_name': f'Other {i}', 'c_email': f'o{i}@example.com',
+                 'c_phone_no': '555-0000', 'c_address': 'Elsewhere', 'password': '', 's_id': 'S002'}
+                for i in range(added, target)
+            ])
+            db.session.commit()
+        added = target
+        print(f"   {target} other customers:")
+        timed('dashboard', lambda: client.get('/seller'))
+        timed('customer list', lambda: client.get('/seller/customers'))
+
+
+def bench_admission(noisy_threads=8, seconds=5):
+    """Another seller's dashboard latency while one seller floods the PDF download, without and with limits."""
+    noisy_threads, seconds = int(noisy_threads), float(seconds)
+    print(f"Admission control, {noisy_threads} threads downloading a 2000-line PDF for {seconds:.0f} s")
+    seed(200, customer_count=20)
+    with app.app_context():
+        db.session.add(Invoice(invoice_no='BIG', invoice_datetime=datetime(2024, 1, 1), status='pending',
+                               tax=Decimal('0'), amount=Decimal('0'), s_id=SELLER_ID, c_id='C000000'))
+        db.session.bulk_insert_mappings(InvoiceItem, [
+            {'invoice_no': 'BIG', 'p_id': f'P{i % 50:03d}', 'item_quantity': 1, 'discount': Decimal('0')}
+            for i in range(2000)
+        ])
+        db.session.add(Seller(s_id='S002', s_name='Quiet Seller', s_email='quiet@example.com',
+                              s_address='2 Quiet Road', s_phone='000', password=''))
+        db.session.commit()
+
+    def signed_in(s_id):
+        client = app.test_client()
+        with client.session_transaction() as session:
+            session.update(user_id=s_id, user_role='seller')
+        return client
+
+    limiter = app.extensions['rate_limiter']
+    for enabled in (False, True):
+        limiter.enabled = enabled
+        limiter.backend = type(limiter.backend)()
+        stop = threading.Event()
+        statuses = []
+
+        def flood():
+            client = signed_in(SELLER_ID)
+            while not stop.is_set():
+                response = client.get('/invoice/BIG/download')  # backs off as Retry-After asks
+                statuses.append(response.status_code)
+                stop.wait(int(response.headers.get('Retry-After', 0)))
+
+        workers = [threading.Thread(target=flood) for _ in range(noisy_threads)]
+        for worker in workers:
+            worker.start()
+        quiet = signed_in('S002')
+        latencies = []
+        deadline = time.perf_counter() + seconds
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            quiet.get('/seller')
+            latencies.append(time.perf_counter() - started)
+        stop.set()
+        for worker in workers:
+            worker.join()
+        latencies.sort()
+        p95 = latencies[int(len(latencies) * 0.95)]
+        print(f"   limits {'on ' if enabled else 'off'}: other seller p50 {statistics.median(latencies) * 1000:7.1f} ms,"
+              f" p95 {p95 * 1000:7.1f} ms; flood got {statuses.count(200)} PDFs, {statuses.count(429)} x 429")
+
+
+def bench_assets():
+    """Bytes and requests for a first and a repeat visit to the invoice form, before and after build-assets."""
+    import gzip
+    import re
+    import shutil
+    import assets
+
+    print("Static assets on GET /seller/invoices/create (client accepts gzip, br)")
+    seed(50, customer_count=20)
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session.update(user_id=SELLER_ID, user_role='seller')
+    headers = {'Accept-Encoding': 'gzip, br'}
+    source_folder, installed = app.static_folder, app.extensions['assets']
+    with tempfile.TemporaryDirectory() as scratch:
+        built_folder = os.path.join(scratch, 'static')
+        shutil.copytree(source_folder, built_folder, ignore=shutil.ignore_patterns(assets.DIST))
+        assets.build(built_folder, os.path.join(app.root_path, app.template_folder, 'base.html'))
+        unbuilt = assets.Assets(scratch)  # no dist/ there
+        for label, folder, pipeline in (('source files', source_folder, unbuilt),
+                                        ('built assets', built_folder, assets.Assets(built_folder))):
+            app.static_folder, app.extensions['assets'] = folder, pipeline
+            app.jinja_env.globals['critical_css'] = app.extensions['assets'].critical_css
+            page = client.get('/seller/invoices/create', headers=headers)
+            # The page itself is compressed too (see compression.py)
+            html = page.data
+            if page.headers.get('Content-Encoding') == 'br':
+                import brotli
+                html = brotli.decompress(html)
+            elif page.headers.get('Content-Encoding') == 'gzip':
+                html = gzip.decompress(html)
+            urls = sorted(set(re.findall(r'/static/[^"\']+', html.decode())))
+            first = [client.get(url, headers=headers) for url in urls]
+            # A repeat visit revalidates cacheable-but-stale files; immutable ones aren't requested at all
+            stale = [(url, response) for url, response in zip(urls, first)
+                     if not response.cache_control.immutable]
+            repeat = [client.get(url, headers={**headers, 'If-None-Match': response.get_etag()[0]})
+                      for url, response in stale]
+            print(f"   {label}: page {len(page.data)} B; first visit {len(first)} asset requests, "
+                  f"{sum(len(r.data) for r in first)} B; repeat visit {len(repeat)} requests, "
+                  f"{sum(len(r.data) for r in repeat)} B")
+    app.static_folder, app.extensions['assets'] = source_folder, installed
+    app.jinja_env.globals['critical_css'] = installed.critical_css
+
+
+def bench_compression(rows=2000, mbps=10):
+    """Bytes on the wire and time to last byte per encoding; transfer time is modelled on a ``mbps`` link."""
+    rows, mbps = int(rows), float(mbps)
+    print(f"Response compression, {rows} invoices, {mbps:g} Mbit/s link")
+    seed(rows, product_count=300)
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session.update(user_id=SELLER_ID, user_role='seller')
+    app.extensions['rate_limiter'].enabled = False
+    import compression
+    encodings = ['identity', *compression.available_encoders()]
+    pages = ['/seller/invoices', '/seller/invoices/create', '/api/v1/invoices?include=items&limit=500',
+             '/seller/statements?format=csv']
+    for url in pages:
+        print(f"   {url}")
+        for encoding in encodings:
+            times, size = [], 0
+            for _ in range(5):
+                started = time.perf_counter()
+                response = client.get(url, headers={'Accept-Encoding': encoding}, buffered=True)
+                size = len(response.data)
+                times.append(time.perf_counter() - started)
+            server = statistics.median(times)
+            transfer = size * 8 / (mbps * 1_000_000)
+            print(f"      {encoding:<9} {size:>9} B   server {server * 1000:7.1f} ms"
+                  f"   last byte {(server + transfer) * 1000:8.1f} ms")
+
+
+def bench_integrity(rows=100000, workers=4):
+    """Find invoices whose amount no longer matches their items: one ORM pass vs. chunked SQL."""
+    rows, workers = int(rows), int(workers)
+    print(f"Invoice integrity check, {rows} invoices, every 5th product repriced")
+    seed(rows)
+    import integrity
+    with app.app_context():
+        repriced = [f'P{i:03d}' for i in range(0, 50, 5)]
+        db.session.execute(Product.__table__.update().where(Product.p_id.in_(repriced))
+                           .values(p_price=Product.p_price + 1))
+        db.session.commit()
+
+        def orm_pass():
+            # What a one-off script would do: load each invoice and its items and add them up
+            found = 0
+            for invoice in Invoice.query.order_by(Invoice.invoice_no).all():
+                subtotal = sum(item.price * item.item_quantity - item.discount for item in invoice.items)
+                found += abs(invoice.amount - invoice.tax - subtotal) >= Decimal('0.005')
+            db.session.expunge_all()
+            return found
+
+        def measure(label, check):
+            tracemalloc.start()
+            started = time.perf_counter()
+            found = check()
+            elapsed = time.perf_counter() - started
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            print(f"   {label:<46} {elapsed * 1000:10.1f} ms {peak / 1024 / 1024:8.1f} MiB peak  {found} found")
+
+        measure('ORM, one invoice at a time', orm_pass)
+        measure(f'verify_invoices(workers={workers})',
+                lambda: integrity.verify_invoices(workers=workers)[0])
+        measure('verify_invoices(fix=True, all_statuses=True)',
+                lambda: integrity.verify_invoices(workers=workers, fix=True, all_statuses=True)[1])
+        measure('verify_invoices() after fixing', lambda: integrity.verify_invoices(workers=workers)[0])
+
+
+def bench_concurrent_edits(threads=10):
+    """Many sellers saving the same invoice form at once, then many invoices of one product paid at once."""
+    threads = int(threads)
+    print(f"Concurrent edits, {threads} threads")
+    seed(threads * 3, product_count=1)  # two thirds of the invoices are open
+    with app.app_context():
+        open_invoices = db.session.execute(
+            select(Invoice.invoice_no).where(Invoice.status != 'paid').order_by(Invoice.invoice_no).limit(threads + 1)
+        ).scalars().all()
+
+    def race(invoice_for):
+        barrier = threading.Barrier(threads)
+        statuses = []
+
+        def mark_paid(n):
+            client = app.test_client()
+            with client.session_transaction() as session:
+                session.update(user_id=SELLER_ID, user_role='seller')
+            barrier.wait()
+            response = client.post(f'/seller/invoices/edit/{invoice_for(n)}',
+                                   data={'status': 'paid', 'version': versions[invoice_for(n)]})
+            statuses.append(response.status_code)
+
+        with app.app_context():
+            stock = db.session.get(Product, 'P000').p_stock
+            versions = dict(db.session.execute(select(Invoice.invoice_no, Invoice.version_id)).all())
+        workers = [threading.Thread(target=mark_paid, args=(n,)) for n in range(threads)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        with app.app_context():
+            taken = stock - db.session.get(Product, 'P000').p_stock
+        return statuses.count(302), statuses.count(409), taken
+
+    saved, conflicts, taken = race(lambda n: open_invoices[0])
+    print(f"   same invoice form: {saved} saved, {conflicts} told to reload, stock taken {taken} time(s)")
+    saved, conflicts, taken = race(lambda n: open_invoices[n + 1])
+    print(f"   {threads} invoices, one product: {saved} saved, {conflicts} conflicts, stock taken {taken} time(s)")
+
+
+def bench_activity_log(rows=1000000, months=24):
+    """Dashboard activity query and feed pages with the whole log in one table vs. monthly partitions."""
+    rows, months = int(rows), int(months)
+    print(f"Activity log, {rows} activities over {months} months, 200 users")
+    seed(0, customer_count=1)
+    import activity_log
+    from models import Activity
+    now = datetime.utcnow()
+    step = timedelta(days=30 * months) / rows
+    with app.app_context():
+        for start in range(0, rows, 50000):
+            db.session.execute(Activity.__table__.insert(), [
+                {'user_id': SELLER_ID if i % 200 == 0 else f'U{i % 200:03d}', 'user_role': 'seller',
+                 'action_type': 'invoice_created', 'description': f'Created invoice INV-{i:06d}',
+                 'timestamp': now - step * i}
+                for i in range(start, min(start + 50000, rows))
+            ])
+        db.session.commit()
+
+        def measure(label):
+            print(f"   {label}")
+            timed('dashboard (latest 5)', lambda: activity_log.recent(SELLER_ID), repeat=20)
+            timed('feed, first page of 100', lambda: activity_log.feed(SELLER_ID, 100), repeat=20)
+            hot = db.session.execute(select(func.count()).select_from(Activity)).scalar()
+            print(f"   {'rows in activities':<40} {hot:>10}")
+
+        db.session.execute(text('DROP INDEX ix_activities_user_time'))
+        db.session.commit()
+        measure('one table, no index (before)')
+        db.session.execute(text('CREATE INDEX ix_activities_user_time ON activities (user_id, timestamp)'))
+        db.session.commit()
+        measure('one table, (user_id, timestamp) index')
+        started = time.perf_counter()
+        moved, dropped = activity_log.rotate(retention_months=12, batch_size=10000)
+        print(f"   rotate-activities: {moved} moved, {dropped} months rolled up in {time.perf_counter() - started:.1f} s")
+        measure('monthly partitions, 12 months kept')
+
+
+def bench_drafts(lines=50, threads=10):
+    """Autosaving a long invoice form one changed line at a time, and finalizing it from retrying clients."""
+    lines, threads = int(lines), int(threads)
+    print(f"Invoice drafts, {lines} lines, {threads} finalize attempts")
+    seed(10, product_count=lines)
+    from urllib.parse import urlencode
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session.update(user_id=SELLER_ID, user_role='seller')
+    with app.app_context():
+        customer = db.session.execute(select(Customer.c_id).order_by(Customer.c_id)).scalars().first()
+
+    form = {'customer_id': customer, 'currency': 'INR', 'tax_region': 'IN'}
+    for n in range(lines):
+        form.update({f'product_{n}_id': f'P{n:03d}', f'quantity_{n}': 1, f'discount_{n}': '0'})
+    print(f"   {'whole form per save':<40} {len(urlencode(form)):>10} bytes")
+
+    draft = client.post('/api/v1/drafts', json={
+        'customer_id': customer,
+        'lines': [{'id': f'line-{n}', 'product_id': f'P{n:03d}', 'quantity': 1} for n in range(lines)],
+    }).get_json()['data']
+    version = draft['version']
+    body = {'version': version, 'lines': [{'id': 'line-0', 'quantity': 2}]}
+    print(f"   {'draft PATCH, one changed line':<40} {len(json.dumps(body)):>10} bytes")
+
+    def autosave():
+        nonlocal version
+        response = client.patch(f"/api/v1/drafts/{draft['id']}",
+                                json={'version': version, 'lines': [{'id': 'line-0', 'quantity': version + 1}]})
+        version = response.get_json()['data']['version']
+
+    timed('draft PATCH, one changed line', autosave, repeat=20)
+    stale = client.patch(f"/api/v1/drafts/{draft['id']}", json={'version': version - 1, 'lines': []})
+    print(f"   {'PATCH from an older version':<40} {stale.status_code:>10}")
+
+    # The same click retried by a client that never saw the answer, all at once
+    barrier = threading.Barrier(threads)
+    statuses = []
+
+    def finalize():
+        retrying = app.test_client()
+        with retrying.session_transaction() as session:
+            session.update(user_id=SELLER_ID, user_role='seller')
+        barrier.wait()
+        response = retrying.post(f"/api/v1/drafts/{draft['id']}/finalize", headers={'Idempotency-Key': 'bench-key'})
+        statuses.append((response.status_code, (response.get_json().get('data') or {}).get('id')))
+
+    with app.app_context():
+        before = db.session.execute(select(func.count()).select_from(Invoice)).scalar()
+    workers = [threading.Thread(target=finalize) for _ in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    with app.app_context():
+        created = db.session.execute(select(func.count()).select_from(Invoice)).scalar() - before
+    codes = sorted(code for code, _ in statuses)
+    print(f"   finalize x{threads}, one key: {created} invoice(s) created, "
+          f"{len({invoice for _, invoice in statuses})} distinct id(s), statuses {codes}")
+
+
+def bench_reports(rows=500000):
+    """Seller report aggregations run on the live tables vs. on the Parquet export."""
+    rows = int(rows)
+    print(f"Reports, {rows} invoices")
+    seed(rows)
+    import reports
+    directory = os.path.join(_tmpdir, 'snapshots')
+    with app.app_context():
+        month = func.strftime('%Y-%m', Invoice.invoice_datetime)
+
+        def live():
+            db.session.execute(select(month, func.count(), func.sum(Invoice.amount / Invoice.exchange_rate))
+                               .where(Invoice.s_id == SELLER_ID).group_by(month)).all()
+            db.session.execute(select(InvoiceItem.p_id, func.sum(InvoiceItem.item_quantity),
+                                      func.sum(Product.p_price * InvoiceItem.item_quantity - InvoiceItem.discount))
+                               .join(Invoice).join(Product).where(Invoice.s_id == SELLER_ID)
+                               .group_by(InvoiceItem.p_id)).all()
+            db.session.execute(select(Invoice.c_id, func.count(), func.sum(Invoice.amount))
+                               .where(Invoice.s_id == SELLER_ID).group_by(Invoice.c_id)).all()
+
+        timed('months, products, customers in SQL', live)
+        started = time.perf_counter()
+        path, counts = reports.export_snapshot(directory)
+        print(f"   {'export-snapshot':<40} {(time.perf_counter() - started) * 1000:10.1f} ms")
+        size = sum(os.path.getsize(os.path.join(path, name)) for name in os.listdir(path))
+        database = os.path.getsize(os.environ['DATABASE_URL'][len('sqlite:///'):])
+        print(f"   {'export size / database size':<40} {size // 1024:>7} KB / {database // 1024} KB")
+
+        def from_export():
+            reports._seller_report.cache_clear()
+            reports._seller_report(path, SELLER_ID)
+
+        timed('same report from the export', from_export)
+        timed('same report, cached', lambda: reports._seller_report(path, SELLER_ID), repeat=20)
+
+
+def bench_numbering(rows=200000, threads=8, per_thread=100):
+    """Invoice number allocation: COUNT(*) over every invoice vs. the per-seller counter, under concurrency."""
+    rows, threads, per_thread = int(rows), int(threads), int(per_thread)
+    print(f"Invoice numbering, {rows} existing invoices, {threads} workers x {per_thread} invoices, one seller")
+    seed(rows)
+    import numbering
+    with app.app_context():
+        timed('next number by COUNT(*) (before)', lambda: db.session.execute(
+            select(func.count()).select_from(Invoice)).scalar(), repeat=5)
+
+        def allocate_one():
+            numbering.next_number(SELLER_ID)
+            db.session.commit()
+
+        timed('next number from invoice_sequences', allocate_one, repeat=20)
+
+    created, errors = [], []
+
+    def worker(n):
+        with app.app_context():
+            for i in range(per_thread):
+                try:
+                    invoice_no = numbering.next_number(SELLER_ID)
+                    db.session.add(Invoice(invoice_no=invoice_no, status='pending', amount=Decimal('10.00'),
+                                           s_id=SELLER_ID, c_id='C000000'))
+                    if i % 10 == 9:
+                        db.session.rollback()  # a failed save hands its number back
+                        continue
+                    db.session.commit()
+                    created.append(invoice_no)
+                except Exception as error:
+                    db.session.rollback()
+                    errors.append(error)
+
+    started = time.perf_counter()
+    workers = [threading.Thread(target=worker, args=(n,)) for n in range(threads)]
+    for worker_thread in workers:
+        worker_thread.start()
+    for worker_thread in workers:
+        worker_thread.join()
+    elapsed = time.perf_counter() - started
+    numbers = sorted(int(invoice_no.rsplit('-', 1)[1]) for invoice_no in created)
+    first = numbers[0] if numbers else 0
+    print(f"   {len(created)} invoices in {elapsed:.2f} s ({len(created) / elapsed:.0f}/s), {len(errors)} errors")
+    print(f"   duplicates: {len(numbers) - len(set(numbers))}, "
+          f"gaps: {numbers != list(range(first, first + len(numbers)))}")
+
+
+def bench_portal(rows=500000, customers=5000):
+    """Customer dashboard: aggregating the customer's invoices per visit vs. reading customer_summaries."""
+    rows, customers = int(rows), int(customers)
+    print(f"Customer portal, {rows} invoices across {customers} customers of one seller")
+    seed(rows, customer_count=customers)
+    import portal
+    customer = 'C000001'
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session.update(user_id=customer, user_role='customer', customer_accounts=[[customer, SELLER_ID]])
+    with app.app_context():
+        def aggregate():
+            db.session.execute(
+                select(Invoice.status, func.count(), func.sum(Invoice.amount - Invoice.amount_paid))
+                .where(Invoice.c_id == customer).group_by(Invoice.status)
+            ).all()
+
+        index = next(index for index in Invoice.__table__.indexes if index.name == 'ix_invoices_customer_date')
+        index.drop(db.engine)
+        timed('aggregate invoices, no customer index', aggregate)
+        index.create(db.engine)
+        timed('aggregate invoices by customer index', aggregate)
+        timed('rebuild every summary', portal.rebuild_summaries, repeat=1)
+
+        def refresh_one():
+            portal.mark_changed({(SELLER_ID, customer)})
+            db.session.commit()
+
+        timed('refresh one summary (cost per commit)', refresh_one, repeat=10)
+    queries = []
+    with app.app_context():
+        event.listen(db.engine, 'before_cursor_execute', lambda *args: queries.append(args[2]))
+    timed('dashboard from customer_summaries', lambda: client.get('/customer'), repeat=10)
+    print(f"   dashboard statements touching invoices: {sum('FROM invoices' in q for q in queries)}")
+    timed('all invoices page (customer index)', lambda: client.get('/customer/invoices'))
+
+
+BENCHMARKS = {
+    'listing_render': bench_listing_render,
+    'listing_memory': bench_listing_memory,
+    'recurring_generate': bench_recurring_generate,
+    'pdf_memory': bench_pdf_memory,
+    'startup': bench_startup,
+    'unique_inserts': bench_unique_inserts,
+    'tenant_pages': bench_tenant_pages,
+    'admission': bench_admission,
+    'assets': bench_assets,
+    'compression': bench_compression,
+    'integrity': bench_integrity,
+    'concurrent_edits': bench_concurrent_edits,
+    'activity_log': bench_activity_log,
+    'drafts': bench_drafts,
+    'reports': bench_reports,
+    'numbering': bench_numbering,
+    'portal': bench_portal,
+}
+
+
+def main():
+    if len(sys.argv) < 2 or sys.argv[1] not in BENCHMARKS:
+        print(f"Usage: python benchmark.py <{'|'.join(BENCHMARKS)}> [args...]")
+        sys.exit(1)
+    BENCHMARKS[sys.argv[1]](*sys.argv[2:])
+
+
+if __name__ == '__main__':
+    main()
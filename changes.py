@@ -0,0 +1,111 @@
+"""Change tracking for sync clients.
+
+Every model carries ``updated_at`` (see ``TrackedMixin``). It is set on
+insert and refreshed by every ORM flush or Core ``UPDATE``. Editing an
+invoice's line items also touches the invoice. Deleting an invoice,
+product or customer through the ORM leaves a ``Tombstone`` row, and so does
+moving an invoice to the archive tables (with ``archived`` set).
+
+``changed_rows`` walks invoices, products, customers and tombstones in one
+total order ``(changed_at, resource, key)``. Each source is range-scanned
+from the cursor on its own ``updated_at`` index and limited before the
+results are merged. A page therefore costs about as much as the number of
+changes it returns, not the size of the tables. Rows newer than
+``CHANGE_FEED_LAG_SECONDS`` are held back until the next page, so a
+transaction that stamped a row but hasn't committed yet can't be skipped.
+"""
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import String, cast, event, literal, or_, select, tuple_, union_all, update
+
+from models import db, Customer, Invoice, InvoiceItem, Product, Tombstone
+from replicas import RoutingSession
+
+TOMBSTONE = 'tombstone'
+# resource name -> (model, primary key column, owning seller column or None)
+TRACKED = {
+    'customer': (Customer, Customer.c_id, Customer.s_id),
+    'invoice': (Invoice, Invoice.invoice_no, Invoice.s_id),
+    'product': (Product, Product.p_id, Product.s_id),
+}
+RESOURCE_NAMES = {model: name for name, (model, _, _) in TRACKED.items()}
+
+
+@event.listens_for(RoutingSession, 'before_flush')
+def _record_changes(db_session, flush_context, instances):
+    now = datetime.utcnow()
+    with db_session.no_autoflush:
+        for obj in db_session.deleted:
+            resource = RESOURCE_NAMES.get(type(obj))
+            if resource:
+                _, key, owner = TRACKED[resource]
+                db_session.add(Tombstone(
+                    resource=resource,
+                    key=getattr(obj, key.key),
+                    s_id=getattr(obj, owner.key) if owner is not None else None,
+                    deleted_at=now,
+                ))
+        # A changed line item is a change to its invoice
+        for obj in db_session.dirty:
+            if isinstance(obj, InvoiceItem) and db_session.is_modified(obj) and obj.invoice is not None:
+                obj.invoice.updated_at = now
+
+
+def _source(resource, seller_id, position, horizon, limit):
+    """Up to ``limit`` rows of one resource after ``position``, oldest first."""
+    if resource == TOMBSTONE:
+        changed_at, key = Tombstone.deleted_at, cast(Tombstone.id, String)
+        stmt = select(changed_at.label('changed_at'), literal(TOMBSTONE).label('resource'), key.label('key')).where(
+            or_(Tombstone.s_id == seller_id, Tombstone.s_id.is_(None)))
+    else:
+        model, key, owner = TRACKED[resource]
+        changed_at = model.updated_at
+        stmt = select(changed_at.label('changed_at'), literal(resource).label('resource'), key.label('key')).where(
+            changed_at.isnot(None))
+        if owner is not None:
+            stmt = stmt.where(owner == seller_id)
+    stmt = stmt.where(changed_at <= horizon)
+
+    if position is not None:
+        since, since_resource, since_key = position
+        # (changed_at, resource, key) > position, with resource fixed for this source
+        if resource > since_resource:
+            stmt = stmt.where(changed_at >= since)
+        elif resource == since_resource:
+            stmt = stmt.where(tuple_(changed_at, key) > tuple_(since, since_key))
+        else:
+            stmt = stmt.where(changed_at > since)
+    return stmt.order_by(changed_at, key).limit(limit).subquery()
+
+
+def changed_rows(seller_id, position=None, limit=100):
+    """The next ``limit`` ``(changed_at, resource, key)`` rows after ``position``.
+
+    Tombstone rows are resolved to ``(deleted_at, 'tombstone', Tombstone)``.
+    """
+    horizon = datetime.utcnow() - timedelta(seconds=current_app.config['CHANGE_FEED_LAG_SECONDS'])
+    sources = [_source(resource, seller_id, position, horizon, limit) for resource in (*TRACKED, TOMBSTONE)]
+    merged = union_all(*[select(source) for source in sources]).subquery()
+    rows = db.session.execute(
+        select(merged).order_by(merged.c.changed_at, merged.c.resource, merged.c.key).limit(limit)
+    ).all()
+
+    tombstone_ids = [int(row.key) for row in rows if row.resource == TOMBSTONE]
+    tombstones = {
+        str(t.id): t for t in Tombstone.query.filter(Tombstone.id.in_(tombstone_ids))
+    } if tombstone_ids else {}
+    return [
+        (row.changed_at, row.resource, tombstones[row.key] if row.resource == TOMBSTONE else row.key)
+        for row in rows
+    ]
+
+
+def backfill_updated_at(added_columns):
+    """Stamp existing rows of tables that just gained ``updated_at`` so the first sync picks them up."""
+    now = datetime.utcnow()
+    for table_name, column in added_columns:
+        if column == 'updated_at':
+            table = db.metadata.tables[table_name]
+            db.session.execute(update(table).where(table.c.updated_at.is_(None)).values(updated_at=now))
+    db.session.commit()
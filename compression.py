@@ -0,0 +1,97 @@
+"""Response compression.
+
+HTML, JSON, CSV and other text responses are compressed with Brotli (if the
+optional ``brotli`` package is installed) or gzip, whichever the client's
+``Accept-Encoding`` prefers. Bodies under ``COMPRESS_MIN_SIZE`` bytes go out
+as they are, since compressing them saves less than it costs.
+
+Streamed responses (the CSV export) are compressed chunk by chunk and
+flushed after each one, so the client keeps receiving data while the rest is
+still being produced. PDFs, images and anything already carrying a
+``Content-Encoding`` (the precompressed static files) pass through
+untouched.
+"""
+import zlib
+
+from flask import request
+
+COMPRESSIBLE = {
+    'text/html', 'text/plain', 'text/csv', 'text/css', 'text/javascript', 'text/xml',
+    'application/json', 'application/javascript', 'application/xml', 'image/svg+xml',
+}
+
+
+class GzipEncoder:
+    def __init__(self, config):
+        self._compressor = zlib.compressobj(config['COMPRESS_LEVEL'], zlib.DEFLATED, 31)  # 31: gzip container
+
+    def chunk(self, data):
+        return self._compressor.compress(data) + self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self, data=b''):
+        return self._compressor.compress(data) + self._compressor.flush()
+
+
+class BrotliEncoder:
+    def __init__(self, config):
+        import brotli
+        self._compressor = brotli.Compressor(quality=config['COMPRESS_BROTLI_QUALITY'])
+
+    def chunk(self, data):
+        return self._compressor.process(data) + self._compressor.flush()
+
+    def finish(self, data=b''):
+        return self._compressor.process(data) + self._compressor.finish()
+
+
+def available_encoders():
+    encoders = {'gzip': GzipEncoder}
+    try:
+        import brotli  # noqa: F401
+    except ImportError:
+        return encoders
+    return {'br': BrotliEncoder, **encoders}
+
+
+def _stream(body, encoder):
+    try:
+        for data in body:
+            if isinstance(data, str):
+                data = data.encode('utf-8')
+            if data:
+                yield encoder.chunk(data)
+        yield encoder.finish()
+    finally:
+        if hasattr(body, 'close'):
+            body.close()
+
+
+def init_app(app):
+    encoders = available_encoders()
+
+    @app.after_request
+    def compress_response(response):
+        if (request.method == 'HEAD' or response.direct_passthrough
+                or not 200 <= response.status_code < 300 or response.status_code == 204
+                or response.mimetype not in COMPRESSIBLE or 'Content-Encoding' in response.headers
+                or 'no-transform' in response.headers.get('Cache-Control', '')):
+            return response
+        response.vary.add('Accept-Encoding')
+        encoding = request.accept_encodings.best_match(list(encoders))
+        if encoding is None:
+            return response
+
+        encoder = encoders[encoding](app.config)
+        if response.is_streamed:
+            response.response = _stream(response.response, encoder)
+            response.headers.pop('Content-Length', None)
+        else:
+            data = response.get_data()
+            if len(data) < app.config['COMPRESS_MIN_SIZE']:
+                return response
+            response.set_data(encoder.finish(data))
+        response.content_encoding = encoding
+        if response.get_etag()[0] and not response.get_etag()[1]:
+            # The compressed bytes differ from the ones the strong ETag was computed for
+            response.set_etag(response.get_etag()[0], weak=True)
+        return response
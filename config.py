@@ -1,12 +1,14 @@
 import os
-from dotenv import load_dotenv
-
-# Load .env from project root if present
-load_dotenv()
 
 
 basedir = os.path.abspath(os.path.dirname(__file__))
 
+# Load .env from project root if present. Deployed dynos set real environment
+# variables and have no .env, so they skip importing python-dotenv altogether.
+if os.path.exists(os.path.join(basedir, '.env')):
+    from dotenv import load_dotenv
+    load_dotenv(os.path.join(basedir, '.env'))
+
 
 class Config:
     """Configuration using environment variables.
@@ -29,6 +31,79 @@ class Config:
 
     SQLALCHEMY_TRACK_MODIFICATIONS = False
 
+    # Optional read replicas: comma-separated URLs, each exposed as bind "replica_<n>"
+    SQLALCHEMY_BINDS = {
+        f"replica_{i}": url.strip()
+        for i, url in enumerate(os.environ.get('DATABASE_REPLICA_URLS', '').split(','))
+        if url.strip()
+    }
+    # Optional per-seller databases: "S042=<url>,S077=<url>", each exposed as bind "tenant_<s_id>"
+    SQLALCHEMY_BINDS.update(
+        (f"tenant_{entry.split('=', 1)[0].strip()}", entry.split('=', 1)[1].strip())
+        for entry in os.environ.get('TENANT_DATABASE_URLS', '').split(',')
+        if '=' in entry
+    )
+    # Seconds a user keeps reading from the primary after a write
+    REPLICA_STICKY_SECONDS = int(os.environ.get('REPLICA_STICKY_SECONDS', '5'))
+
+    # Rendered listing rows kept in memory (per worker)
+    ROW_FRAGMENT_CACHE_SIZE = int(os.environ.get('ROW_FRAGMENT_CACHE_SIZE', '10000'))
+
+    # Paid invoices older than this are moved to the archive tables by `flask archive-invoices`
+    ARCHIVE_AFTER_DAYS = int(os.environ.get('ARCHIVE_AFTER_DAYS', '365'))
+
+    # Months of detailed activity kept by `flask rotate-activities`; older months become monthly counts
+    ACTIVITY_RETENTION_MONTHS = int(os.environ.get('ACTIVITY_RETENTION_MONTHS', '12'))
+
+    # Parquet exports written by `flask export-snapshot` and read by the reports page
+    REPORTS_SNAPSHOT_DIR = os.environ.get('REPORTS_SNAPSHOT_DIR', os.path.join(basedir, 'snapshots'))
+    # Hours after which the reports page exports a fresh snapshot itself, in the background (0: never)
+    REPORTS_EXPORT_MAX_AGE_HOURS = int(os.environ.get('REPORTS_EXPORT_MAX_AGE_HOURS', '0'))
+
+    # Tax rules (region, tax_class, rate) and exchange rates (currency, symbol, per_base)
+    TAX_RULES_FILE = os.environ.get('TAX_RULES_FILE', os.path.join(basedir, 'data', 'tax_rules.csv'))
+    EXCHANGE_RATES_FILE = os.environ.get('EXCHANGE_RATES_FILE', os.path.join(basedir, 'data', 'exchange_rates.csv'))
+    BASE_CURRENCY = os.environ.get('BASE_CURRENCY', 'INR')  # currency product prices are kept in
+    DEFAULT_TAX_REGION = os.environ.get('DEFAULT_TAX_REGION', 'IN')
+
+    # Invoice numbers, one gap-free series per seller and fiscal year (see numbering.py).
+    # {year} is the year the fiscal year starts in; the Indian fiscal year starts in April.
+    INVOICE_NUMBER_FORMAT = os.environ.get('INVOICE_NUMBER_FORMAT', 'INV-{seller}-{year}-{number:04d}')
+    FISCAL_YEAR_START_MONTH = int(os.environ.get('FISCAL_YEAR_START_MONTH', '4'))
+
+    # The change feed (/api/v1/changes) holds back rows changed in the last few seconds so
+    # transactions still committing are not skipped
+    CHANGE_FEED_LAG_SECONDS = int(os.environ.get('CHANGE_FEED_LAG_SECONDS', '5'))
+
+    # Webhooks: comma-separated endpoint URLs that receive invoice events (see webhooks.py)
+    WEBHOOK_URLS = [url.strip() for url in os.environ.get('WEBHOOK_URLS', '').split(',') if url.strip()]
+    WEBHOOK_SECRET = os.environ.get('WEBHOOK_SECRET', '')  # signs each batch (X-Webhook-Signature)
+    WEBHOOK_BATCH_SIZE = int(os.environ.get('WEBHOOK_BATCH_SIZE', '50'))
+    WEBHOOK_CONCURRENCY = int(os.environ.get('WEBHOOK_CONCURRENCY', '4'))  # endpoints delivered to at once
+    WEBHOOK_TIMEOUT = float(os.environ.get('WEBHOOK_TIMEOUT', '10'))
+    WEBHOOK_BACKOFF_SECONDS = int(os.environ.get('WEBHOOK_BACKOFF_SECONDS', '30'))  # doubled after each failure
+    WEBHOOK_MAX_ATTEMPTS = int(os.environ.get('WEBHOOK_MAX_ATTEMPTS', '10'))
+
+    # Per-user limits on expensive routes (see ratelimit.py): "<requests>/<seconds>" per route class,
+    # and how many of one user's requests of that class may run at once
+    RATE_LIMIT_ENABLED = os.environ.get('RATE_LIMIT_ENABLED', 'True').lower() == 'true'
+    RATE_LIMITS = {
+        'pdf': os.environ.get('RATE_LIMIT_PDF', '30/60'),
+        'export': os.environ.get('RATE_LIMIT_EXPORT', '10/60'),
+        'search': os.environ.get('RATE_LIMIT_SEARCH', '120/60'),
+    }
+    CONCURRENCY_LIMITS = {
+        'pdf': int(os.environ.get('CONCURRENCY_LIMIT_PDF', '2')),
+        'export': int(os.environ.get('CONCURRENCY_LIMIT_EXPORT', '1')),
+        'search': int(os.environ.get('CONCURRENCY_LIMIT_SEARCH', '4')),
+    }
+    RATE_LIMIT_STORAGE_URL = os.environ.get('RATE_LIMIT_STORAGE_URL')  # redis://...; unset keeps counters per worker
+
+    # Response compression (see compression.py); smaller bodies are sent as they are
+    COMPRESS_MIN_SIZE = int(os.environ.get('COMPRESS_MIN_SIZE', '500'))
+    COMPRESS_LEVEL = int(os.environ.get('COMPRESS_LEVEL', '6'))  # gzip, 1-9
+    COMPRESS_BROTLI_QUALITY = int(os.environ.get('COMPRESS_BROTLI_QUALITY', '4'))  # 0-11
+
     # Other configurations
     DEBUG = os.environ.get('FLASK_DEBUG', 'False').lower() == 'true'
     PREFERRED_URL_SCHEME = os.environ.get('PREFERRED_URL_SCHEME', 'https')
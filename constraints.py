@@ -0,0 +1,67 @@
+"""Inserts that rely on the database's unique constraints.
+
+Checking ``filter_by(email=...).first()`` before inserting costs an extra
+round trip, and two concurrent requests can both pass the check.
+``insert_or_ignore`` sends a single ``INSERT ... ON CONFLICT DO NOTHING``
+(``INSERT IGNORE`` on MySQL) and reports whether the row went in. The unique
+index decides atomically, so a duplicate can never be stored. The extra
+lookup to explain a conflict runs only when there was one.
+"""
+from sqlalchemy import exists, func, insert, select
+from sqlalchemy.exc import IntegrityError
+
+from models import db
+
+MAX_KEY_ATTEMPTS = 20
+
+
+def insert_or_ignore(model, values):
+    """Insert one row unless it conflicts with a unique constraint. Returns whether it was inserted."""
+    dialect = db.engine.dialect.name
+    if dialect == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+    elif dialect == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+    elif dialect in ('mysql', 'mariadb'):
+        return db.session.execute(insert(model).values(values).prefix_with('IGNORE')).rowcount == 1
+    else:
+        try:
+            with db.session.begin_nested():
+                db.session.execute(insert(model).values(values))
+            return True
+        except IntegrityError:
+            return False
+    return db.session.execute(dialect_insert(model).values(values).on_conflict_do_nothing()).rowcount == 1
+
+
+def is_taken(model, values):
+    """Whether a row with all of ``values`` (column name -> value) exists."""
+    return db.session.execute(select(exists().where(
+        *(getattr(model, name) == value for name, value in values.items())
+    ))).scalar()
+
+
+def insert_numbered(model, key, prefix, values, unique):
+    """Insert ``values`` under the next ``<prefix><nnn>`` key (S012, S001-C004, ...).
+
+    ``unique`` names the column(s) of a unique constraint, e.g. ``('s_id', 'c_email')``.
+    Returns the new key, or ``None`` when that combination is already taken.
+    If another request claims the same key first, the next number is tried.
+    """
+    number = db.session.execute(
+        select(func.count()).select_from(model).where(getattr(model, key).startswith(prefix, autoescape=True))
+    ).scalar()
+    for _ in range(MAX_KEY_ATTEMPTS):
+        number += 1
+        new_key = f'{prefix}{number:03d}'
+        if insert_or_ignore(model, {key: new_key, **values}):
+            return new_key
+        if is_taken(model, {name: values[name] for name in unique}):
+            return None
+    raise RuntimeError(f'No free {model.__tablename__} key after {MAX_KEY_ATTEMPTS} attempts')
+
+
+def violates_unique(error, column):
+    """Whether ``error`` (an ``IntegrityError``) was raised by the unique constraint on ``column``."""
+    message = str(error.orig).lower()
+    return column.name in message and ('unique' in message or 'duplicate' in message)
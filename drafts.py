@@ -0,0 +1,193 @@
+"""Draft invoices.
+
+The invoice form saves as it goes. A draft is created when the form opens
+and each edit is sent as a small ``PATCH`` naming only the fields and lines
+that changed. Lines carry an id chosen by the client, so an edit made
+offline can be replayed later without knowing what the server assigned.
+Several queued edits can go in one ``PATCH``. Every save bumps the draft's
+version (see ``version_id_col``), and a ``PATCH`` that names an older
+version is refused instead of overwriting a newer save from another tab.
+
+``finalize`` turns a draft into an invoice in one transaction, keyed by an
+idempotency key the client generates once per draft. The key is stored on
+the draft with the invoice number, so a retry after a lost response
+returns the invoice created the first time without doing any work, and
+two concurrent attempts can't both create one.
+"""
+import uuid
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+
+from sqlalchemy import select
+
+import numbering
+import taxes
+import webhooks
+from models import db, Activity, Customer, Product, Invoice, InvoiceItem, ArchivedInvoice, InvoiceDraft, InvoiceDraftLine
+
+MAX_KEY_LENGTH = 64
+
+
+class DraftConflict(Exception):
+    """The draft was saved or finalized by someone else since the client last saw it."""
+
+
+def _decimal(value, name):
+    try:
+        value = Decimal(str(value)).quantize(taxes.CENT)
+    except (InvalidOperation, ValueError):
+        raise ValueError(f'{name} must be a number')
+    if value < 0:
+        raise ValueError(f'{name} must not be negative')
+    return value
+
+
+def create_draft(s_id, changes):
+    draft = InvoiceDraft(id=str(uuid.uuid4()), s_id=s_id, tax_region=taxes.rate_tables().default_region)
+    db.session.add(draft)
+    apply_changes(draft, changes)
+    return draft
+
+
+def apply_changes(draft, changes):
+    """Apply a ``PATCH`` body to ``draft``. The caller commits.
+
+    ``changes`` may hold ``customer_id``, ``currency``, ``tax_region``, ``tax`` and ``version`` (the
+    version the client last saw), plus ``lines``: ``{"id", "product_id", "quantity", "discount",
+    "position"}`` to add or update a line (any field may be left out), or ``{"id", "deleted": true}``.
+    """
+    if draft.invoice_no is not None:
+        raise DraftConflict('This draft has already been turned into an invoice')
+    version = changes.get('version')
+    if version is not None and version != draft.version_id:
+        raise DraftConflict('This draft was saved somewhere else')
+
+    with db.session.no_autoflush:  # one UPDATE, and one version step, per save
+        tables = taxes.rate_tables()
+        if 'customer_id' in changes:
+            c_id = changes['customer_id'] or None
+            if c_id is not None and db.session.execute(
+                    select(Customer.c_id).where(Customer.c_id == c_id, Customer.s_id == draft.s_id)).first() is None:
+                raise ValueError('Unknown customer')
+            draft.c_id = c_id
+        if 'currency' in changes:
+            if changes['currency'] and changes['currency'] not in tables.currencies:
+                raise ValueError('Unknown currency')
+            draft.currency = changes['currency'] or None
+        if 'tax_region' in changes:
+            if changes['tax_region'] and changes['tax_region'] not in tables.regions:
+                raise ValueError('Unknown tax region')
+            draft.tax_region = changes['tax_region'] or None
+        if 'tax' in changes:
+            draft.tax = _decimal(changes['tax'] or 0, 'tax')
+
+        line_changes = changes.get('lines') or []
+        if line_changes:
+            _apply_line_changes(draft, line_changes)
+    # Always an UPDATE, so every save moves the version on, even one that only touched lines
+    draft.updated_at = datetime.utcnow()
+
+
+def _apply_line_changes(draft, line_changes):
+    product_ids = {change['product_id'] for change in line_changes if change.get('product_id')}
+    known = set(db.session.execute(
+        select(Product.p_id).where(Product.p_id.in_(product_ids), Product.s_id == draft.s_id)
+    ).scalars()) if product_ids else set()
+    lines = {line.line_id: line for line in draft.lines}
+    for change in line_changes:
+        line_id = change.get('id')
+        if not isinstance(line_id, str) or not 0 < len(line_id) <= 36:
+            raise ValueError('Each line needs an id of up to 36 characters')
+        line = lines.get(line_id)
+        if change.get('deleted'):
+            if line is not None:
+                draft.lines.remove(line)
+                del lines[line_id]
+            continue
+        if line is None:
+            line = lines[line_id] = InvoiceDraftLine(line_id=line_id, position=len(lines))
+            draft.lines.append(line)
+        if 'product_id' in change:
+            if change['product_id'] and change['product_id'] not in known:
+                raise ValueError(f"Unknown product {change['product_id']}")
+            line.p_id = change['product_id'] or None
+        if 'quantity' in change:
+            try:
+                line.item_quantity = int(change['quantity'])
+            except (TypeError, ValueError):
+                raise ValueError('quantity must be a whole number')
+            if line.item_quantity < 1:
+                raise ValueError('quantity must be at least 1')
+        if 'discount' in change:
+            line.discount = _decimal(change['discount'] or 0, 'discount')
+        if 'position' in change:
+            line.position = int(change['position'])
+
+
+def totals(draft):
+    """``taxes.Totals`` for the lines that have a product."""
+    lines = [line for line in draft.lines if line.p_id]
+    products = {product.p_id: product for product in db.session.execute(
+        select(Product).where(Product.p_id.in_({line.p_id for line in lines}))
+    ).scalars()} if lines else {}
+    result = taxes.compute_totals(
+        [(products[line.p_id].tax_class, products[line.p_id].p_price, line.item_quantity, line.discount)
+         for line in lines if line.p_id in products],
+        draft.tax_region,
+        draft.currency,
+    )
+    if draft.tax_region is None:
+        tax = draft.tax or Decimal('0')
+        result = result._replace(tax=tax, amount=result.subtotal + tax)
+    return result
+
+
+def finalize(draft, key):
+    """Turn ``draft`` into an invoice. Returns ``(invoice, created)``; the caller commits.
+
+    Called again with the same ``key`` after it succeeded, it returns the same invoice with
+    ``created=False``. The draft's version check makes a concurrent second attempt fail with
+    ``StaleDataError`` at commit.
+    """
+    if not key or len(key) > MAX_KEY_LENGTH:
+        raise ValueError(f'An Idempotency-Key of up to {MAX_KEY_LENGTH} characters is required')
+    if draft.invoice_no is not None:
+        if draft.idempotency_key != key:
+            raise DraftConflict('This draft has already been turned into an invoice')
+        return db.session.get(Invoice, draft.invoice_no) or db.session.get(ArchivedInvoice, draft.invoice_no), False
+
+    if draft.c_id is None:
+        raise ValueError('Choose a customer')
+    lines = [line for line in draft.lines if line.p_id]
+    if not lines:
+        raise ValueError('Add at least one item')
+    result = totals(draft)
+
+    invoice = Invoice(
+        invoice_no=numbering.next_number(draft.s_id),
+        invoice_datetime=datetime.utcnow(),
+        status='pending',
+        tax=result.tax,
+        amount=result.amount,
+        currency=result.currency,
+        exchange_rate=result.exchange_rate,
+        tax_region=draft.tax_region,
+        s_id=draft.s_id,
+        c_id=draft.c_id,
+    )
+    db.session.add(invoice)
+    db.session.add_all([
+        InvoiceItem(invoice_no=invoice.invoice_no, p_id=line.p_id, item_quantity=line.item_quantity,
+                    discount=line.discount)
+        for line in lines
+    ])
+    webhooks.publish('invoice.created', [invoice])
+    customer = db.session.get(Customer, draft.c_id)
+    db.session.add(Activity(user_id=draft.s_id, user_role='seller', action_type='invoice_created',
+                            description=f'Created invoice {invoice.invoice_no} for {customer.c_name}'))
+
+    # The draft stays behind as the record of this key; its lines now live on the invoice
+    draft.invoice_no, draft.idempotency_key = invoice.invoice_no, key
+    draft.lines = []
+    draft.updated_at = datetime.utcnow()
+    return invoice, True
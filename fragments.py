@@ -0,0 +1,78 @@
+"""Cached rendering of listing table rows.
+
+Each row partial is compiled once when the app starts and every rendered
+``<tr>`` is cached under the row tuple itself. A read-model row holds every
+value its partial displays, so the tuple doubles as the row version: any
+edit produces a different tuple and therefore a fresh render, and stale
+entries simply age out of the LRU.
+
+The ``money`` filter also reads currency symbols from the rate files (see
+taxes.py), so the key includes the rate tables' file stamp as well: editing
+those files re-renders every row instead of keeping the old symbols.
+"""
+from collections import OrderedDict
+from threading import Lock
+
+from flask import current_app
+from markupsafe import Markup
+
+import taxes
+
+ROW_TEMPLATES = (
+    'seller/_invoice_row.html',
+    'seller/_customer_row.html',
+    'seller/_product_row.html',
+)
+
+
+class RowFragmentCache:
+    def __init__(self, maxsize=10000):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, key):
+        with self._lock:
+            html = self._entries.get(key)
+            if html is not None:
+                self._entries.move_to_end(key)
+            return html
+
+    def put(self, key, html):
+        with self._lock:
+            self._entries[key] = html
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+def render_rows(template_name, rows):
+    """Render ``rows`` through a row partial, reusing cached fragments."""
+    cache = current_app.extensions['row_fragments']
+    template = current_app.jinja_env.get_template(template_name)
+    stamp = taxes.rate_tables().stamp
+    parts = []
+    for row in rows:
+        key = (template_name, stamp, row)
+        html = cache.get(key)
+        if html is None:
+            html = template.render(row=row)
+            cache.put(key, html)
+        parts.append(html)
+    return Markup(''.join(parts))
+
+
+def init_app(app):
+    app.extensions['row_fragments'] = RowFragmentCache(app.config.get('ROW_FRAGMENT_CACHE_SIZE', 10000))
+    app.jinja_env.globals['render_rows'] = render_rows
+    # Compile the row partials up front so the first listing request
+    # doesn't pay for parsing them.
+    for name in ROW_TEMPLATES:
+        app.jinja_env.get_template(name)
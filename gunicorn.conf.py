@@ -0,0 +1,35 @@
+"""Gunicorn settings, picked up automatically from the working directory.
+
+    gunicorn 'app:create_app()'
+
+The app is built once in the master (``preload_app``) and forked into the
+workers, so they share its imported modules and compiled templates
+copy-on-write instead of each loading its own. Set ``GUNICORN_PRELOAD=false``
+to build the app in every worker instead, e.g. to reload code with a HUP.
+"""
+import gc
+import os
+
+preload_app = os.environ.get('GUNICORN_PRELOAD', 'true').lower() == 'true'
+
+
+def when_ready(server):
+    if not server.cfg.preload_app:
+        return
+    app = server.app.wsgi()
+    # Compile every template once in the master rather than once per worker
+    for name in app.jinja_env.list_templates():
+        app.jinja_env.get_template(name)
+    # Keep the collector from touching (and so copying) the pages shared with the workers
+    gc.freeze()
+
+
+def post_fork(server, worker):
+    if not server.cfg.preload_app:
+        return
+    from models import db
+
+    # Connections opened in the master must not be shared with the workers
+    with server.app.wsgi().app_context():
+        for engine in db.engines.values():
+            engine.dispose(close=False)
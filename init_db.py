@@ -4,19 +4,21 @@ import os
 import sys
 from datetime import datetime
 from decimal import Decimal
-import uuid
 
 # Add the current directory to Python path
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
-from app import app, db
-from models import Seller, Customer, Product, Invoice, InvoiceItem
+from app import create_app, db
+import schema
+from models import Seller, Customer, Product, Invoice, InvoiceItem, Payment
 from werkzeug.security import generate_password_hash
 
+app = create_app()
+
 def create_tables():
     print("Creating database tables...")
     with app.app_context():
-        db.create_all()
+        schema.upgrade_database()
         print("Tables created successfully!")
 
 def insert_sample_data():
@@ -49,29 +51,32 @@ def insert_sample_data():
         db.session.add(seller2)
         
         customer1 = Customer(
-            c_id='C001',
+            c_id='S001-C001',
             c_name='Jane Customer',
             c_email='customer@example.com',
             c_phone_no='555-123-4567',
-            c_address='789 Customer Lane, City, State 12345'
+            c_address='789 Customer Lane, City, State 12345',
+            s_id='S001'
         )
         customer1.set_password('password')
         
         customer2 = Customer(
-            c_id='C002',
+            c_id='S001-C002',
             c_name='John Doe',
             c_email='john@example.com',
             c_phone_no='555-987-6543',
-            c_address='321 Client Street, City, State 12345'
+            c_address='321 Client Street, City, State 12345',
+            s_id='S001'
         )
         customer2.set_password('password')
         
         customer3 = Customer(
-            c_id='C003',
+            c_id='S001-C003',
             c_name='Bob Johnson',
             c_email='bob@example.com',
             c_phone_no='555-456-7890',
-            c_address='654 Buyer Blvd, City, State 12345'
+            c_address='654 Buyer Blvd, City, State 12345',
+            s_id='S001'
         )
         customer3.set_password('password')
         
@@ -79,15 +84,9 @@ def insert_sample_data():
         db.session.add(customer2)
         db.session.add(customer3)
         
-        product1_id = uuid.uuid4().hex
-        product2_id = uuid.uuid4().hex
-        product3_id = uuid.uuid4().hex
-        product4_id = uuid.uuid4().hex
-        product5_id = uuid.uuid4().hex
-
         products = [
             Product(
-                p_id=product1_id,
+                p_id='S001-P001',
                 p_name='Wireless Headphones',
                 p_price=Decimal('99.99'),
                 p_description='High-quality wireless headphones with noise cancellation',
@@ -95,7 +94,7 @@ def insert_sample_data():
                 s_id='S001'
             ),
             Product(
-                p_id=product2_id,
+                p_id='S001-P002',
                 p_name='Smart Watch',
                 p_price=Decimal('199.99'),
                 p_description='Fitness tracking smart watch with heart rate monitor',
@@ -103,7 +102,7 @@ def insert_sample_data():
                 s_id='S001'
             ),
             Product(
-                p_id=product3_id,
+                p_id='S001-P003',
                 p_name='Bluetooth Speaker',
                 p_price=Decimal('79.99'),
                 p_description='Portable Bluetooth speaker with 360-degree sound',
@@ -111,7 +110,7 @@ def insert_sample_data():
                 s_id='S001'
             ),
             Product(
-                p_id=product4_id,
+                p_id='S001-P004',
                 p_name='Laptop Stand',
                 p_price=Decimal('49.99'),
                 p_description='Adjustable aluminum laptop stand for ergonomic work',
@@ -119,7 +118,7 @@ def insert_sample_data():
                 s_id='S001'
             ),
             Product(
-                p_id=product5_id,
+                p_id='S001-P005',
                 p_name='Wireless Mouse',
                 p_price=Decimal('29.99'),
                 p_description='Ergonomic wireless mouse with precision tracking',
@@ -137,10 +136,19 @@ def insert_sample_data():
             status='paid',
             tax=Decimal('24.00'),
             amount=Decimal('299.97'),
+            amount_paid=Decimal('299.97'),
             s_id='S001',
-            c_id='C001'
+            c_id='S001-C001'
         )
         db.session.add(invoice1)
+        db.session.add(Payment(
+            invoice_no='INV-001',
+            s_id='S001',
+            amount=Decimal('299.97'),
+            paid_at=datetime(2024, 1, 20),
+            method='bank',
+            reference='NEFT INV-001'
+        ))
         
         invoice2 = Invoice(
             invoice_no='INV-002',
@@ -149,7 +157,7 @@ def insert_sample_data():
             tax=Decimal('14.40'),
             amount=Decimal('179.98'),
             s_id='S001',
-            c_id='C001'
+            c_id='S001-C001'
         )
         db.session.add(invoice2)
         
@@ -160,7 +168,7 @@ def insert_sample_data():
             tax=Decimal('12.80'),
             amount=Decimal('159.98'),
             s_id='S001',
-            c_id='C002'
+            c_id='S001-C002'
         )
         db.session.add(invoice3)
         
@@ -168,33 +176,33 @@ def insert_sample_data():
             # Invoice 1 items
             InvoiceItem(
                 invoice_no='INV-001',
-                p_id='P001',
+                p_id='S001-P001',
                 item_quantity=1,
                 discount=Decimal('0.00')
             ),
             InvoiceItem(
                 invoice_no='INV-001',
-                p_id='P002',
+                p_id='S001-P002',
                 item_quantity=1,
                 discount=Decimal('0.00')
             ),
             # Invoice 2 items
             InvoiceItem(
                 invoice_no='INV-002',
-                p_id='P003',
+                p_id='S001-P003',
                 item_quantity=2,
                 discount=Decimal('0.00')
             ),
             # Invoice 3 items
             InvoiceItem(
                 invoice_no='INV-003',
-                p_id='P001',
+                p_id='S001-P001',
                 item_quantity=1,
                 discount=Decimal('0.00')
             ),
             InvoiceItem(
                 invoice_no='INV-003',
-                p_id='P003',
+                p_id='S001-P003',
                 item_quantity=1,
                 discount=Decimal('0.00')
             )
@@ -223,8 +231,8 @@ def main():
         print("Database initialization completed successfully!")
         print("\nSample Data Created:")
         print("   - 2 Sellers (S001, S002)")
-        print("   - 3 Customers (C001, C002, C003)")
-        print("   - 5 Products (P001-P005)")
+        print("   - 3 Customers of S001 (S001-C001 to S001-C003)")
+        print("   - 5 Products of S001 (S001-P001 to S001-P005)")
         print("   - 3 Invoices (INV-001 to INV-003)")
         print("   - 5 Invoice Items")
         print("\nDemo Credentials:")
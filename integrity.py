@@ -0,0 +1,180 @@
+"""Invoice amount verification.
+
+``Invoice.amount`` is stored when an invoice is saved, but line totals are
+shown from the products' current prices, so the two drift apart whenever a
+price changes. ``flask --app app verify-invoices`` recomputes every
+invoice's totals the way ``edit_invoice`` would and lists the ones that
+differ. The net amount of each invoice and tax class is summed in SQL, in
+whole units of 10^-8 (price cents times exchange-rate millionths), so the
+sums are exact on every database. Rounding and tax then go through
+``taxes.class_totals``, the same code ``compute_totals`` uses. An invoice
+with a ``tax_region`` gets its tax recomputed per class at the region's
+current rate. An invoice whose tax was entered by hand keeps that tax.
+
+Each seller is a partition. Partitions are checked in parallel
+(``--workers``), each walking its invoices in keyset chunks of
+``--chunk-size``, so memory stays flat and no query scans more than one
+chunk. With ``--fix`` the mismatches (amount and tax) are written back in
+chunked bulk UPDATEs, and an ``invoice.updated`` webhook is queued for
+each. Only open invoices are fixed unless ``--all-statuses`` is given,
+because changing the amount of a paid invoice changes what was paid. A chunk in which someone
+edited an invoice after it was checked is left alone (its UPDATE is
+conditional on the version read), so run the command again to pick it up.
+Archived invoices are checked too, but never fixed.
+"""
+from collections import defaultdict, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+
+import click
+from flask import current_app
+from sqlalchemy import BigInteger, and_, cast, func, select, update
+from sqlalchemy.orm.exc import StaleDataError
+
+import portal
+import taxes
+import tenants
+import webhooks
+from models import db, Seller, Product, Invoice, InvoiceItem, ArchivedInvoice, ArchivedInvoiceItem
+from statements import OPEN_STATUSES
+
+NET_UNIT = Decimal('1E-8')  # a cent of price times a millionth of exchange rate
+
+Mismatch = namedtuple('Mismatch', ['table', 'invoice_no', 's_id', 'status', 'stored', 'expected', 'stored_tax',
+                                   'expected_tax'])
+TABLES = ((Invoice, InvoiceItem), (ArchivedInvoice, ArchivedInvoiceItem))
+
+
+def _chunk_bounds(invoice, s_id, chunk_size):
+    """``(after, last)`` invoice_no ranges covering one seller's invoices, ``chunk_size`` at a time."""
+    after = None
+    while True:
+        keys = select(invoice.invoice_no).where(invoice.s_id == s_id)
+        if after is not None:
+            keys = keys.where(invoice.invoice_no > after)
+        last = db.session.execute(
+            select(func.max(keys.order_by(invoice.invoice_no).limit(chunk_size).subquery().c.invoice_no))
+        ).scalar()
+        if last is None:
+            return
+        yield after, last
+        after = last
+
+
+def _units(column, places):
+    """``column`` as a whole number of ``10**-places``; integer sums don't pick up float error on SQLite."""
+    return cast(func.round(column * 10 ** places), BigInteger)
+
+
+def _in_chunk(invoice, s_id, after, last):
+    return and_(invoice.s_id == s_id, invoice.invoice_no <= last,
+                invoice.invoice_no > after if after is not None else True)
+
+
+def class_net_query(invoice, item, s_id, after, last):
+    """``(invoice_no, tax_class, net)`` for the invoices of ``s_id`` in ``(after, last]``, net in ``NET_UNIT``s."""
+    line_net = (_units(Product.p_price, 2) * _units(invoice.exchange_rate, 6) * item.item_quantity
+                - _units(item.discount, 2) * 10 ** 6)
+    return (
+        select(item.invoice_no, Product.tax_class, func.sum(line_net).label('net'))
+        .join(invoice, invoice.invoice_no == item.invoice_no)
+        .join(Product, Product.p_id == item.p_id)
+        .where(_in_chunk(invoice, s_id, after, last))
+        .group_by(item.invoice_no, Product.tax_class)
+    )
+
+
+def expected_totals(invoice, net_by_class):
+    """``(amount, tax)`` that ``edit_invoice`` would store for ``invoice`` given its net per tax class."""
+    subtotal, tax, _ = taxes.class_totals(net_by_class, invoice.tax_region)
+    if not invoice.tax_region:
+        tax = invoice.tax  # entered by hand
+    return subtotal + tax, tax
+
+
+def chunk_mismatches(invoice, item, s_id, after, last):
+    """``[(invoice, expected amount, expected tax)]`` for the invoices in the chunk whose totals are off."""
+    nets = defaultdict(dict)
+    for invoice_no, tax_class, net in db.session.execute(class_net_query(invoice, item, s_id, after, last)):
+        nets[invoice_no][tax_class] = Decimal(int(net)) * NET_UNIT
+    invoices = db.session.execute(
+        select(invoice).where(_in_chunk(invoice, s_id, after, last)).order_by(invoice.invoice_no)).scalars()
+    chunk = []
+    for inv in invoices:
+        amount, tax = expected_totals(inv, nets[inv.invoice_no])
+        if amount != inv.amount or tax != inv.tax:
+            chunk.append((inv, amount, tax))
+    return chunk
+
+
+def verify_seller(app, s_id, chunk_size, fix=False, all_statuses=False):
+    """Check (and optionally fix) one seller's invoices. Runs in its own app context and session."""
+    mismatches, fixed = [], 0
+    with app.app_context(), tenants.scope(s_id):
+        for invoice, item in TABLES:
+            for after, last in _chunk_bounds(invoice, s_id, chunk_size):
+                chunk = chunk_mismatches(invoice, item, s_id, after, last)
+                mismatches.extend(Mismatch(invoice.__tablename__, inv.invoice_no, s_id, inv.status, inv.amount,
+                                           amount, inv.tax, tax) for inv, amount, tax in chunk)
+                if fix and invoice is Invoice:
+                    fixed += _fix(chunk, all_statuses)
+                db.session.expunge_all()
+    return mismatches, fixed
+
+
+def _fix(chunk, all_statuses):
+    to_fix = [(inv, amount, tax) for inv, amount, tax in chunk if all_statuses or inv.status in OPEN_STATUSES]
+    if not to_fix:
+        return 0
+    try:
+        # Conditional on the versions just read, like any other edit
+        db.session.execute(update(Invoice), [
+            {'invoice_no': inv.invoice_no, 'version_id': inv.version_id, 'amount': amount, 'tax': tax}
+            for inv, amount, tax in to_fix
+        ])
+    except StaleDataError:
+        db.session.rollback()
+        return 0
+    portal.mark_changed((inv.s_id, inv.c_id) for inv, _, _ in to_fix)
+    webhooks.publish('invoice.updated', [
+        {**{field: getattr(inv, field) for field in webhooks.INVOICE_FIELDS}, 'amount': amount, 'tax': tax}
+        for inv, amount, tax in to_fix
+    ])
+    db.session.commit()
+    return len(to_fix)
+
+
+def verify_invoices(seller_ids=None, chunk_size=1000, workers=4, fix=False, all_statuses=False, report=None):
+    """Check every seller's invoices, ``workers`` sellers at a time. Returns ``(mismatches, fixed)``."""
+    app = current_app._get_current_object()
+    if seller_ids is None:
+        seller_ids = db.session.execute(select(Seller.s_id).order_by(Seller.s_id)).scalars().all()
+    total, fixed = 0, 0
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        results = pool.map(lambda s_id: verify_seller(app, s_id, chunk_size, fix, all_statuses), seller_ids)
+        for mismatches, seller_fixed in results:
+            total += len(mismatches)
+            fixed += seller_fixed
+            if report:
+                for mismatch in mismatches:
+                    report(mismatch)
+    return total, fixed
+
+
+def init_app(app):
+    @app.cli.command('verify-invoices')
+    @click.option('--fix', is_flag=True, help='Write the recomputed amounts and taxes back.')
+    @click.option('--all-statuses', is_flag=True, help='With --fix, also fix paid and cancelled invoices.')
+    @click.option('--seller', 'sellers', multiple=True, help='Only check this seller (repeatable).')
+    @click.option('--workers', type=int, default=4, show_default=True, help='Sellers checked in parallel.')
+    @click.option('--chunk-size', type=int, default=1000, show_default=True)
+    def verify_invoices_command(fix, all_statuses, sellers, workers, chunk_size):
+        """Report (and optionally fix) invoices whose stored amount doesn't match their items."""
+        def report(mismatch):
+            tax = (f" (tax {mismatch.stored_tax} -> {mismatch.expected_tax})"
+                   if mismatch.stored_tax != mismatch.expected_tax else '')
+            click.echo(f"{mismatch.table} {mismatch.invoice_no} ({mismatch.s_id}, {mismatch.status}): "
+                       f"stored {mismatch.stored}, items give {mismatch.expected}{tax}")
+
+        total, fixed = verify_invoices(list(sellers) or None, chunk_size, workers, fix, all_statuses, report)
+        click.echo(f"{total} invoice(s) don't match their items" + (f"; fixed {fixed}." if fix else '.'))
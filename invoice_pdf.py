@@ -0,0 +1,230 @@
+"""Invoice PDF rendering.
+
+Line items are streamed from a column-projected query with ``yield_per`` so
+an invoice with tens of thousands of lines never materialises its items (or
+their products) as ORM objects. Pages go through ``PageWriter``, which
+compresses each page and appends it to a ``SpooledTemporaryFile`` as soon as
+``showPage()`` is called (ReportLab's canvas would keep every page until
+``save()``). The file moves to disk once it outgrows ``SPOOL_MAX_BYTES`` and
+is streamed to the client, so a worker holds one page at a time plus a few
+integers per page for the cross-reference table, however long the invoice.
+
+Each page ends with its own subtotal and the running total carried forward.
+Invoices that span several pages get a closing page summary listing both.
+"""
+import tempfile
+import zlib
+from decimal import Decimal
+
+from reportlab.lib import colors
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.units import mm
+from reportlab.pdfbase.pdfmetrics import stringWidth
+from sqlalchemy import select
+
+from models import db, Product, InvoiceItem, ArchivedInvoice, ArchivedInvoiceItem
+
+SPOOL_MAX_BYTES = 256 * 1024  # a typical invoice is a few KiB; long ones go to disk
+ITEM_BATCH_SIZE = 500
+BOTTOM_MARGIN = 40 * mm
+FONTS = ('Helvetica', 'Helvetica-Bold')  # standard PDF fonts, nothing to embed
+
+
+class PageWriter:
+    """The part of ReportLab's ``Canvas`` API the invoice uses, writing each page out as it is finished.
+
+    Objects 1 and 2 are the catalog and the page tree, which are written last; the fonts follow, then a
+    content stream and a page object per page.
+    """
+
+    def __init__(self, out, pagesize):
+        self.out = out
+        self.width, self.height = pagesize
+        self.offsets = [None, None]
+        self.kids = []
+        self.parts = []
+        self.font = (FONTS[0], 12)
+        self.out.write(b'%PDF-1.4\n%\xe2\xe3\xcf\xd3\n')
+        self.font_refs = {name: self._object(
+            f'<< /Type /Font /Subtype /Type1 /BaseFont /{name} /Encoding /WinAnsiEncoding >>'.encode())
+            for name in FONTS}
+
+    def _object(self, body, number=None):
+        if number is None:
+            self.offsets.append(None)
+            number = len(self.offsets)
+        self.offsets[number - 1] = self.out.tell()
+        self.out.write(b'%d 0 obj\n' % number + body + b'\nendobj\n')
+        return number
+
+    def getPageNumber(self):
+        return len(self.kids) + 1
+
+    def setFont(self, name, size):
+        self.font = (name, size)
+
+    def setStrokeColor(self, color):
+        self.parts.append(f'{color.red:.3f} {color.green:.3f} {color.blue:.3f} RG')
+
+    def line(self, x1, y1, x2, y2):
+        self.parts.append(f'{x1:.2f} {y1:.2f} m {x2:.2f} {y2:.2f} l S')
+
+    def drawString(self, x, y, text):
+        name, size = self.font
+        encoded = text.encode('cp1252', 'replace')
+        for special in (b'\\', b'(', b')'):
+            encoded = encoded.replace(special, b'\\' + special)
+        self.parts.append(f'BT /F{FONTS.index(name) + 1} {size} Tf {x:.2f} {y:.2f} Td ('.encode()
+                          + encoded + b') Tj ET')
+
+    def drawRightString(self, x, y, text):
+        self.drawString(x - stringWidth(text, *self.font), y, text)
+
+    def showPage(self):
+        stream = zlib.compress(b'\n'.join(part if isinstance(part, bytes) else part.encode()
+                                          for part in self.parts))
+        contents = self._object(b'<< /Length %d /Filter /FlateDecode >>\nstream\n' % len(stream)
+                                + stream + b'\nendstream')
+        fonts = ' '.join(f'/F{i} {ref} 0 R' for i, ref in enumerate(self.font_refs.values(), start=1))
+        self.kids.append(self._object(
+            f'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {self.width:.2f} {self.height:.2f}] '
+            f'/Resources << /Font << {fonts} >> >> /Contents {contents} 0 R >>'.encode()))
+        self.parts = []
+
+    def save(self):
+        if self.parts:
+            self.showPage()
+        kids = ' '.join(f'{kid} 0 R' for kid in self.kids)
+        self._object(f'<< /Type /Pages /Kids [{kids}] /Count {len(self.kids)} >>'.encode(), 2)
+        self._object(b'<< /Type /Catalog /Pages 2 0 R >>', 1)
+        xref = self.out.tell()
+        self.out.write(b'xref\n0 %d\n0000000000 65535 f \n' % (len(self.offsets) + 1))
+        for offset in self.offsets:
+            self.out.write(b'%010d 00000 n \n' % offset)
+        self.out.write(b'trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n'
+                       % (len(self.offsets) + 1, xref))
+
+
+def iter_lines(invoice):
+    """Yield ``(name, quantity, price, discount)`` for each line, fetched in batches."""
+    item = ArchivedInvoiceItem if isinstance(invoice, ArchivedInvoice) else InvoiceItem
+    stmt = (
+        select(Product.p_name, item.item_quantity, Product.p_price, item.discount)
+        .join(Product, Product.p_id == item.p_id)
+        .where(item.invoice_no == invoice.invoice_no)
+        .order_by(item.item_id)
+        .execution_options(yield_per=ITEM_BATCH_SIZE)
+    )
+    return db.session.execute(stmt)
+
+
+def render_invoice_pdf(invoice, customer):
+    """Render ``invoice`` and return a rewound file object holding the PDF."""
+    out = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_BYTES)
+    pdf = PageWriter(out, A4)
+    width, height = A4
+
+    def table_header(y):
+        pdf.setFont('Helvetica-Bold', 11)
+        pdf.drawString(20 * mm, y, 'Product')
+        pdf.drawString(100 * mm, y, 'Qty')
+        pdf.drawString(120 * mm, y, f'Price ({invoice.currency})')
+        pdf.drawString(155 * mm, y, f'Total ({invoice.currency})')
+        y -= 5 * mm
+        pdf.setStrokeColor(colors.black)
+        pdf.line(20 * mm, y, 190 * mm, y)
+        y -= 6 * mm
+        pdf.setFont('Helvetica', 11)
+        return y
+
+    def continuation_header(brought_forward=None):
+        y = height - 20 * mm
+        pdf.setFont('Helvetica-Bold', 11)
+        pdf.drawString(20 * mm, y, f'Invoice #{invoice.invoice_no} (continued, page {pdf.getPageNumber()})')
+        if brought_forward is not None:
+            pdf.setFont('Helvetica', 10)
+            pdf.drawRightString(190 * mm, y, f'Brought forward: {brought_forward:.2f}')
+        return y - 10 * mm
+
+    def page_footer(page_subtotal, running):
+        y = 25 * mm
+        pdf.setFont('Helvetica', 10)
+        pdf.drawRightString(190 * mm, y, f'Page subtotal: {page_subtotal:.2f}')
+        pdf.drawRightString(190 * mm, y - 5 * mm, f'Carried forward: {running:.2f}')
+
+    y = height - 30 * mm
+    pdf.setFont('Helvetica-Bold', 16)
+    pdf.drawString(20 * mm, y, f'Invoice #{invoice.invoice_no}')
+    y -= 10 * mm
+
+    pdf.setFont('Helvetica', 11)
+    pdf.drawString(20 * mm, y, f'Date: {invoice.invoice_datetime.strftime("%Y-%m-%d %H:%M")}')
+    y -= 6 * mm
+    if customer:
+        pdf.drawString(20 * mm, y, f'Bill To: {customer.c_name}  <{customer.c_email}>')
+        y -= 10 * mm
+
+    y = table_header(y)
+    subtotal = Decimal('0')
+    page_subtotal = Decimal('0')
+    page_totals = []
+    for name, quantity, base_price, discount in iter_lines(invoice):
+        price = base_price * invoice.exchange_rate
+        line_total = (price * quantity) - discount
+        subtotal += line_total
+        page_subtotal += line_total
+        pdf.drawString(20 * mm, y, f'{name}')
+        pdf.drawRightString(115 * mm, y, str(quantity))
+        pdf.drawRightString(145 * mm, y, f'{price:.2f}')
+        pdf.drawRightString(190 * mm, y, f'{line_total:.2f}')
+        y -= 6 * mm
+        if y < BOTTOM_MARGIN:
+            page_totals.append((page_subtotal, subtotal))
+            page_footer(page_subtotal, subtotal)
+            pdf.showPage()
+            page_subtotal = Decimal('0')
+            y = table_header(continuation_header(subtotal))
+    page_totals.append((page_subtotal, subtotal))
+
+    # Summary
+    if y < BOTTOM_MARGIN + 30 * mm:
+        pdf.showPage()
+        y = continuation_header()
+    y -= 4 * mm
+    pdf.line(120 * mm, y, 190 * mm, y)
+    y -= 8 * mm
+    pdf.setFont('Helvetica-Bold', 12)
+    pdf.drawRightString(170 * mm, y, 'Subtotal:')
+    pdf.setFont('Helvetica', 12)
+    pdf.drawRightString(190 * mm, y, f'{subtotal:.2f}')
+    y -= 6 * mm
+    pdf.setFont('Helvetica-Bold', 12)
+    pdf.drawRightString(170 * mm, y, f'Tax ({invoice.tax_region}):' if invoice.tax_region else 'Tax:')
+    pdf.setFont('Helvetica', 12)
+    pdf.drawRightString(190 * mm, y, f'{invoice.tax:.2f}')
+    y -= 8 * mm
+    pdf.setFont('Helvetica-Bold', 13)
+    pdf.drawRightString(170 * mm, y, f'Total ({invoice.currency}):')
+    pdf.setFont('Helvetica-Bold', 13)
+    pdf.drawRightString(190 * mm, y, f'{invoice.amount:.2f}')
+
+    if len(page_totals) > 1:
+        pdf.showPage()
+        y = continuation_header() - 4 * mm
+        pdf.setFont('Helvetica-Bold', 12)
+        pdf.drawString(20 * mm, y, 'Page Summary')
+        y -= 8 * mm
+        for page_no, (page_total, running) in enumerate(page_totals, start=1):
+            pdf.setFont('Helvetica', 11)
+            pdf.drawString(20 * mm, y, f'Page {page_no}')
+            pdf.drawRightString(145 * mm, y, f'{page_total:.2f}')
+            pdf.drawRightString(190 * mm, y, f'{running:.2f}')
+            y -= 6 * mm
+            if y < BOTTOM_MARGIN:
+                pdf.showPage()
+                y = continuation_header() - 4 * mm
+
+    pdf.save()
+
+    out.seek(0)
+    return out
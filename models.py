@@ -1,11 +1,20 @@
 from flask_sqlalchemy import SQLAlchemy
 from datetime import datetime
 from werkzeug.security import generate_password_hash, check_password_hash
+from replicas import RoutingSession
 
-db = SQLAlchemy()
+db = SQLAlchemy(session_options={'class_': RoutingSession})
 
-class Activity(db.Model):
+class TrackedMixin:
+    """``updated_at`` is set on insert and on every ORM or Core update; changes.py reads it"""
+    updated_at = db.Column(db.DateTime, nullable=True, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+class Activity(TrackedMixin, db.Model):
+    """The newest partition of the activity log; older months are moved out by activity_log.py"""
     __tablename__ = 'activities'
+    __table_args__ = (
+        db.Index('ix_activities_user_time', 'user_id', 'timestamp'),  # dashboard and feed, newest first
+    )
     
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     user_id = db.Column(db.String(10), nullable=False)  # User who performed the action
@@ -26,21 +35,34 @@ class Activity(db.Model):
         }
     
     def get_time_ago(self):
-        now = datetime.utcnow()
-        diff = now - self.timestamp
-        
-        if diff.days > 0:
-            return f"{diff.days} day{'s' if diff.days > 1 else ''} ago"
-        elif diff.seconds > 3600:
-            hours = diff.seconds // 3600
-            return f"{hours} hour{'s' if hours > 1 else ''} ago"
-        elif diff.seconds > 60:
-            minutes = diff.seconds // 60
-            return f"{minutes} minute{'s' if minutes > 1 else ''} ago"
-        else:
-            return "Just now"
-
-class Seller(db.Model):
+        return time_ago(self.timestamp)
+
+def time_ago(timestamp):
+    """'3 hours ago' for a UTC timestamp (also the ``time_ago`` template filter)"""
+    diff = datetime.utcnow() - timestamp
+    
+    if diff.days > 0:
+        return f"{diff.days} day{'s' if diff.days > 1 else ''} ago"
+    elif diff.seconds > 3600:
+        hours = diff.seconds // 3600
+        return f"{hours} hour{'s' if hours > 1 else ''} ago"
+    elif diff.seconds > 60:
+        minutes = diff.seconds // 60
+        return f"{minutes} minute{'s' if minutes > 1 else ''} ago"
+    else:
+        return "Just now"
+
+class ActivityRollup(db.Model):
+    """Monthly activity counts kept after a month's detailed rows pass retention"""
+    __tablename__ = 'activity_rollups'
+
+    month = db.Column(db.Date, primary_key=True)  # first day of the month
+    user_id = db.Column(db.String(10), primary_key=True)
+    user_role = db.Column(db.String(20), primary_key=True)
+    action_type = db.Column(db.String(50), primary_key=True)
+    count = db.Column(db.Integer, nullable=False)
+
+class Seller(TrackedMixin, db.Model):
     __tablename__ = 'sellers'
     
     s_id = db.Column(db.String(10), primary_key=True)  # S_ID
@@ -70,18 +92,29 @@ class Seller(db.Model):
             'role': 'seller'
         }
 
-class Customer(db.Model):
+class Customer(TrackedMixin, db.Model):
     __tablename__ = 'customers'
+    __table_args__ = (
+        db.Index('uq_customers_seller_email', 's_id', 'c_email', unique=True),  # emails are unique per seller
+        db.Index('ix_customers_seller_updated', 's_id', 'updated_at'),  # change feed
+        db.Index('ix_customers_email', 'c_email'),  # customer portal sign-in, across sellers
+    )
     
-    c_id = db.Column(db.String(10), primary_key=True)    # C_ID
+    c_id = db.Column(db.String(20), primary_key=True)    # C_ID, "<seller>-C<nnn>"
     c_name = db.Column(db.String(100), nullable=False)  # C_NAME
-    c_email = db.Column(db.String(100), nullable=False, unique=True)  # C_EMAIL
+    c_email = db.Column(db.String(100), nullable=False)  # C_EMAIL
     c_phone_no = db.Column(db.String(20), nullable=False)  # C_PHONE_NO
     c_address = db.Column(db.Text, nullable=False)       # C_ADDRESS
     password = db.Column(db.String(255), nullable=True, default='')  # PASSWORD (optional for customers)
+    s_id = db.Column(db.String(10), db.ForeignKey('sellers.s_id'), nullable=True)  # owning seller
+    version_id = db.Column(db.Integer, nullable=False, server_default='1')  # optimistic lock, see __mapper_args__
     
     # Relationships
     invoices = db.relationship('Invoice', backref='customer', lazy=True)
+
+    # Every ORM UPDATE/DELETE is conditional on the version it loaded and bumps it; a concurrent
+    # change makes the flush raise StaleDataError instead of being overwritten.
+    __mapper_args__ = {'version_id_col': version_id}
     
     # Properties for template compatibility
     @property
@@ -125,19 +158,26 @@ class Customer(db.Model):
             return False
         return check_password_hash(self.password, password)
 
-class Product(db.Model):
+class Product(TrackedMixin, db.Model):
     """PRODUCT entity from ER diagram"""
     __tablename__ = 'products'
+    __table_args__ = (
+        db.Index('ix_products_seller_updated', 's_id', 'updated_at'),  # change feed
+    )
     
-    p_id = db.Column(db.String(10), primary_key=True)    # P_ID
+    p_id = db.Column(db.String(20), primary_key=True)    # P_ID, "<seller>-P<nnn>"
     p_name = db.Column(db.String(100), nullable=False)  # P_NAME
     p_price = db.Column(db.Numeric(10, 2), nullable=False)  # P_PRICE
     p_description = db.Column(db.Text, nullable=True)    # P_DESCRIPTION
     p_stock = db.Column(db.Integer, nullable=False, default=0)  # P_STOCK
+    tax_class = db.Column(db.String(20), nullable=False, default='standard', server_default='standard')
     s_id = db.Column(db.String(10), db.ForeignKey('sellers.s_id'), nullable=False)  # S_ID (FK)
+    version_id = db.Column(db.Integer, nullable=False, server_default='1')  # optimistic lock, see __mapper_args__
     
     # Relationships
     invoice_items = db.relationship('InvoiceItem', backref='product', lazy=True)
+
+    __mapper_args__ = {'version_id_col': version_id}
     
     # Properties for template compatibility
     @property
@@ -167,23 +207,13 @@ class Product(db.Model):
             'price': float(self.p_price),
             'description': self.p_description,
             'stock': self.p_stock,
+            'tax_class': self.tax_class,
             'seller_id': self.s_id
         }
 
-class Invoice(db.Model):
-    __tablename__ = 'invoices'
-    
-    invoice_no = db.Column(db.String(20), primary_key=True)  # INVOICE_NO
-    invoice_datetime = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)  # INVOICE_DATETIME
-    status = db.Column(db.String(20), nullable=False, default='pending')  # STATUS
-    tax = db.Column(db.Numeric(10, 2), nullable=False, default=0)  # TAX
-    amount = db.Column(db.Numeric(10, 2), nullable=False)  # AMOUNT
-    s_id = db.Column(db.String(10), db.ForeignKey('sellers.s_id'), nullable=False)  # S_ID (FK)
-    c_id = db.Column(db.String(10), db.ForeignKey('customers.c_id'), nullable=False)  # C_ID (FK)
-    
-    # Relationships
-    invoice_items = db.relationship('InvoiceItem', backref='invoice', lazy=True, cascade='all, delete-orphan')
-    
+class InvoiceMixin:
+    """Display helpers shared by live and archived invoices"""
+
     # Properties for template compatibility
     @property
     def id(self):
@@ -206,6 +236,9 @@ class Invoice(db.Model):
     def customer_email(self):
         return self.customer.c_email
     
+    @property
+    def balance_due(self):
+        return self.amount - self.amount_paid
     
     def to_dict(self):
         return {
@@ -214,6 +247,9 @@ class Invoice(db.Model):
             'status': self.status,
             'tax': float(self.tax),
             'amount': float(self.amount),
+            'amount_paid': float(self.amount_paid),
+            'currency': self.currency,
+            'tax_region': self.tax_region,
             'seller_id': self.s_id,
             'customer_id': self.c_id,
             'customer_name': self.customer.c_name,
@@ -221,16 +257,9 @@ class Invoice(db.Model):
             'items': [item.to_dict() for item in self.invoice_items]
         }
 
-class InvoiceItem(db.Model):
-    """INVOICE_ITEM entity from ER diagram"""
-    __tablename__ = 'invoice_items'
-    
-    item_id = db.Column(db.Integer, primary_key=True, autoincrement=True)  # ITEM_ID
-    invoice_no = db.Column(db.String(20), db.ForeignKey('invoices.invoice_no'), nullable=False)  # INVOICE_NO (FK)
-    p_id = db.Column(db.String(10), db.ForeignKey('products.p_id'), nullable=False)  # P_ID (FK)
-    item_quantity = db.Column(db.Integer, nullable=False)  # ITEM_QUANTITY
-    discount = db.Column(db.Numeric(10, 2), nullable=False, default=0)  # DISCOUNT
-    
+class InvoiceItemMixin:
+    """Display helpers shared by live and archived invoice items"""
+
     # Properties for template compatibility
     @property
     def quantity(self):
@@ -242,17 +271,241 @@ class InvoiceItem(db.Model):
     
     @property
     def price(self):
-        return self.product.p_price
+        """Unit price in the invoice's currency"""
+        return self.product.p_price * self.invoice.exchange_rate
     
     @property
     def total(self):
-        return (self.product.p_price * self.item_quantity) - self.discount
+        return (self.price * self.item_quantity) - self.discount
     
     def to_dict(self):
         return {
             'product_name': self.product.p_name,
             'quantity': self.item_quantity,
-            'price': float(self.product.p_price),
+            'price': float(self.price),
             'discount': float(self.discount),
-            'total': float((self.product.p_price * self.item_quantity) - self.discount)
+            'total': float(self.total)
         }
+
+class Invoice(InvoiceMixin, TrackedMixin, db.Model):
+    __tablename__ = 'invoices'
+    __table_args__ = (
+        db.Index('ix_invoices_seller_amount', 's_id', 'amount'),  # bank reconciliation lookups
+        db.Index('ix_invoices_seller_updated', 's_id', 'updated_at'),  # change feed
+        db.Index('ix_invoices_customer_date', 'c_id', 'invoice_datetime'),  # customer portal
+    )
+    
+    invoice_no = db.Column(db.String(20), primary_key=True)  # INVOICE_NO
+    invoice_datetime = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)  # INVOICE_DATETIME
+    status = db.Column(db.String(20), nullable=False, default='pending')  # STATUS
+    tax = db.Column(db.Numeric(10, 2), nullable=False, default=0)  # TAX
+    amount = db.Column(db.Numeric(10, 2), nullable=False)  # AMOUNT
+    amount_paid = db.Column(db.Numeric(10, 2), nullable=False, default=0, server_default='0')  # sum of payments
+    currency = db.Column(db.String(3), nullable=False, default='INR', server_default='INR')
+    exchange_rate = db.Column(db.Numeric(12, 6), nullable=False, default=1, server_default='1')  # per base unit
+    tax_region = db.Column(db.String(20), nullable=True)  # None: tax was entered by hand
+    s_id = db.Column(db.String(10), db.ForeignKey('sellers.s_id'), nullable=False)  # S_ID (FK)
+    c_id = db.Column(db.String(20), db.ForeignKey('customers.c_id'), nullable=False)  # C_ID (FK)
+    version_id = db.Column(db.Integer, nullable=False, server_default='1')  # optimistic lock, see __mapper_args__
+    
+    # Relationships
+    invoice_items = db.relationship('InvoiceItem', backref='invoice', lazy=True, cascade='all, delete-orphan')
+
+    __mapper_args__ = {'version_id_col': version_id}
+
+class InvoiceItem(InvoiceItemMixin, TrackedMixin, db.Model):
+    """INVOICE_ITEM entity from ER diagram"""
+    __tablename__ = 'invoice_items'
+    
+    item_id = db.Column(db.Integer, primary_key=True, autoincrement=True)  # ITEM_ID
+    invoice_no = db.Column(db.String(20), db.ForeignKey('invoices.invoice_no'), nullable=False)  # INVOICE_NO (FK)
+    p_id = db.Column(db.String(20), db.ForeignKey('products.p_id'), nullable=False, index=True)  # P_ID (FK)
+    item_quantity = db.Column(db.Integer, nullable=False)  # ITEM_QUANTITY
+    discount = db.Column(db.Numeric(10, 2), nullable=False, default=0)  # DISCOUNT
+
+class InvoiceSequence(db.Model):
+    """Last invoice number a seller used in a fiscal year; numbering.py row-locks it to take the next"""
+    __tablename__ = 'invoice_sequences'
+
+    s_id = db.Column(db.String(10), db.ForeignKey('sellers.s_id'), primary_key=True)
+    fiscal_year = db.Column(db.Integer, primary_key=True)  # calendar year the fiscal year starts in
+    last_number = db.Column(db.Integer, nullable=False, default=0)
+
+class CustomerSummary(db.Model):
+    """A customer's invoice counts, balance and newest invoices for the portal; portal.py keeps it current"""
+    __tablename__ = 'customer_summaries'
+
+    c_id = db.Column(db.String(20), db.ForeignKey('customers.c_id'), primary_key=True)
+    s_id = db.Column(db.String(10), db.ForeignKey('sellers.s_id'), nullable=False)
+    invoice_count = db.Column(db.Integer, nullable=False, default=0)
+    paid_count = db.Column(db.Integer, nullable=False, default=0)
+    open_count = db.Column(db.Integer, nullable=False, default=0)  # pending or overdue
+    billed = db.Column(db.Numeric(12, 2), nullable=False, default=0)  # base currency
+    outstanding = db.Column(db.Numeric(12, 2), nullable=False, default=0)  # base currency, open invoices only
+    last_invoice_at = db.Column(db.DateTime, nullable=True)
+    latest = db.Column(db.Text, nullable=False, default='[]')  # JSON list of the newest invoices
+    refreshed_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+class InvoiceDraft(TrackedMixin, db.Model):
+    """An invoice being written, autosaved line by line; drafts.finalize turns it into an Invoice"""
+    __tablename__ = 'invoice_drafts'
+    __table_args__ = (
+        db.Index('uq_invoice_drafts_seller_key', 's_id', 'idempotency_key', unique=True),  # one draft per key
+    )
+
+    id = db.Column(db.String(36), primary_key=True)  # uuid4
+    s_id = db.Column(db.String(10), db.ForeignKey('sellers.s_id'), nullable=False)
+    c_id = db.Column(db.String(20), db.ForeignKey('customers.c_id'), nullable=True)
+    currency = db.Column(db.String(3), nullable=True)  # None: base currency
+    tax_region = db.Column(db.String(20), nullable=True)  # None: tax entered by hand
+    tax = db.Column(db.Numeric(10, 2), nullable=False, default=0)  # used without a tax_region
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    idempotency_key = db.Column(db.String(64), nullable=True)  # set when finalized
+    invoice_no = db.Column(db.String(20), nullable=True)  # the invoice it became
+    version_id = db.Column(db.Integer, nullable=False, server_default='1')
+
+    lines = db.relationship('InvoiceDraftLine', backref='draft', lazy=True, cascade='all, delete-orphan',
+                            order_by='InvoiceDraftLine.position')
+
+    __mapper_args__ = {'version_id_col': version_id}
+
+class InvoiceDraftLine(TrackedMixin, db.Model):
+    __tablename__ = 'invoice_draft_lines'
+
+    draft_id = db.Column(db.String(36), db.ForeignKey('invoice_drafts.id'), primary_key=True)
+    line_id = db.Column(db.String(36), primary_key=True)  # chosen by the client, so edits can name the line
+    position = db.Column(db.Integer, nullable=False, default=0)
+    p_id = db.Column(db.String(20), db.ForeignKey('products.p_id'), nullable=True)  # None: not picked yet
+    item_quantity = db.Column(db.Integer, nullable=False, default=1)
+    discount = db.Column(db.Numeric(10, 2), nullable=False, default=0)
+
+class ArchivedInvoice(InvoiceMixin, TrackedMixin, db.Model):
+    """Paid invoices moved out of the hot invoices table by archive.py"""
+    __tablename__ = 'invoices_archive'
+    __table_args__ = (
+        db.Index('ix_invoices_archive_seller_date', 's_id', 'invoice_datetime'),
+    )
+    
+    invoice_no = db.Column(db.String(20), primary_key=True)
+    invoice_datetime = db.Column(db.DateTime, nullable=False)
+    status = db.Column(db.String(20), nullable=False)
+    tax = db.Column(db.Numeric(10, 2), nullable=False, default=0)
+    amount = db.Column(db.Numeric(10, 2), nullable=False)
+    amount_paid = db.Column(db.Numeric(10, 2), nullable=False, default=0, server_default='0')
+    currency = db.Column(db.String(3), nullable=False, default='INR', server_default='INR')
+    exchange_rate = db.Column(db.Numeric(12, 6), nullable=False, default=1, server_default='1')
+    tax_region = db.Column(db.String(20), nullable=True)
+    s_id = db.Column(db.String(10), db.ForeignKey('sellers.s_id'), nullable=False)
+    c_id = db.Column(db.String(20), db.ForeignKey('customers.c_id'), nullable=False, index=True)
+    archived_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    
+    # Relationships
+    customer = db.relationship('Customer', lazy=True)
+    invoice_items = db.relationship('ArchivedInvoiceItem', backref='invoice', lazy=True, cascade='all, delete-orphan')
+
+class ArchivedInvoiceItem(InvoiceItemMixin, TrackedMixin, db.Model):
+    __tablename__ = 'invoice_items_archive'
+    
+    item_id = db.Column(db.Integer, primary_key=True)
+    invoice_no = db.Column(db.String(20), db.ForeignKey('invoices_archive.invoice_no'), nullable=False, index=True)
+    p_id = db.Column(db.String(20), db.ForeignKey('products.p_id'), nullable=False, index=True)
+    item_quantity = db.Column(db.Integer, nullable=False)
+    discount = db.Column(db.Numeric(10, 2), nullable=False, default=0)
+    
+    # Relationships
+    product = db.relationship('Product', lazy=True)
+
+class RecurringInvoice(TrackedMixin, db.Model):
+    """Invoice template billed again every ``interval_months`` by recurring.py"""
+    __tablename__ = 'recurring_invoices'
+    
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    s_id = db.Column(db.String(10), db.ForeignKey('sellers.s_id'), nullable=False, index=True)
+    c_id = db.Column(db.String(20), db.ForeignKey('customers.c_id'), nullable=False)
+    tax = db.Column(db.Numeric(10, 2), nullable=False, default=0)
+    interval_months = db.Column(db.Integer, nullable=False, default=1)  # 1 = monthly, 3 = quarterly, 12 = yearly
+    day_of_month = db.Column(db.Integer, nullable=False, default=1)  # 1-28, first day the period's invoice is issued
+    start_date = db.Column(db.Date, nullable=False)
+    end_date = db.Column(db.Date, nullable=True)
+    active = db.Column(db.Boolean, nullable=False, default=True)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    
+    # Relationships
+    customer = db.relationship('Customer', lazy=True)
+    items = db.relationship('RecurringInvoiceItem', backref='template', lazy=True, cascade='all, delete-orphan')
+    
+    @property
+    def schedule(self):
+        label = {1: 'Monthly', 3: 'Quarterly', 12: 'Yearly'}.get(self.interval_months, f'Every {self.interval_months} months')
+        return f'{label} on day {self.day_of_month}'
+
+class RecurringInvoiceItem(TrackedMixin, db.Model):
+    __tablename__ = 'recurring_invoice_items'
+    
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    recurring_id = db.Column(db.Integer, db.ForeignKey('recurring_invoices.id'), nullable=False, index=True)
+    p_id = db.Column(db.String(20), db.ForeignKey('products.p_id'), nullable=False, index=True)
+    item_quantity = db.Column(db.Integer, nullable=False)
+    discount = db.Column(db.Numeric(10, 2), nullable=False, default=0)
+    
+    # Relationships
+    product = db.relationship('Product', lazy=True)
+
+class RecurringInvoiceRun(TrackedMixin, db.Model):
+    """One row per template and billing period; the primary key makes generation idempotent"""
+    __tablename__ = 'recurring_invoice_runs'
+    
+    recurring_id = db.Column(db.Integer, db.ForeignKey('recurring_invoices.id'), primary_key=True)
+    period = db.Column(db.Date, primary_key=True)  # first day of the billed month
+    invoice_no = db.Column(db.String(20), nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+class Payment(TrackedMixin, db.Model):
+    """Money received against an invoice; Invoice.amount_paid holds the running total"""
+    __tablename__ = 'payments'
+    __table_args__ = (
+        db.Index('ix_payments_seller_paid_at', 's_id', 'paid_at'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    invoice_no = db.Column(db.String(20), nullable=False, index=True)  # live or archived invoice
+    s_id = db.Column(db.String(10), db.ForeignKey('sellers.s_id'), nullable=False)
+    amount = db.Column(db.Numeric(10, 2), nullable=False)  # negative for reversals
+    paid_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    method = db.Column(db.String(20), nullable=False, default='manual')  # manual, bank, reversal, backfill
+    reference = db.Column(db.String(100), nullable=True, index=True)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+class WebhookEvent(TrackedMixin, db.Model):
+    """Outbox: one row per event and endpoint, written in the same transaction as the change it reports"""
+    __tablename__ = 'webhook_outbox'
+    __table_args__ = (
+        db.Index('ix_webhook_outbox_due', 'delivered_at', 'failed_at', 'next_attempt_at'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    event_id = db.Column(db.String(36), nullable=False, index=True)  # shared by every endpoint's copy
+    event_type = db.Column(db.String(40), nullable=False)  # invoice.created, invoice.updated, invoice.paid
+    endpoint = db.Column(db.String(500), nullable=False)
+    s_id = db.Column(db.String(10), db.ForeignKey('sellers.s_id'), nullable=False)
+    payload = db.Column(db.Text, nullable=False)  # JSON
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    attempts = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    next_attempt_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    delivered_at = db.Column(db.DateTime, nullable=True)
+    failed_at = db.Column(db.DateTime, nullable=True)  # gave up after WEBHOOK_MAX_ATTEMPTS
+    last_error = db.Column(db.String(500), nullable=True)
+
+class Tombstone(db.Model):
+    """Marks a deleted (or archived) invoice, product or customer so the change feed can report it"""
+    __tablename__ = 'tombstones'
+    __table_args__ = (
+        db.Index('ix_tombstones_deleted_at', 'deleted_at'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    resource = db.Column(db.String(20), nullable=False)  # 'invoice', 'product' or 'customer'
+    key = db.Column(db.String(20), nullable=False)  # primary key of the deleted row
+    s_id = db.Column(db.String(10), nullable=True)  # owning seller; None for customers deleted before they had one
+    deleted_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    archived = db.Column(db.Boolean, nullable=False, default=False, server_default='0')  # moved to the archive tables
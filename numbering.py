@@ -0,0 +1,107 @@
+"""Invoice numbers: one gap-free series per seller and fiscal year.
+
+``invoice_sequences`` holds the last number each seller used in each fiscal
+year. ``allocate`` takes the next ones with a single
+``UPDATE ... SET last_number = last_number + n``. The UPDATE locks that
+seller's row until the transaction ends, so two workers can never get the
+same number. Because the counter moves in the same transaction as the
+invoice insert, a rolled-back invoice gives its number back and the series
+has no gaps. Other sellers' rows are not locked, so sellers never wait for
+each other, and no invoice table is counted.
+
+The row stays locked until commit, so allocate as the last step before
+inserting and commit right after. Batch jobs allocate a whole batch at once
+(``count``).
+
+Numbers are built from ``INVOICE_NUMBER_FORMAT`` (default
+``INV-{seller}-{year}-{number:04d}``, e.g. ``INV-S001-2026-0007``). ``year``
+is the calendar year the fiscal year starts in, and fiscal years start in
+``FISCAL_YEAR_START_MONTH``. Invoices numbered before this scheme keep their
+``INV-001`` numbers.
+"""
+import re
+import string
+from datetime import datetime
+from functools import lru_cache
+
+from flask import current_app
+from sqlalchemy import select, update
+
+from constraints import insert_or_ignore
+from models import db, Invoice, InvoiceSequence
+
+FIELD_PATTERNS = {'seller': r'[A-Za-z0-9]+', 'year': r'\d{4}', 'number': r'\d+'}
+LEGACY_REFERENCE = r'INV-\d+'
+
+
+def fiscal_year(moment, start_month):
+    return moment.year if moment.month >= start_month else moment.year - 1
+
+
+def format_number(fmt, s_id, year, number):
+    return fmt.format(seller=s_id, year=year, number=number)
+
+
+def allocate(s_id, count=1, when=None):
+    """The next ``count`` invoice numbers of ``s_id`` for the fiscal year of ``when`` (default: now).
+
+    Runs in the caller's transaction and row-locks the seller's counter until it ends.
+    """
+    config = current_app.config
+    year = fiscal_year(when or datetime.utcnow(), config['FISCAL_YEAR_START_MONTH'])
+    sequence = InvoiceSequence.__table__
+    bump = (update(sequence)
+            .where(sequence.c.s_id == s_id, sequence.c.fiscal_year == year)
+            .values(last_number=sequence.c.last_number + count))
+    last = _bump(bump, sequence)
+    if last is None:
+        # First invoice of the year: create the counter (a concurrent first invoice may beat us to it)
+        insert_or_ignore(InvoiceSequence, {'s_id': s_id, 'fiscal_year': year, 'last_number': 0})
+        last = _bump(bump, sequence)
+    return [format_number(config['INVOICE_NUMBER_FORMAT'], s_id, year, number)
+            for number in range(last - count + 1, last + 1)]
+
+
+def _bump(bump, sequence):
+    """Run the UPDATE and return the new ``last_number``, or None if the row doesn't exist yet."""
+    if db.session.get_bind(clause=bump).dialect.update_returning:
+        return db.session.execute(bump.returning(sequence.c.last_number)).scalar()
+    if db.session.execute(bump).rowcount == 0:
+        return None
+    # The UPDATE holds the row lock, so this reads our own increment
+    return db.session.execute(select(sequence.c.last_number).where(bump.whereclause)).scalar()
+
+
+def next_number(s_id, when=None):
+    return allocate(s_id, 1, when)[0]
+
+
+@lru_cache(maxsize=8)
+def reference_pattern(fmt):
+    """Regex finding invoice numbers of format ``fmt`` (or older ``INV-001`` ones) in free text."""
+    parts = []
+    for literal, field, _, _ in string.Formatter().parse(fmt):
+        parts.append(re.escape(literal))
+        if field is not None:
+            parts.append(FIELD_PATTERNS[field])
+    return re.compile(f"{''.join(parts)}|{LEGACY_REFERENCE}", re.IGNORECASE)
+
+
+def invoice_reference():
+    return reference_pattern(current_app.config['INVOICE_NUMBER_FORMAT'])
+
+
+def init_app(app):
+    fmt = app.config['INVOICE_NUMBER_FORMAT']
+    try:
+        sample = format_number(fmt, 'S9999', 2099, 99999)
+        reference_pattern(fmt)
+    except (KeyError, IndexError, ValueError) as error:
+        raise ValueError(f'INVOICE_NUMBER_FORMAT {fmt!r} may only use {{seller}}, {{year}} and {{number}}: {error}')
+    if '{number' not in fmt:
+        raise ValueError(f'INVOICE_NUMBER_FORMAT {fmt!r} must contain {{number}}')
+    if '/' in sample:
+        raise ValueError(f'INVOICE_NUMBER_FORMAT {fmt!r} must not contain "/" (invoice numbers are used in URLs)')
+    if len(sample) > Invoice.invoice_no.type.length:
+        raise ValueError(f'INVOICE_NUMBER_FORMAT {fmt!r} gives numbers longer than '
+                         f'{Invoice.invoice_no.type.length} characters ({sample})')
@@ -0,0 +1,262 @@
+"""Payments ledger.
+
+Every amount received against an invoice is a ``Payment`` row, and
+``Invoice.amount_paid`` is kept as a running total of those rows so
+listings, the dashboard and statements read one column instead of summing
+the ledger. An invoice turns ``paid`` once its payments cover the amount;
+partial payments leave it pending/overdue with a smaller balance due.
+Marking an invoice unpaid again writes a ``reversal`` entry so the ledger
+and the rollup never disagree.
+
+Bank statement lines are reconciled in bulk. A line is matched by the
+invoice number in its reference if there is one, otherwise by its amount
+against the seller's open, unpaid invoices (via the ``(s_id, amount)``
+index). A line is identified by its date, amount and reference. Lines already
+imported as bank payments, and repeats of a line within the same file, are
+skipped, so the same export can be uploaded twice while instalments that
+carry the same reference on different days (or for different amounts) are
+all recorded. All lookups for a file are a fixed number of ``IN`` queries,
+however many lines it has.
+
+    flask --app app reconcile-payments SELLER_ID statement.csv
+"""
+import csv
+import io
+from collections import defaultdict
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+
+import click
+from sqlalchemy import bindparam, case, func, insert, select, update
+
+import numbering
+import webhooks
+from models import db, Invoice, InvoiceItem, ArchivedInvoice, Payment, Product
+
+OPEN_STATUSES = ('pending', 'overdue')
+
+
+def adjust_stock(invoice, old_status, new_status):
+    """Take stock out when an invoice becomes paid and put it back when it stops being paid.
+
+    Stock moves by a relative UPDATE (``p_stock = p_stock - n``), so two invoices paid at the same time
+    both count without conflicting. The product's version is still bumped, so a product edit form
+    opened before the change can't save the old stock level over it.
+    """
+    if old_status != 'paid' and new_status == 'paid':
+        sign = -1
+    elif old_status == 'paid' and new_status != 'paid':
+        sign = 1
+    else:
+        return
+    changes = defaultdict(int)
+    for item in invoice.invoice_items:
+        changes[item.p_id] += sign * item.item_quantity
+    if not changes:
+        return
+    product = Product.__table__.c
+    stock = product.p_stock + bindparam('change')
+    db.session.execute(
+        Product.__table__.update().where(product.p_id == bindparam('product_id'))
+        .values(p_stock=case((stock > 0, stock), else_=0), version_id=product.version_id + 1),
+        [{'product_id': p_id, 'change': change} for p_id, change in changes.items()],
+    )
+    for item in invoice.invoice_items:
+        db.session.expire(item.product, ['p_stock', 'version_id'])
+
+
+def record_payments(seller_id, entries):
+    """Apply ``entries`` (dicts with invoice_no, amount and optional paid_at, method, reference).
+
+    Returns the ``Payment`` objects added; entries for unknown invoices are ignored. The caller commits.
+    """
+    numbers = {entry['invoice_no'] for entry in entries}
+    invoices = {
+        invoice.invoice_no: invoice
+        for invoice in Invoice.query
+        .filter(Invoice.s_id == seller_id, Invoice.invoice_no.in_(numbers))
+        .options(db.selectinload(Invoice.invoice_items).joinedload(InvoiceItem.product))
+    }
+    payments, paid = [], []
+    for entry in entries:
+        invoice = invoices.get(entry['invoice_no'])
+        if invoice is None:
+            continue
+        payment = Payment(
+            invoice_no=invoice.invoice_no,
+            s_id=seller_id,
+            amount=entry['amount'],
+            paid_at=entry.get('paid_at') or datetime.utcnow(),
+            method=entry.get('method', 'manual'),
+            reference=entry.get('reference'),
+        )
+        payments.append(payment)
+        invoice.amount_paid += payment.amount
+        if invoice.status in OPEN_STATUSES and invoice.amount_paid >= invoice.amount:
+            adjust_stock(invoice, invoice.status, 'paid')
+            invoice.status = 'paid'
+            paid.append(invoice)
+    db.session.add_all(payments)
+    webhooks.publish('invoice.paid', paid)
+    return payments
+
+
+def settle(invoice):
+    """Record a payment for whatever is still due (the seller marked the invoice paid by hand)."""
+    balance = invoice.amount - invoice.amount_paid
+    if balance > 0:
+        db.session.add(Payment(invoice_no=invoice.invoice_no, s_id=invoice.s_id, amount=balance, method='manual'))
+        invoice.amount_paid = invoice.amount
+
+
+def reverse(invoice):
+    """Cancel out everything paid so far (the seller moved the invoice back out of paid)."""
+    if invoice.amount_paid:
+        db.session.add(Payment(invoice_no=invoice.invoice_no, s_id=invoice.s_id, amount=-invoice.amount_paid,
+                               method='reversal'))
+        invoice.amount_paid = 0
+
+
+def invoice_payments(invoice_no):
+    return Payment.query.filter_by(invoice_no=invoice_no).order_by(Payment.paid_at.asc(), Payment.id.asc()).all()
+
+
+def parse_bank_csv(text):
+    """Parse a ``date,amount,reference`` CSV (header row required). Returns ``(lines, errors)``."""
+    lines, errors = [], []
+    reader = csv.DictReader(io.StringIO(text))
+    for number, row in enumerate(reader, start=2):
+        row = {(key or '').strip().lower(): (value or '').strip() for key, value in row.items()}
+        try:
+            amount = Decimal(row.get('amount', '')).quantize(Decimal('0.01'))
+            paid_at = datetime.strptime(row.get('date', ''), '%Y-%m-%d')
+        except (InvalidOperation, ValueError):
+            errors.append(f'Line {number}: expected a YYYY-MM-DD date and an amount')
+            continue
+        if amount <= 0:
+            errors.append(f'Line {number}: amount must be positive')
+            continue
+        lines.append({'line': number, 'paid_at': paid_at, 'amount': amount, 'reference': row.get('reference') or None})
+    return lines, errors
+
+
+def reconcile(seller_id, lines):
+    """Match bank ``lines`` to invoices and record the matched ones as payments.
+
+    Returns ``(matched, unmatched, duplicates)``; ``matched`` pairs each line with its invoice number.
+    """
+    dates = {line['paid_at'] for line in lines}
+    seen = set(db.session.execute(
+        select(Payment.paid_at, Payment.amount, Payment.reference)
+        .where(Payment.s_id == seller_id, Payment.method == 'bank', Payment.paid_at.in_(dates))
+    ).tuples()) if dates else set()
+    duplicates, pending = [], []
+    for line in lines:
+        identity = (line['paid_at'], line['amount'], line['reference'])
+        if identity in seen:
+            duplicates.append(line)
+        else:
+            seen.add(identity)  # a repeat further down the same file is a duplicate too
+            pending.append(line)
+
+    open_invoices = select(Invoice.invoice_no, Invoice.amount, Invoice.amount_paid).where(
+        Invoice.s_id == seller_id, Invoice.status.in_(OPEN_STATUSES))
+
+    # 1. By invoice number in the reference
+    wanted = {}
+    reference = numbering.invoice_reference()
+    for line in pending:
+        found = reference.search(line['reference'] or '')
+        if found:
+            wanted[id(line)] = found.group(0).upper()
+    by_number = {
+        row.invoice_no: row
+        for row in db.session.execute(open_invoices.where(Invoice.invoice_no.in_(set(wanted.values()))))
+    } if wanted else {}
+
+    # 2. By exact amount against open invoices with nothing paid yet
+    unreferenced = [line for line in pending if wanted.get(id(line)) not in by_number]
+    by_amount = defaultdict(list)
+    if unreferenced:
+        for row in db.session.execute(
+            open_invoices.where(Invoice.amount.in_({line['amount'] for line in unreferenced}),
+                                Invoice.amount_paid == 0)
+            .order_by(Invoice.invoice_datetime.asc())
+        ):
+            by_amount[row.amount].append(row.invoice_no)
+
+    matched, unmatched, used = [], [], set()
+    for line in pending:
+        invoice_no = wanted.get(id(line))
+        if invoice_no not in by_number:
+            candidates = [no for no in by_amount.get(line['amount'], []) if no not in used]
+            # Only match on amount when it's unambiguous
+            invoice_no = candidates[0] if len(candidates) == 1 else None
+        if invoice_no is None:
+            unmatched.append(line)
+            continue
+        used.add(invoice_no)
+        matched.append((line, invoice_no))
+
+    record_payments(seller_id, [
+        {'invoice_no': invoice_no, 'amount': line['amount'], 'paid_at': line['paid_at'],
+         'method': 'bank', 'reference': line['reference']}
+        for line, invoice_no in matched
+    ])
+    return matched, unmatched, duplicates
+
+
+def backfill_paid_invoices():
+    """Give invoices that were marked paid before the ledger existed a matching payment and rollup."""
+    for model in (Invoice, ArchivedInvoice):
+        rows = db.session.execute(
+            select(model.invoice_no, model.s_id, model.amount, model.invoice_datetime)
+            .where(model.status == 'paid', model.amount_paid == 0)
+        ).all()
+        if not rows:
+            continue
+        db.session.execute(insert(Payment), [
+            {'invoice_no': no, 's_id': s_id, 'amount': amount, 'paid_at': issued, 'method': 'backfill'}
+            for no, s_id, amount, issued in rows
+        ])
+        db.session.execute(
+            update(model).where(model.status == 'paid', model.amount_paid == 0).values(amount_paid=model.amount)
+        )
+    db.session.commit()
+
+
+def seller_totals(seller_id):
+    """Invoice counts and money totals for the dashboard, from the rollup columns, in the base currency."""
+    totals = {'total_invoices': 0, 'paid_invoices': 0, 'unpaid_invoices': 0,
+              'revenue_collected': Decimal('0'), 'revenue_due': Decimal('0')}
+    for model in (Invoice, ArchivedInvoice):
+        for status, count, paid, due in db.session.execute(
+            select(model.status, func.count(), func.coalesce(func.sum(model.amount_paid / model.exchange_rate), 0),
+                   func.coalesce(func.sum((model.amount - model.amount_paid) / model.exchange_rate), 0))
+            .where(model.s_id == seller_id)
+            .group_by(model.status)
+        ):
+            totals['total_invoices'] += count
+            totals['revenue_collected'] += Decimal(str(paid))
+            if status == 'paid':
+                totals['paid_invoices'] += count
+            elif status in OPEN_STATUSES:
+                totals['unpaid_invoices'] += count
+                totals['revenue_due'] += Decimal(str(due))
+    return totals
+
+
+def init_app(app):
+    @app.cli.command('reconcile-payments')
+    @click.argument('seller_id')
+    @click.argument('statement', type=click.File('r', encoding='utf-8-sig'))
+    def reconcile_payments_command(seller_id, statement):
+        """Match a bank statement CSV (date,amount,reference) to a seller's invoices."""
+        lines, errors = parse_bank_csv(statement.read())
+        for error in errors:
+            click.echo(error, err=True)
+        matched, unmatched, duplicates = reconcile(seller_id, lines)
+        db.session.commit()
+        click.echo(f"Matched {len(matched)}, unmatched {len(unmatched)}, already imported {len(duplicates)}.")
+        for line in unmatched:
+            click.echo(f"  unmatched line {line['line']}: {line['amount']} {line['reference'] or ''}")
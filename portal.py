@@ -0,0 +1,274 @@
+"""Customer portal.
+
+Customers sign in with their email and the password a seller set for them
+on the edit-customer page. Each seller keeps their own record of a customer
+(``S001-C004``), so one person can have several records. The portal shows
+every record whose own password matches, in the main database and in every
+seller database. Records with a different password are never shown, so one
+seller can't give someone access to another seller's invoices by reusing
+their email.
+
+The dashboard reads only ``customer_summaries``. Each customer record has
+one row there with its invoice counts, total billed and outstanding balance
+(in the base currency), and its newest invoices. A row is updated in the
+same transaction that changes that customer's invoices:
+
+- An ``after_flush`` listener notes the customer of every invoice the
+  session inserts, updates or deletes.
+- Just before commit, those customers' rows are locked and recomputed from
+  their invoices alone, using the ``(c_id, invoice_datetime)`` index.
+
+Because the rows are locked first, two transactions billing the same
+customer run one after the other, and the second one counts the first one's
+invoice. Code that writes invoices with Core statements (recurring
+generation, integrity fixes) calls ``mark_changed`` instead. Customer
+traffic never aggregates ``invoices``.
+
+After changing invoices with SQL by hand, or moving a seller's rows to a
+database of their own, rebuild the rows:
+
+    flask --app app rebuild-customer-summaries
+"""
+import json
+from collections import defaultdict, namedtuple
+from datetime import datetime
+from decimal import Decimal
+from itertools import chain
+
+import click
+from flask import g, session
+from sqlalchemy import bindparam, case, event, func, inspect, select, union_all, update
+
+import tenants
+from constraints import insert_or_ignore
+from models import db, Customer, CustomerSummary, Invoice, ArchivedInvoice, Seller
+from replicas import RoutingSession
+from statements import OPEN_STATUSES
+
+LATEST_INVOICES = 10
+CHANGED_KEY = 'portal_changed_customers'
+CENT = Decimal('0.01')
+
+PortalInvoiceRow = namedtuple('PortalInvoiceRow', ['id', 'date', 'amount', 'currency', 'status', 'seller_name'])
+
+
+def mark_changed(customers, db_session=None):
+    """Recompute the summaries of ``customers`` (``(s_id, c_id)`` pairs) when the session commits."""
+    (db_session or db.session).info.setdefault(CHANGED_KEY, set()).update(customers)
+
+
+@event.listens_for(RoutingSession, 'after_flush')
+def _note_invoices(db_session, flush_context):
+    changed = set()
+    for obj in chain(db_session.new, db_session.dirty, db_session.deleted):
+        if isinstance(obj, (Invoice, ArchivedInvoice)):
+            changed.add((obj.s_id, obj.c_id))
+            # An invoice moved to another customer changes the old customer's totals too
+            changed.update((obj.s_id, c_id) for c_id in inspect(obj).attrs.c_id.history.deleted if c_id)
+    if changed:
+        mark_changed(changed, db_session)
+
+
+@event.listens_for(RoutingSession, 'before_commit')
+def _refresh_on_commit(db_session):
+    db_session.flush()
+    changed = db_session.info.pop(CHANGED_KEY, None)
+    if changed:
+        refresh(changed, db_session)
+
+
+@event.listens_for(RoutingSession, 'after_soft_rollback')
+def _forget_changes(db_session, previous_transaction):
+    if previous_transaction.parent is None:
+        db_session.info.pop(CHANGED_KEY, None)
+
+
+def _by_database(customers):
+    """``{database: {c_id: s_id}}``, where database is the seller with their own database or None (the main one)."""
+    own = tenants.tenant_engines()
+    groups = defaultdict(dict)
+    for s_id, c_id in customers:
+        groups[s_id if s_id in own else None][c_id] = s_id
+    return groups
+
+
+def refresh(customers, db_session=None):
+    """Recompute the summaries of ``customers`` (``(s_id, c_id)`` pairs) in the current transaction."""
+    db_session = db_session or db.session()
+    for database, sellers in sorted(_by_database(customers).items(), key=lambda group: group[0] or ''):
+        with tenants.scope(database):
+            _refresh(db_session, sellers, {'bind': tenants.bind_for(database)})
+
+
+def _refresh(db_session, sellers, bind):
+    summary = CustomerSummary.__table__
+    c_ids = sorted(sellers)
+    now = datetime.utcnow()
+
+    # Lock the rows (creating missing ones) before reading any invoices, so a concurrent commit for the same
+    # customers waits here and then reads this one's invoices as well
+    existing = set(db_session.execute(select(summary.c.c_id).where(summary.c.c_id.in_(c_ids)),
+                                      bind_arguments=bind).scalars())
+    for c_id in c_ids:
+        if c_id not in existing:
+            insert_or_ignore(CustomerSummary, {'c_id': c_id, 's_id': sellers[c_id], 'refreshed_at': now})
+    db_session.execute(update(summary).where(summary.c.c_id.in_(c_ids)).values(refreshed_at=now),
+                       bind_arguments=bind)
+
+    invoices = union_all(*(
+        select(model.c_id, model.invoice_no, model.invoice_datetime, model.status, model.amount, model.currency,
+               (model.amount / model.exchange_rate).label('amount_base'),
+               case((model.status.in_(OPEN_STATUSES), (model.amount - model.amount_paid) / model.exchange_rate),
+                    else_=0).label('due_base'))
+        .where(model.c_id.in_(c_ids))
+        for model in (Invoice, ArchivedInvoice)
+    )).subquery()
+    totals = {row.c_id: row for row in db_session.execute(
+        select(invoices.c.c_id, func.count().label('invoice_count'),
+               func.count(case((invoices.c.status == 'paid', 1))).label('paid_count'),
+               func.count(case((invoices.c.status.in_(OPEN_STATUSES), 1))).label('open_count'),
+               func.coalesce(func.sum(invoices.c.amount_base), 0).label('billed'),
+               func.coalesce(func.sum(invoices.c.due_base), 0).label('outstanding'),
+               func.max(invoices.c.invoice_datetime).label('last_invoice_at'))
+        .group_by(invoices.c.c_id),
+        bind_arguments=bind,
+    )}
+    position = func.row_number().over(partition_by=invoices.c.c_id,
+                                      order_by=(invoices.c.invoice_datetime.desc(), invoices.c.invoice_no.desc()))
+    ranked = select(invoices.c.c_id, invoices.c.invoice_no, invoices.c.invoice_datetime, invoices.c.amount,
+                    invoices.c.currency, invoices.c.status, position.label('position')).subquery()
+    latest = defaultdict(list)
+    for row in db_session.execute(select(ranked).where(ranked.c.position <= LATEST_INVOICES)
+                                  .order_by(ranked.c.c_id, ranked.c.position), bind_arguments=bind):
+        latest[row.c_id].append({'id': row.invoice_no, 'at': row.invoice_datetime.isoformat(),
+                                 'amount': str(row.amount), 'currency': row.currency, 'status': row.status})
+
+    values = []
+    for c_id in c_ids:
+        row = totals.get(c_id)
+        values.append({
+            'customer_id': c_id,
+            'invoice_count': row.invoice_count if row else 0,
+            'paid_count': row.paid_count if row else 0,
+            'open_count': row.open_count if row else 0,
+            'billed': Decimal(str(row.billed)).quantize(CENT) if row else 0,
+            'outstanding': Decimal(str(row.outstanding)).quantize(CENT) if row else 0,
+            'last_invoice_at': row.last_invoice_at if row else None,
+            'latest': json.dumps(latest[c_id]),
+        })
+    db_session.execute(update(summary).where(summary.c.c_id == bindparam('customer_id')), values,
+                       bind_arguments=bind)
+
+
+def rebuild_summaries(batch_size=500):
+    """Recompute every customer's summary, ``batch_size`` customers per transaction. Returns how many."""
+    own = tenants.tenant_engines()
+    total = 0
+    for database in [None, *sorted(own)]:
+        with tenants.scope(database):
+            query = select(Customer.s_id, Customer.c_id).where(Customer.s_id.isnot(None)).order_by(Customer.c_id)
+            if database is None and own:
+                # Their rows are summarised in their own database
+                query = query.where(Customer.s_id.notin_(own))
+            customers = db.session.execute(query).all()
+        for start in range(0, len(customers), batch_size):
+            mark_changed(customers[start:start + batch_size])
+            db.session.commit()
+        total += len(customers)
+    return total
+
+
+def find_accounts(email, password):
+    """The customer records with this email whose password matches, from the main and every seller database."""
+    own = tenants.tenant_engines()
+    accounts = []
+    for database in [None, *sorted(own)]:
+        with tenants.scope(database):
+            query = Customer.query.filter(Customer.c_email == email, Customer.s_id.isnot(None))
+            if database is None and own:
+                query = query.filter(Customer.s_id.notin_(own))
+            accounts.extend(customer for customer in query.order_by(Customer.c_id)
+                            if customer.check_password(password))
+    return accounts
+
+
+def _signed_in_accounts():
+    return _by_database((s_id, c_id) for c_id, s_id in session.get('customer_accounts', []))
+
+
+def _seller_names(seller_ids):
+    if not seller_ids:
+        return {}
+    return dict(db.session.execute(select(Seller.s_id, Seller.s_name).where(Seller.s_id.in_(seller_ids))).all())
+
+
+def dashboard():
+    """``(stats, invoices)`` for the signed-in customer: totals over all their records and the newest invoices.
+
+    Reads the summary rows only.
+    """
+    stats = {'total_invoices': 0, 'paid_invoices': 0, 'pending_invoices': 0,
+             'total_amount': Decimal('0'), 'outstanding': Decimal('0')}
+    latest = []
+    for database, accounts in _signed_in_accounts().items():
+        with tenants.scope(database):
+            for summary in CustomerSummary.query.filter(CustomerSummary.c_id.in_(accounts)):
+                stats['total_invoices'] += summary.invoice_count
+                stats['paid_invoices'] += summary.paid_count
+                stats['pending_invoices'] += summary.open_count
+                stats['total_amount'] += summary.billed
+                stats['outstanding'] += summary.outstanding
+                latest.extend((entry, summary.s_id) for entry in json.loads(summary.latest))
+    latest.sort(key=lambda pair: (pair[0]['at'], pair[0]['id']), reverse=True)
+    latest = latest[:LATEST_INVOICES]
+    names = _seller_names({s_id for _, s_id in latest})
+    return stats, [
+        PortalInvoiceRow(entry['id'], entry['at'][:10], Decimal(entry['amount']), entry['currency'], entry['status'],
+                         names.get(s_id))
+        for entry, s_id in latest
+    ]
+
+
+def invoices():
+    """Every invoice of the signed-in customer, live and archived, newest first (by the customer index)."""
+    rows = []
+    for database, accounts in _signed_in_accounts().items():
+        with tenants.scope(database):
+            rows.extend(db.session.execute(union_all(*(
+                select(model.invoice_no, model.invoice_datetime, model.amount, model.currency, model.status,
+                       model.s_id).where(model.c_id.in_(accounts))
+                for model in (Invoice, ArchivedInvoice)
+            ))).all())
+    rows.sort(key=lambda row: (row.invoice_datetime, row.invoice_no), reverse=True)
+    names = _seller_names({row.s_id for row in rows})
+    return [PortalInvoiceRow(no, dt.strftime('%Y-%m-%d'), amount, currency, status, names.get(s_id))
+            for no, dt, amount, currency, status, s_id in rows]
+
+
+def customer_invoice(invoice_no):
+    """The signed-in customer's invoice ``invoice_no`` (live or archived), or None if it isn't theirs.
+
+    The rest of the request is scoped to the invoice's seller, so its items and customer load from the
+    seller's database.
+    """
+    for database, accounts in _signed_in_accounts().items():
+        invoice = None
+        with tenants.scope(database):
+            for model in (Invoice, ArchivedInvoice):
+                invoice = model.query.filter(model.invoice_no == invoice_no, model.c_id.in_(accounts)).first()
+                if invoice is not None:
+                    break
+        if invoice is not None:
+            g.tenant_id = invoice.s_id
+            g.tenant_engine = tenants.tenant_engines().get(invoice.s_id)
+            return invoice
+    return None
+
+
+def init_app(app):
+    @app.cli.command('rebuild-customer-summaries')
+    @click.option('--batch-size', type=int, default=500, show_default=True, help='Customers per transaction.')
+    def rebuild_customer_summaries_command(batch_size):
+        """Recompute the customer portal's per-customer summaries from the invoices."""
+        count = rebuild_summaries(max(1, batch_size))
+        click.echo(f"Rebuilt the summaries of {count} customer(s).")
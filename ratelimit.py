@@ -0,0 +1,167 @@
+"""Rate limiting and admission control for expensive routes.
+
+Routes are grouped into classes (``pdf``, ``export``, ``search``). Each
+signed-in user gets a token bucket per class: ``RATE_LIMIT_<CLASS>`` as
+``<requests>/<seconds>`` is both the burst size and the refill rate.
+``CONCURRENCY_LIMIT_<CLASS>`` caps how many of one user's requests of that
+class run at the same time. Either way the request is turned away with
+``429 Too Many Requests`` and a ``Retry-After`` header before any work is
+done, so one busy seller can't tie up every worker.
+
+Counters live in this process by default. With several gunicorn workers
+or hosts, set ``RATE_LIMIT_STORAGE_URL=redis://...`` (needs the ``redis``
+package) so every worker draws from the same buckets. Both backends have
+the same three methods, so tests or a single-box deploy can swap in
+``MemoryBackend``.
+"""
+import math
+import threading
+import time
+from collections import Counter
+from functools import wraps
+
+from flask import current_app, request, session
+from werkzeug.exceptions import TooManyRequests
+
+ROUTE_CLASSES = ('pdf', 'export', 'search')
+
+# Seconds a client is told to wait when it hits a concurrency cap
+BUSY_RETRY_AFTER = 1
+
+
+def parse_rate(value):
+    """``'30/60'`` -> ``(30, 0.5)``: burst size and tokens added per second."""
+    requests, seconds = value.split('/')
+    return int(requests), int(requests) / float(seconds)
+
+
+class MemoryBackend:
+    """Buckets and in-flight counts for this process only."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._buckets = {}
+        self._in_flight = Counter()
+
+    def take(self, key, capacity, per_second):
+        """Take a token. Returns 0 if there was one, else the seconds until there will be."""
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.get(key, (capacity, now))
+            tokens = min(capacity, tokens + (now - updated) * per_second)
+            if tokens >= 1:
+                self._buckets[key] = (tokens - 1, now)
+                return 0
+            self._buckets[key] = (tokens, now)
+        return (1 - tokens) / per_second
+
+    def enter(self, key, limit):
+        with self._lock:
+            if self._in_flight[key] >= limit:
+                return False
+            self._in_flight[key] += 1
+            return True
+
+    def leave(self, key):
+        with self._lock:
+            self._in_flight[key] -= 1
+            if self._in_flight[key] <= 0:
+                del self._in_flight[key]
+
+
+# Refill and take in one round trip; Redis's clock keeps workers consistent
+_TAKE_SCRIPT = """
+local capacity = tonumber(ARGV[1])
+local per_second = tonumber(ARGV[2])
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local tokens = tonumber(bucket[1]) or capacity
+local updated = tonumber(bucket[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - updated) * per_second)
+local wait = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+else
+    wait = (1 - tokens) / per_second
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated', tostring(now))
+redis.call('EXPIRE', KEYS[1], math.ceil(capacity / per_second) + 1)
+return tostring(wait)
+"""
+
+
+class RedisBackend:
+    """Buckets and in-flight counts shared by every worker through Redis."""
+
+    # In-flight counters expire in case a worker dies mid-request
+    IN_FLIGHT_TTL = 300
+
+    def __init__(self, url):
+        import redis
+        self._redis = redis.Redis.from_url(url)
+        self._take = self._redis.register_script(_TAKE_SCRIPT)
+
+    def take(self, key, capacity, per_second):
+        return float(self._take(keys=[f'ratelimit:{key}'], args=[capacity, per_second]))
+
+    def enter(self, key, limit):
+        name = f'inflight:{key}'
+        pipe = self._redis.pipeline()
+        pipe.incr(name)
+        pipe.expire(name, self.IN_FLIGHT_TTL)
+        count, _ = pipe.execute()
+        if count > limit:
+            self._redis.decr(name)
+            return False
+        return True
+
+    def leave(self, key):
+        self._redis.decr(f'inflight:{key}')
+
+
+class RateLimiter:
+    def __init__(self, config):
+        self.enabled = config['RATE_LIMIT_ENABLED']
+        self.rates = {name: parse_rate(config['RATE_LIMITS'][name]) for name in ROUTE_CLASSES}
+        self.concurrency = dict(config['CONCURRENCY_LIMITS'])
+        url = config.get('RATE_LIMIT_STORAGE_URL')
+        self.backend = RedisBackend(url) if url else MemoryBackend()
+
+
+def _client_key(route_class):
+    user = session.get('user_id') or request.remote_addr
+    return f'{route_class}:{user}'
+
+
+def limited(route_class):
+    """Rate-limit and cap concurrent requests of ``route_class`` per user."""
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            limiter = current_app.extensions['rate_limiter']
+            if not limiter.enabled:
+                return f(*args, **kwargs)
+            key = _client_key(route_class)
+            wait = limiter.backend.take(key, *limiter.rates[route_class])
+            if wait > 0:
+                raise TooManyRequests(retry_after=math.ceil(wait))
+            if not limiter.backend.enter(key, limiter.concurrency[route_class]):
+                raise TooManyRequests(retry_after=BUSY_RETRY_AFTER)
+            try:
+                response = current_app.make_response(f(*args, **kwargs))
+            except BaseException:
+                limiter.backend.leave(key)
+                raise
+            if response.is_streamed and not response.direct_passthrough:
+                # A generated body (CSV export) is still being produced after the view returns
+                response.call_on_close(lambda: limiter.backend.leave(key))
+            else:
+                limiter.backend.leave(key)
+            return response
+        return decorated_function
+    return decorator
+
+
+def init_app(app):
+    app.extensions['rate_limiter'] = RateLimiter(app.config)
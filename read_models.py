@@ -0,0 +1,132 @@
+"""Read models for the seller listing pages and pickers.
+
+Listings only need a handful of display fields per record, so instead of
+hydrating ORM entities (and walking relationship properties such as
+``Invoice.customer_name`` row by row) they run a single column-projected
+``select()`` and get back plain named tuples. The tuples carry the same
+attribute names the templates already use, so a row renders identically
+whether it came from here or from a model instance.
+"""
+from collections import namedtuple
+
+from sqlalchemy import select
+
+from models import db, Customer, Product, Invoice, ArchivedInvoice
+
+InvoiceRow = namedtuple('InvoiceRow', ['id', 'customer_name', 'customer_email', 'date', 'amount', 'amount_paid',
+                                       'currency', 'status'])
+CustomerRow = namedtuple('CustomerRow', ['id', 'name', 'email', 'phone', 'address'])
+ProductRow = namedtuple('ProductRow', ['id', 'name', 'price', 'stock', 'description', 'tax_class'])
+CustomerInvoiceRow = namedtuple('CustomerInvoiceRow', ['id', 'date', 'amount', 'currency', 'status'])
+CustomerOption = namedtuple('CustomerOption', ['id', 'name', 'email'])
+
+
+def invoice_list_query(seller_id):
+    """Projection behind the seller invoice listing; callers add filters and ordering."""
+    return (
+        select(
+            Invoice.invoice_no,
+            Customer.c_name,
+            Customer.c_email,
+            Invoice.invoice_datetime,
+            Invoice.amount,
+            Invoice.amount_paid,
+            Invoice.currency,
+            Invoice.status,
+        )
+        .join(Customer, Customer.c_id == Invoice.c_id)
+        .where(Invoice.s_id == seller_id)
+    )
+
+
+def archived_invoice_list_query(seller_id):
+    """Same projection as ``invoice_list_query`` over the archive tables."""
+    return (
+        select(
+            ArchivedInvoice.invoice_no,
+            Customer.c_name,
+            Customer.c_email,
+            ArchivedInvoice.invoice_datetime,
+            ArchivedInvoice.amount,
+            ArchivedInvoice.amount_paid,
+            ArchivedInvoice.currency,
+            ArchivedInvoice.status,
+        )
+        .join(Customer, Customer.c_id == ArchivedInvoice.c_id)
+        .where(ArchivedInvoice.s_id == seller_id)
+    )
+
+
+def customer_list_query():
+    return select(
+        Customer.c_id,
+        Customer.c_name,
+        Customer.c_email,
+        Customer.c_phone_no,
+        Customer.c_address,
+    )
+
+
+def product_list_query(seller_id):
+    return select(
+        Product.p_id,
+        Product.p_name,
+        Product.p_price,
+        Product.p_stock,
+        Product.p_description,
+        Product.tax_class,
+    ).where(Product.s_id == seller_id)
+
+
+def customer_invoice_list_query(seller_id, customer_id):
+    return select(
+        Invoice.invoice_no,
+        Invoice.invoice_datetime,
+        Invoice.amount,
+        Invoice.currency,
+        Invoice.status,
+    ).where(Invoice.s_id == seller_id, Invoice.c_id == customer_id)
+
+
+def get_customer(customer_id):
+    """Single customer as a ``CustomerRow``, or ``None``."""
+    row = db.session.execute(customer_list_query().where(Customer.c_id == customer_id)).first()
+    return CustomerRow(*row) if row else None
+
+
+def customer_options():
+    """Customers for the invoice form's select box; skips the address column."""
+    stmt = select(Customer.c_id, Customer.c_name, Customer.c_email).order_by(Customer.c_name.asc())
+    return [CustomerOption(*row) for row in db.session.execute(stmt)]
+
+
+def product_options(seller_id):
+    """Seller's products as the JSON-ready dicts the invoice form script expects."""
+    stmt = select(Product.p_id, Product.p_name, Product.p_price, Product.p_stock, Product.tax_class).where(
+        Product.s_id == seller_id)
+    return [
+        {'id': p_id, 'name': name, 'price': float(price), 'stock': stock, 'tax_class': tax_class}
+        for p_id, name, price, stock, tax_class in db.session.execute(stmt)
+    ]
+
+
+def invoice_rows(stmt):
+    return [
+        InvoiceRow(no, name, email, dt.strftime('%Y-%m-%d'), amount, paid, currency, status)
+        for no, name, email, dt, amount, paid, currency, status in db.session.execute(stmt)
+    ]
+
+
+def customer_invoice_rows(stmt):
+    return [
+        CustomerInvoiceRow(no, dt.strftime('%Y-%m-%d'), amount, currency, status)
+        for no, dt, amount, currency, status in db.session.execute(stmt)
+    ]
+
+
+def customer_rows(stmt):
+    return [CustomerRow(*row) for row in db.session.execute(stmt)]
+
+
+def product_rows(stmt):
+    return [ProductRow(*row) for row in db.session.execute(stmt)]
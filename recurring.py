@@ -0,0 +1,137 @@
+"""Recurring invoice generation.
+
+A ``RecurringInvoice`` template is billed once per period: every
+``interval_months`` months counted from its start month, on or after
+``day_of_month``. The scheduler walks due templates in id order, one batch
+at a time. For each batch it preloads the template lines and current
+product prices with one query each, then bulk-inserts the invoices, their
+items and a ``RecurringInvoiceRun`` marker in a single transaction. The
+run table's (template, period) primary key makes re-running the command
+for the same period a no-op. A period that the scheduler skips entirely
+(e.g. the job was down all month) is not back-filled.
+
+    flask --app app generate-recurring-invoices [--date YYYY-MM-DD]
+"""
+from collections import Counter, defaultdict
+from datetime import date, datetime
+from decimal import Decimal
+
+import click
+from sqlalchemy import exists, insert, select
+
+import numbering
+import portal
+import webhooks
+from models import (db, Activity, Invoice, InvoiceItem, Product, RecurringInvoice, RecurringInvoiceItem,
+                    RecurringInvoiceRun)
+
+
+def months_between(start, period):
+    return (period.year - start.year) * 12 + period.month - start.month
+
+
+def generate_due_invoices(on_date=None, batch_size=1000):
+    """Create this period's invoice for every due template. Returns the number created."""
+    on_date = on_date or date.today()
+    period = on_date.replace(day=1)
+    issued_at = datetime.combine(on_date, datetime.utcnow().time())
+
+    due = (
+        select(RecurringInvoice.id, RecurringInvoice.s_id, RecurringInvoice.c_id, RecurringInvoice.tax,
+               RecurringInvoice.interval_months, RecurringInvoice.start_date)
+        .where(
+            RecurringInvoice.active.is_(True),
+            RecurringInvoice.start_date <= on_date,
+            (RecurringInvoice.end_date.is_(None)) | (RecurringInvoice.end_date >= on_date),
+            RecurringInvoice.day_of_month <= on_date.day,
+            ~exists().where(
+                RecurringInvoiceRun.recurring_id == RecurringInvoice.id,
+                RecurringInvoiceRun.period == period,
+            ),
+        )
+        .order_by(RecurringInvoice.id)
+        .limit(batch_size)
+    )
+
+    per_seller = Counter()
+    last_id = 0
+    while True:
+        batch = db.session.execute(due.where(RecurringInvoice.id > last_id)).all()
+        if not batch:
+            break
+        last_id = batch[-1].id
+        templates = [t for t in batch if months_between(t.start_date, period) % t.interval_months == 0]
+        if not templates:
+            continue
+
+        lines = defaultdict(list)
+        for line in db.session.execute(
+            select(RecurringInvoiceItem.recurring_id, RecurringInvoiceItem.p_id,
+                   RecurringInvoiceItem.item_quantity, RecurringInvoiceItem.discount)
+            .where(RecurringInvoiceItem.recurring_id.in_([t.id for t in templates]))
+        ):
+            lines[line.recurring_id].append(line)
+        product_ids = {line.p_id for template_lines in lines.values() for line in template_lines}
+        prices = dict(db.session.execute(
+            select(Product.p_id, Product.p_price).where(Product.p_id.in_(product_ids))
+        ).all())
+
+        billable = [(template, [line for line in lines[template.id] if line.p_id in prices]) for template in templates]
+        billable = [(template, template_lines) for template, template_lines in billable if template_lines]
+        # One counter UPDATE per seller in the batch, in s_id order so concurrent jobs can't deadlock
+        numbers = {
+            s_id: iter(numbering.allocate(s_id, count, issued_at))
+            for s_id, count in sorted(Counter(template.s_id for template, _ in billable).items())
+        }
+
+        invoices, items, runs = [], [], []
+        for template, template_lines in billable:
+            invoice_no = next(numbers[template.s_id])
+            subtotal = Decimal('0')
+            for line in template_lines:
+                subtotal += (prices[line.p_id] * line.item_quantity) - line.discount
+                items.append({
+                    'invoice_no': invoice_no,
+                    'p_id': line.p_id,
+                    'item_quantity': line.item_quantity,
+                    'discount': line.discount,
+                })
+            invoices.append({
+                'invoice_no': invoice_no,
+                'invoice_datetime': issued_at,
+                'status': 'pending',
+                'tax': template.tax,
+                'amount': subtotal + template.tax,
+                's_id': template.s_id,
+                'c_id': template.c_id,
+            })
+            runs.append({'recurring_id': template.id, 'period': period, 'invoice_no': invoice_no})
+            per_seller[template.s_id] += 1
+
+        if invoices:
+            db.session.execute(insert(Invoice), invoices)
+            db.session.execute(insert(InvoiceItem), items)
+            db.session.execute(insert(RecurringInvoiceRun), runs)
+            portal.mark_changed((invoice['s_id'], invoice['c_id']) for invoice in invoices)
+            webhooks.publish('invoice.created', invoices)
+        db.session.commit()
+
+    if per_seller:
+        db.session.add_all([
+            Activity(user_id=s_id, user_role='seller', action_type='recurring_invoices_generated',
+                     description=f'Generated {count} recurring invoice(s) for {period:%B %Y}')
+            for s_id, count in per_seller.items()
+        ])
+        db.session.commit()
+    return sum(per_seller.values())
+
+
+def init_app(app):
+    @app.cli.command('generate-recurring-invoices')
+    @click.option('--date', 'on_date', type=click.DateTime(formats=['%Y-%m-%d']), default=None,
+                  help='Billing date to generate for (default: today).')
+    @click.option('--batch-size', type=int, default=1000, show_default=True)
+    def generate_recurring_invoices_command(on_date, batch_size):
+        """Create all recurring invoices due for the current period."""
+        created = generate_due_invoices(on_date.date() if on_date else None, batch_size)
+        click.echo(f"Generated {created} recurring invoice(s).")
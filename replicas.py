@@ -0,0 +1,63 @@
+"""Read-replica routing for ``db.session``.
+
+Replicas are configured as extra SQLAlchemy binds named ``replica_<n>``
+(see ``DATABASE_REPLICA_URLS`` in config.py). Routes decorated with
+``read_replica`` send their SELECTs to one of them; flushes and DML always
+go to the primary. Whenever a request writes, the user's session is pinned
+to the primary for ``REPLICA_STICKY_SECONDS`` so the next page (usually the
+redirect after a POST) sees their own changes even if the replica lags.
+"""
+import random
+import time
+from functools import wraps
+
+from flask import current_app, g, has_app_context, session
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event
+from sqlalchemy.sql.dml import UpdateBase
+
+REPLICA_BIND_PREFIX = 'replica_'
+
+
+class RoutingSession(Session):
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        # A seller with a database of their own reads and writes there (see tenants.py)
+        tenant = g.get('tenant_engine') if bind is None and has_app_context() else None
+        if tenant is not None:
+            return tenant
+        if bind is None and not self._flushing and not isinstance(clause, UpdateBase):
+            replica = g.get('replica_engine') if has_app_context() else None
+            if replica is not None:
+                return replica
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+@event.listens_for(RoutingSession, 'after_flush')
+def _note_write(db_session, flush_context):
+    if has_app_context():
+        g.db_wrote = True
+
+
+def replica_engines():
+    engines = current_app.extensions['sqlalchemy'].engines
+    return [engine for key, engine in sorted(engines.items(), key=lambda kv: str(kv[0]))
+            if key and key.startswith(REPLICA_BIND_PREFIX)]
+
+
+def read_replica(f):
+    """Serve this route's reads from a replica unless the user just wrote."""
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        engines = replica_engines()
+        if engines and session.get('primary_until', 0) < time.time():
+            g.replica_engine = random.choice(engines)
+        return f(*args, **kwargs)
+    return decorated_function
+
+
+def init_app(app):
+    @app.after_request
+    def stick_to_primary(response):
+        if g.get('db_wrote') and replica_engines():
+            session['primary_until'] = time.time() + app.config['REPLICA_STICKY_SECONDS']
+        return response
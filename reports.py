@@ -0,0 +1,315 @@
+"""Reports from a columnar snapshot of the invoice data.
+
+Finance reports aggregate every invoice a seller ever issued. Running them
+against ``invoices``/``invoice_items`` competes with the pages that write to
+those tables. ``flask --app app export-snapshot`` (run it nightly) instead
+copies invoices (live and archived), their items, products and customers
+into Parquet files under ``REPORTS_SNAPSHOT_DIR``:
+
+    snapshots/20261019T020000/invoices.parquet
+    snapshots/20261019T020000/invoice_items.parquet
+    ...
+    snapshots/CURRENT            (name of the newest complete export)
+
+The export reads each database once, from a replica when one is configured
+(see replicas.py), streaming ``chunk_size`` rows at a time into a compressed
+row group. Rows are sorted by seller, so a report for one seller reads only
+that seller's row groups. Money columns are also given in the base currency
+(``amount_base``, ``net_base``), so reports can add invoices in different
+currencies.
+
+``/seller/reports`` computes its tables from the newest export with
+``pyarrow.compute``, memory-mapping the files, and never queries the
+database. Exports are immutable, so each seller's report is computed once
+per export and cached. Both need ``pyarrow`` (in requirements.txt); on a
+server without it the reports page says so.
+
+Where no scheduler can write to the web servers' disk (a Render web service
+and a Render cron job never share one), set
+``REPORTS_EXPORT_MAX_AGE_HOURS``. The reports page then starts an export in
+a background thread of the web worker once the newest one is older than
+that. A claim file in ``REPORTS_SNAPSHOT_DIR`` keeps other workers from
+starting a second export at the same time.
+"""
+import os
+import random
+import shutil
+import threading
+import time
+from collections import namedtuple
+from contextlib import ExitStack
+from datetime import datetime, timedelta
+from functools import lru_cache
+
+import click
+from flask import current_app
+from sqlalchemy import Float, cast, literal, select, union_all
+
+import replicas
+import tenants
+from models import db, Customer, Product, Invoice, InvoiceItem, ArchivedInvoice, ArchivedInvoiceItem
+from statements import OPEN_STATUSES
+
+POINTER = 'CURRENT'
+CLAIM = '.export.claim'
+CLAIM_EXPIRES_SECONDS = 3600  # an export that died without removing its claim file
+TOP_ROWS = 10
+
+Report = namedtuple('Report', ['exported_at', 'months', 'statuses', 'products', 'customers'])
+
+
+def available():
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def _money(column):
+    return cast(column, Float)
+
+
+def _invoices():
+    parts = [
+        select(invoice.invoice_no, invoice.s_id, invoice.c_id, invoice.invoice_datetime, invoice.status,
+               invoice.currency, invoice.tax_region, _money(invoice.amount).label('amount'),
+               _money(invoice.tax).label('tax'), _money(invoice.amount_paid).label('amount_paid'),
+               _money(invoice.amount / invoice.exchange_rate).label('amount_base'),
+               _money(invoice.amount_paid / invoice.exchange_rate).label('paid_base'),
+               literal(invoice is ArchivedInvoice).label('archived'))
+        for invoice in (Invoice, ArchivedInvoice)
+    ]
+    stmt = union_all(*parts).subquery()
+    return select(stmt).order_by(stmt.c.s_id, stmt.c.invoice_no)
+
+
+def _invoice_items():
+    parts = [
+        select(item.invoice_no, invoice.s_id, invoice.c_id, invoice.invoice_datetime, item.p_id,
+               item.item_quantity, _money(item.discount).label('discount'),
+               # Line net as integrity.py computes it, back in the base currency
+               _money((Product.p_price * invoice.exchange_rate * item.item_quantity - item.discount)
+                      / invoice.exchange_rate).label('net_base'))
+        .join(invoice, invoice.invoice_no == item.invoice_no)
+        .join(Product, Product.p_id == item.p_id)
+        for invoice, item in ((Invoice, InvoiceItem), (ArchivedInvoice, ArchivedInvoiceItem))
+    ]
+    stmt = union_all(*parts).subquery()
+    return select(stmt).order_by(stmt.c.s_id, stmt.c.invoice_no)
+
+
+def _products():
+    return (select(Product.p_id, Product.s_id, Product.p_name, _money(Product.p_price).label('p_price'),
+                   Product.p_stock, Product.tax_class)
+            .order_by(Product.s_id, Product.p_id))
+
+
+def _customers():
+    return select(Customer.c_id, Customer.s_id, Customer.c_name, Customer.c_email).order_by(Customer.s_id,
+                                                                                           Customer.c_id)
+
+
+def _schemas():
+    import pyarrow as pa
+
+    return {
+        'invoices': (_invoices, pa.schema([
+            ('invoice_no', pa.string()), ('s_id', pa.string()), ('c_id', pa.string()),
+            ('invoice_datetime', pa.timestamp('us')), ('status', pa.string()), ('currency', pa.string()),
+            ('tax_region', pa.string()), ('amount', pa.float64()), ('tax', pa.float64()),
+            ('amount_paid', pa.float64()), ('amount_base', pa.float64()), ('paid_base', pa.float64()),
+            ('archived', pa.bool_()),
+        ])),
+        'invoice_items': (_invoice_items, pa.schema([
+            ('invoice_no', pa.string()), ('s_id', pa.string()), ('c_id', pa.string()),
+            ('invoice_datetime', pa.timestamp('us')), ('p_id', pa.string()), ('item_quantity', pa.int64()),
+            ('discount', pa.float64()), ('net_base', pa.float64()),
+        ])),
+        'products': (_products, pa.schema([
+            ('p_id', pa.string()), ('s_id', pa.string()), ('p_name', pa.string()), ('p_price', pa.float64()),
+            ('p_stock', pa.int64()), ('tax_class', pa.string()),
+        ])),
+        'customers': (_customers, pa.schema([
+            ('c_id', pa.string()), ('s_id', pa.string()), ('c_name', pa.string()), ('c_email', pa.string()),
+        ])),
+    }
+
+
+def _source_engines():
+    """The main database (a replica of it if there is one) and every seller database."""
+    main = replicas.replica_engines()
+    return [random.choice(main) if main else db.engine, *tenants.tenant_engines().values()]
+
+
+def export_snapshot(directory, chunk_size=50000, keep=3):
+    """Write a new export under ``directory`` and make it the current one. Returns ``(path, row counts)``."""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    name = datetime.utcnow().strftime('%Y%m%dT%H%M%S')
+    path = os.path.join(directory, name)
+    partial = os.path.join(directory, f'.{name}.partial')
+    os.makedirs(partial, exist_ok=True)
+    schemas = _schemas()
+    counts = dict.fromkeys(schemas, 0)
+    with ExitStack() as stack:
+        writers = {table: stack.enter_context(pq.ParquetWriter(os.path.join(partial, f'{table}.parquet'), schema,
+                                                               compression='zstd'))
+                   for table, (query, schema) in schemas.items()}
+        for engine in _source_engines():
+            with engine.connect() as connection:
+                # All four tables from one snapshot, so the items match the invoices exported with them
+                if engine.dialect.name == 'postgresql':
+                    connection.execution_options(isolation_level='REPEATABLE READ')
+                with connection.begin():
+                    for table, (query, schema) in schemas.items():
+                        result = connection.execute(query().execution_options(yield_per=chunk_size))
+                        for rows in result.partitions():
+                            writers[table].write_batch(pa.RecordBatch.from_arrays(
+                                [pa.array(column, field.type) for column, field in zip(zip(*rows), schema)],
+                                schema=schema,
+                            ))
+                            counts[table] += len(rows)
+    os.replace(partial, path)
+    _point_at(directory, name)
+    for old in sorted(_exports(directory))[:-keep]:
+        shutil.rmtree(os.path.join(directory, old), ignore_errors=True)
+    return path, counts
+
+
+def _point_at(directory, name):
+    pointer = os.path.join(directory, POINTER)
+    with open(f'{pointer}.tmp', 'w', encoding='utf-8') as f:
+        f.write(name)
+    os.replace(f'{pointer}.tmp', pointer)
+
+
+def _exports(directory):
+    return [name for name in os.listdir(directory)
+            if not name.startswith('.') and os.path.isdir(os.path.join(directory, name))]
+
+
+def current_export(directory):
+    """Path of the newest complete export, or None."""
+    try:
+        with open(os.path.join(directory, POINTER), encoding='utf-8') as f:
+            path = os.path.join(directory, f.read().strip())
+    except FileNotFoundError:
+        return None
+    return path if os.path.isdir(path) else None
+
+
+def _read(path, table, s_id, columns):
+    import pyarrow.parquet as pq
+
+    return pq.read_table(os.path.join(path, f'{table}.parquet'), columns=columns, filters=[('s_id', '=', s_id)],
+                         memory_map=True)
+
+
+def _rows(table):
+    row = namedtuple('Row', table.column_names)
+    return [row(*values.values()) for values in table.to_pylist()]
+
+
+@lru_cache(maxsize=256)
+def _seller_report(path, s_id):
+    import pyarrow as pa
+    import pyarrow.compute as pc
+
+    invoices = _read(path, 'invoices', s_id, ['c_id', 'invoice_datetime', 'status', 'amount_base', 'paid_base'])
+    invoices = invoices.append_column('month', pc.add(pc.multiply(pc.year(invoices['invoice_datetime']), 100),
+                                                      pc.month(invoices['invoice_datetime'])))
+    is_open = pc.is_in(invoices['status'], value_set=pa.array(sorted(OPEN_STATUSES)))
+    invoices = invoices.append_column('due_base', pc.if_else(
+        is_open, pc.subtract(invoices['amount_base'], invoices['paid_base']), 0.0))
+
+    months = (invoices.group_by('month')
+              .aggregate([('amount_base', 'count'), ('amount_base', 'sum'), ('paid_base', 'sum')])
+              .sort_by([('month', 'descending')]))
+    statuses = (invoices.group_by('status')
+                .aggregate([('amount_base', 'count'), ('amount_base', 'sum'), ('due_base', 'sum')])
+                .sort_by([('amount_base_sum', 'descending')]))
+
+    items = _read(path, 'invoice_items', s_id, ['p_id', 'item_quantity', 'net_base'])
+    products = (items.group_by('p_id').aggregate([('item_quantity', 'sum'), ('net_base', 'sum')])
+                .sort_by([('net_base_sum', 'descending')]).slice(0, TOP_ROWS)
+                .join(_read(path, 'products', s_id, ['p_id', 'p_name']), 'p_id')
+                .sort_by([('net_base_sum', 'descending')]))
+
+    customers = (invoices.group_by('c_id')
+                 .aggregate([('amount_base', 'count'), ('amount_base', 'sum'), ('due_base', 'sum')])
+                 .sort_by([('amount_base_sum', 'descending')]).slice(0, TOP_ROWS)
+                 .join(_read(path, 'customers', s_id, ['c_id', 'c_name']), 'c_id')
+                 .sort_by([('amount_base_sum', 'descending')]))
+
+    months = [month._replace(month=f'{month.month // 100}-{month.month % 100:02d}') for month in _rows(months)]
+    exported_at = datetime.strptime(os.path.basename(path), '%Y%m%dT%H%M%S')
+    return Report(exported_at, months, _rows(statuses), _rows(products), _rows(customers))
+
+
+def _claim(directory):
+    """Create the claim file; False if another worker holds an unexpired claim."""
+    os.makedirs(directory, exist_ok=True)
+    claim = os.path.join(directory, CLAIM)
+    try:
+        if time.time() - os.path.getmtime(claim) > CLAIM_EXPIRES_SECONDS:
+            os.remove(claim)
+    except FileNotFoundError:
+        pass
+    try:
+        os.close(os.open(claim, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+    except FileExistsError:
+        return False
+    return True
+
+
+def _export_in_background(app, directory):
+    try:
+        with app.app_context():
+            path, counts = export_snapshot(directory)
+        app.logger.info('Exported reports snapshot to %s', path)
+    except Exception:
+        app.logger.exception('Reports snapshot export failed')
+    finally:
+        os.remove(os.path.join(directory, CLAIM))
+
+
+def refresh_if_stale():
+    """Start a background export if the newest one is older than ``REPORTS_EXPORT_MAX_AGE_HOURS``.
+
+    Returns True while an export started by any worker is running. Does nothing when the setting is 0.
+    """
+    max_age = current_app.config['REPORTS_EXPORT_MAX_AGE_HOURS']
+    directory = current_app.config['REPORTS_SNAPSHOT_DIR']
+    if not max_age or not available():
+        return False
+    path = current_export(directory)
+    if path is not None:
+        exported_at = datetime.strptime(os.path.basename(path), '%Y%m%dT%H%M%S')
+        if datetime.utcnow() - exported_at < timedelta(hours=max_age):
+            return False
+    if _claim(directory):
+        app = current_app._get_current_object()
+        threading.Thread(target=_export_in_background, args=(app, directory), daemon=True).start()
+    return True
+
+
+def seller_report(s_id):
+    """The seller's report from the newest export, or None without pyarrow or an export."""
+    path = current_export(current_app.config['REPORTS_SNAPSHOT_DIR'])
+    if path is None or not available():
+        return None
+    return _seller_report(path, s_id)
+
+
+def init_app(app):
+    @app.cli.command('export-snapshot')
+    @click.option('--chunk-size', type=int, default=50000, show_default=True, help='Rows per Parquet row group.')
+    @click.option('--keep', type=int, default=3, show_default=True, help='Exports to keep, newest first.')
+    def export_snapshot_command(chunk_size, keep):
+        """Copy invoices, items, products and customers into Parquet files for the reports page."""
+        if not available():
+            raise click.ClickException('export-snapshot needs pyarrow: pip install pyarrow')
+        path, counts = export_snapshot(app.config['REPORTS_SNAPSHOT_DIR'], chunk_size, max(1, keep))
+        click.echo(f"Exported {', '.join(f'{count} {table}' for table, count in counts.items())} to {path}.")
@@ -0,0 +1,135 @@
+"""Schema upgrades.
+
+``db.create_all()`` only creates tables that don't exist yet, so columns and
+indexes added to existing models would be missing from older databases.
+``upgrade_schema`` creates missing tables and then adds any missing columns
+(``ALTER TABLE ... ADD COLUMN``, relying on each new column's server
+default) and indexes. It only ever loosens what is already there: string
+columns the models have widened are widened, and unique constraints the
+models no longer declare are dropped. SQLite can't drop an inline
+constraint, so there the table is rebuilt and its rows copied over. Nothing
+else is dropped or altered.
+
+The app doesn't do this at startup, so workers boot without touching the
+database. Run it once per deploy, before the new code starts serving:
+
+    flask --app app upgrade-db
+
+Tenant databases (``TENANT_DATABASE_URLS``) get the same schema.
+"""
+import click
+from sqlalchemy import String, inspect, select, text
+from sqlalchemy.schema import CreateColumn, CreateTable, UniqueConstraint
+
+import changes
+import payments
+import portal
+import tenants
+from models import db, CustomerSummary
+
+
+def _declared_uniques(table):
+    uniques = {frozenset(column.name for column in table.primary_key.columns)}
+    uniques.update(frozenset(column.name for column in constraint.columns)
+                   for constraint in table.constraints if isinstance(constraint, UniqueConstraint))
+    uniques.update(frozenset(column.name for column in index.columns) for index in table.indexes if index.unique)
+    return uniques
+
+
+def _rebuild_sqlite_table(conn, table, preparer):
+    """Recreate ``table`` from the model, keeping its rows (SQLite's way of dropping a constraint)."""
+    name = preparer.format_table(table)
+    scratch = preparer.quote(f'{table.name}__rebuild')
+    create = str(CreateTable(table).compile(dialect=conn.dialect))
+    conn.execute(text(create.replace(f'CREATE TABLE {name}', f'CREATE TABLE {scratch}', 1)))
+    columns = ', '.join(preparer.quote(column.name) for column in table.columns)
+    conn.execute(text(f'INSERT INTO {scratch} ({columns}) SELECT {columns} FROM {name}'))
+    conn.execute(text(f'DROP TABLE {name}'))
+    conn.execute(text(f'ALTER TABLE {scratch} RENAME TO {name}'))
+
+
+def _drop_unique(conn, table, name, preparer, is_index):
+    dialect = conn.dialect.name
+    if dialect in ('mysql', 'mariadb'):
+        # MySQL keeps unique constraints as indexes
+        conn.execute(text(f'DROP INDEX {preparer.quote(name)} ON {preparer.format_table(table)}'))
+    elif is_index:
+        conn.execute(text(f'DROP INDEX {preparer.quote(name)}'))
+    else:
+        conn.execute(text(f'ALTER TABLE {preparer.format_table(table)} DROP CONSTRAINT {preparer.quote(name)}'))
+
+
+def _widen(conn, table, column, preparer):
+    dialect = conn.dialect.name
+    if dialect == 'postgresql':
+        conn.execute(text(f'ALTER TABLE {preparer.format_table(table)} ALTER COLUMN {preparer.quote(column.name)} '
+                          f'TYPE {column.type.compile(dialect=conn.dialect)}'))
+    elif dialect in ('mysql', 'mariadb'):
+        ddl = CreateColumn(column).compile(dialect=conn.dialect)
+        conn.execute(text(f'ALTER TABLE {preparer.format_table(table)} MODIFY {ddl}'))
+    # SQLite doesn't enforce string lengths
+
+
+def upgrade_schema(engine=None):
+    """Bring a database (the primary by default) up to the models. Returns the ``(table, column)`` pairs added."""
+    engine = engine or db.engine
+    db.metadata.create_all(engine)
+    preparer = engine.dialect.identifier_preparer
+    added = []
+    with engine.begin() as conn:
+        for table in db.metadata.sorted_tables:
+            inspector = inspect(conn)
+            existing = {column['name']: column for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                current = existing.get(column.name)
+                if current is None:
+                    ddl = CreateColumn(column).compile(dialect=engine.dialect)
+                    conn.execute(text(f'ALTER TABLE {preparer.format_table(table)} ADD COLUMN {ddl}'))
+                    added.append((table.name, column.name))
+                elif (isinstance(column.type, String) and column.type.length
+                        and (getattr(current['type'], 'length', None) or column.type.length) < column.type.length):
+                    _widen(conn, table, column, preparer)
+
+            declared = _declared_uniques(table)
+            stale_constraints = [constraint for constraint in inspector.get_unique_constraints(table.name)
+                                 if frozenset(constraint['column_names']) not in declared]
+            stale_indexes = [index for index in inspector.get_indexes(table.name)
+                             if index['unique'] and frozenset(index['column_names']) not in declared
+                             and index['name'] not in {constraint['name'] for constraint in stale_constraints}]
+            if engine.dialect.name == 'sqlite' and stale_constraints:
+                _rebuild_sqlite_table(conn, table, preparer)
+            else:
+                for constraint in stale_constraints:
+                    _drop_unique(conn, table, constraint['name'], preparer, is_index=False)
+                for index in stale_indexes:
+                    _drop_unique(conn, table, index['name'], preparer, is_index=True)
+
+            existing_indexes = {index['name'] for index in inspect(conn).get_indexes(table.name)}
+            for index in table.indexes:
+                if index.name not in existing_indexes:
+                    index.create(conn)
+    return added
+
+
+def upgrade_database():
+    """``upgrade_schema`` on every database, plus the data backfills that go with the columns it added."""
+    added = upgrade_schema()
+    for engine in tenants.tenant_engines().values():
+        upgrade_schema(engine)
+    if ('invoices', 'amount_paid') in added:
+        payments.backfill_paid_invoices()
+    changes.backfill_updated_at(added)
+    if ('customers', 's_id') in added:
+        tenants.backfill_customer_sellers()
+    if db.session.execute(select(CustomerSummary.c_id).limit(1)).first() is None:
+        # First upgrade with the customer portal
+        portal.rebuild_summaries()
+    return added
+
+
+def init_app(app):
+    @app.cli.command('upgrade-db')
+    def upgrade_db_command():
+        """Create missing tables, columns and indexes."""
+        added = upgrade_database()
+        click.echo(f"Schema is up to date ({len(added)} column(s) added).")
@@ -0,0 +1,225 @@
+"""Customer statements.
+
+A statement summarises one customer's account with a seller over a period:
+the balance brought forward, what was invoiced and paid in the period, the
+closing balance and an aging breakdown of what is still open. Balances are
+invoiced minus received, where "received" comes from the payments ledger,
+so part payments count on the day they arrive. Invoices (live and archived)
+and payments are merged into one stream of account entries and every figure
+comes from a single grouped query over it using conditional sums, grouped
+by customer. A single statement and the batch "every customer of this
+seller" statement both run that one query. Aging uses each open invoice's
+current balance due. Invoices and payments in other currencies are
+converted back to the base currency at the rate the invoice was issued at.
+"""
+import csv
+import io
+import tempfile
+from collections import namedtuple
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+from sqlalchemy import and_, case, func, literal, select, union_all
+
+from models import db, Customer, Invoice, ArchivedInvoice, Payment
+
+OPEN_STATUSES = ('pending', 'overdue')
+# (label, min age in days, max age in days or None)
+AGING_BUCKETS = (
+    ('0-30', 0, 30),
+    ('31-60', 31, 60),
+    ('61-90', 61, 90),
+    ('90+', 91, None),
+)
+
+Statement = namedtuple('Statement', [
+    'customer_id', 'customer_name', 'customer_email',
+    'opening_balance', 'invoiced', 'invoice_count', 'paid', 'closing_balance', 'aging',
+])
+StatementLine = namedtuple('StatementLine', ['id', 'date', 'amount', 'currency', 'status'])
+
+
+def _money(value):
+    return Decimal(str(value or 0)).quantize(Decimal('0.01'))
+
+
+def _seller_invoices(seller_id):
+    """Live and archived invoices of a seller as one subquery."""
+    def columns(model):
+        return (model.invoice_no, model.c_id, model.invoice_datetime, model.amount, model.amount_paid,
+                model.currency, model.exchange_rate, model.status)
+    return union_all(
+        select(*columns(Invoice)).where(Invoice.s_id == seller_id),
+        select(*columns(ArchivedInvoice)).where(ArchivedInvoice.s_id == seller_id),
+    ).subquery('seller_invoices')
+
+
+def _account_entries(seller_id):
+    """Invoices and payments of a seller as ``(c_id, at, kind, billed, received, open_amount)`` rows.
+
+    Money columns are in the base currency.
+    """
+    inv = _seller_invoices(seller_id)
+    invoices = select(
+        inv.c.c_id,
+        inv.c.invoice_datetime.label('at'),
+        literal('invoice').label('kind'),
+        case((inv.c.status != 'cancelled', inv.c.amount / inv.c.exchange_rate), else_=literal(0)).label('billed'),
+        literal(0).label('received'),
+        case((inv.c.status.in_(OPEN_STATUSES), (inv.c.amount - inv.c.amount_paid) / inv.c.exchange_rate),
+             else_=literal(0)).label('open_amount'),
+    )
+    received = select(
+        inv.c.c_id,
+        Payment.paid_at,
+        literal('payment'),
+        literal(0),
+        Payment.amount / inv.c.exchange_rate,
+        literal(0),
+    ).join(inv, inv.c.invoice_no == Payment.invoice_no).where(Payment.s_id == seller_id)
+    return union_all(invoices, received).subquery('account_entries')
+
+
+def _sum_where(condition, value):
+    return func.coalesce(func.sum(case((condition, value), else_=literal(0))), 0)
+
+
+def build_statements(seller_id, start, end, customer_id=None):
+    """Statements for ``start``..``end`` (dates, inclusive), one per customer."""
+    entries = _account_entries(seller_id)
+    entry = entries.c
+    period_start = datetime.combine(start, datetime.min.time())
+    period_end = datetime.combine(end + timedelta(days=1), datetime.min.time())
+    before_start = entry.at < period_start
+    before_end = entry.at < period_end
+    in_period = and_(entry.at >= period_start, before_end)
+
+    aging_columns = []
+    for label, min_days, max_days in AGING_BUCKETS:
+        # By calendar day: issued on ``end - max_days`` through ``end - min_days``
+        condition = entry.at < period_end - timedelta(days=min_days)
+        if max_days is not None:
+            condition = and_(condition, entry.at >= period_end - timedelta(days=max_days + 1))
+        aging_columns.append(_sum_where(condition, entry.open_amount).label(f'aging_{label}'))
+
+    stmt = (
+        select(
+            Customer.c_id,
+            Customer.c_name,
+            Customer.c_email,
+            (_sum_where(before_start, entry.billed) - _sum_where(before_start, entry.received)).label('opening'),
+            _sum_where(in_period, entry.billed).label('invoiced'),
+            func.sum(case((and_(in_period, entry.kind == 'invoice', entry.billed > 0), 1), else_=0))
+            .label('invoice_count'),
+            _sum_where(in_period, entry.received).label('paid'),
+            (_sum_where(before_end, entry.billed) - _sum_where(before_end, entry.received)).label('closing'),
+            *aging_columns,
+        )
+        .join(entries, entry.c_id == Customer.c_id)
+        .group_by(Customer.c_id, Customer.c_name, Customer.c_email)
+        .order_by(Customer.c_name.asc())
+    )
+    if customer_id is not None:
+        stmt = stmt.where(Customer.c_id == customer_id)
+
+    statements = []
+    for row in db.session.execute(stmt):
+        c_id, name, email, opening, invoiced, count, paid, closing, *aging = row
+        statements.append(Statement(
+            c_id, name, email,
+            _money(opening), _money(invoiced), count or 0, _money(paid), _money(closing),
+            [(label, _money(value)) for (label, _, _), value in zip(AGING_BUCKETS, aging)],
+        ))
+    return statements
+
+
+def statement_lines(seller_id, customer_id, start, end):
+    """Invoices issued to one customer during the period, oldest first."""
+    inv = _seller_invoices(seller_id)
+    stmt = (
+        select(inv.c.invoice_no, inv.c.invoice_datetime, inv.c.amount, inv.c.currency, inv.c.status)
+        .where(
+            inv.c.c_id == customer_id,
+            inv.c.invoice_datetime >= datetime.combine(start, datetime.min.time()),
+            inv.c.invoice_datetime < datetime.combine(end + timedelta(days=1), datetime.min.time()),
+        )
+        .order_by(inv.c.invoice_datetime.asc())
+    )
+    return [
+        StatementLine(no, dt.strftime('%Y-%m-%d'), amount, currency, status)
+        for no, dt, amount, currency, status in db.session.execute(stmt)
+    ]
+
+
+def statements_csv(statements, rows_per_chunk=500):
+    """CSV text in chunks of ``rows_per_chunk`` rows, so the export can be streamed."""
+    out = io.StringIO()
+    writer = csv.writer(out)
+    writer.writerow(['Customer ID', 'Customer', 'Email', 'Opening Balance', 'Invoiced', 'Invoices', 'Paid',
+                     'Closing Balance'] + [f'Aging {label}' for label, _, _ in AGING_BUCKETS])
+    for number, s in enumerate(statements, 1):
+        writer.writerow([s.customer_id, s.customer_name, s.customer_email, f'{s.opening_balance:.2f}',
+                         f'{s.invoiced:.2f}', s.invoice_count, f'{s.paid:.2f}', f'{s.closing_balance:.2f}']
+                        + [f'{value:.2f}' for _, value in s.aging])
+        if number % rows_per_chunk == 0:
+            yield out.getvalue()
+            out.seek(0)
+            out.truncate()
+    yield out.getvalue()
+
+
+def statements_pdf(statements, start, end, lines=None):
+    """One PDF page (or more) per statement; ``lines`` adds the invoice list for a single customer."""
+    from reportlab.lib.pagesizes import A4
+    from reportlab.lib.units import mm
+    from reportlab.pdfgen import canvas
+
+    out = tempfile.SpooledTemporaryFile(max_size=5 * 1024 * 1024)
+    pdf = canvas.Canvas(out, pagesize=A4, pageCompression=1)
+    width, height = A4
+
+    def row(y, label, value, bold=False):
+        pdf.setFont('Helvetica-Bold' if bold else 'Helvetica', 11)
+        pdf.drawString(20 * mm, y, label)
+        pdf.drawRightString(190 * mm, y, value)
+        return y - 6 * mm
+
+    for s in statements:
+        y = height - 30 * mm
+        pdf.setFont('Helvetica-Bold', 16)
+        pdf.drawString(20 * mm, y, f'Statement: {s.customer_name}')
+        y -= 8 * mm
+        pdf.setFont('Helvetica', 11)
+        pdf.drawString(20 * mm, y, f'{s.customer_email}    Period: {start:%Y-%m-%d} to {end:%Y-%m-%d}')
+        y -= 12 * mm
+        y = row(y, 'Opening balance', f'{s.opening_balance:.2f}')
+        y = row(y, f'Invoiced ({s.invoice_count})', f'{s.invoiced:.2f}')
+        y = row(y, 'Paid', f'{s.paid:.2f}')
+        y = row(y, 'Closing balance', f'{s.closing_balance:.2f}', bold=True)
+        y -= 6 * mm
+        pdf.setFont('Helvetica-Bold', 12)
+        pdf.drawString(20 * mm, y, 'Aging (days)')
+        y -= 8 * mm
+        for label, value in s.aging:
+            y = row(y, label, f'{value:.2f}')
+
+        if lines:
+            y -= 6 * mm
+            pdf.setFont('Helvetica-Bold', 12)
+            pdf.drawString(20 * mm, y, 'Invoices')
+            y -= 8 * mm
+            for line in lines:
+                pdf.setFont('Helvetica', 11)
+                pdf.drawString(20 * mm, y, line.id)
+                pdf.drawString(70 * mm, y, line.date)
+                pdf.drawString(110 * mm, y, line.status.title())
+                pdf.drawRightString(190 * mm, y, f'{line.currency} {line.amount:.2f}')
+                y -= 6 * mm
+                if y < 30 * mm:
+                    pdf.showPage()
+                    y = height - 20 * mm
+        pdf.showPage()
+
+    pdf.save()
+    out.seek(0)
+    return out
@@ -0,0 +1,259 @@
+// Invoice form: line items, inline customer/product creation and totals.
+// Expects `products`, `rates` and `baseSymbol` from the page (create_invoice.html).
+
+let itemCount = 0;
+
+function currentCurrency() {
+    return rates.currencies[document.getElementById('currency-select').value];
+}
+
+function formatMoney(value) {
+    return `${currentCurrency().symbol}${value.toFixed(2)}`;
+}
+
+function addItem() {
+    itemCount++;
+    const container = document.getElementById('items-container');
+    const emptyItems = document.getElementById('empty-items');
+
+    if (emptyItems) {
+        emptyItems.style.display = 'none';
+    }
+
+    const itemDiv = document.createElement('div');
+    itemDiv.className = 'invoice-item';
+    itemDiv.innerHTML = `
+        <div class="item-row">
+            <div class="form-group">
+                <label class="form-label">Product</label>
+                <select name="product_${itemCount}_id" class="form-input product-select" onchange="updateItemTotal(${itemCount})" required>
+                    <option value="">Select product...</option>
+                    ${products.map(p => `<option value="${p.id}">${p.name} - ${baseSymbol}${p.price} (Stock: ${p.stock})</option>`).join('')}
+                </select>
+            </div>
+            <div class="form-group">
+                <label class="form-label">Quantity</label>
+                <input type="number" name="quantity_${itemCount}" class="form-input quantity-input" min="1" value="1" onchange="updateItemTotal(${itemCount})" required>
+            </div>
+            <div class="form-group">
+                <label class="form-label">Discount</label>
+                <input type="number" name="discount_${itemCount}" class="form-input discount-input" min="0" step="0.01" value="0" onchange="updateItemTotal(${itemCount})">
+            </div>
+            <div class="item-total">
+                <label class="form-label">Total</label>
+                <div class="total-display" id="item-total-${itemCount}" data-net="0">${formatMoney(0)}</div>
+            </div>
+            <div class="item-actions">
+                <button type="button" class="btn btn-danger btn-sm" onclick="removeItem(this)">
+                    <i class="fas fa-trash"></i>
+                </button>
+            </div>
+        </div>
+    `;
+
+    container.appendChild(itemDiv);
+    updateTotals();
+}
+
+function addItemWithPreselected(productId, tempMeta) {
+    addItem();
+    const select = document.querySelector(`select[name="product_${itemCount}_id"]`);
+    if (select) {
+        select.value = productId;
+        updateItemTotal(itemCount);
+        if (tempMeta) {
+            // Attach hidden inputs so backend can create this temp product
+            const form = document.querySelector('form');
+            const hn = document.createElement('input'); hn.type='hidden'; hn.name=`temp_product_name_${itemCount}`; hn.value=tempMeta.name; form.appendChild(hn);
+            const hp = document.createElement('input'); hp.type='hidden'; hp.name=`temp_product_price_${itemCount}`; hp.value=tempMeta.price; form.appendChild(hp);
+            const hs = document.createElement('input'); hs.type='hidden'; hs.name=`temp_product_stock_${itemCount}`; hs.value=tempMeta.stock; form.appendChild(hs);
+            const hd = document.createElement('input'); hd.type='hidden'; hd.name=`temp_product_desc_${itemCount}`; hd.value=tempMeta.description; form.appendChild(hd);
+        }
+    }
+}
+
+function removeItem(button) {
+    button.closest('.invoice-item').remove();
+    updateTotals();
+
+    const items = document.querySelectorAll('.invoice-item');
+    if (items.length === 0) {
+        document.getElementById('empty-items').style.display = 'block';
+    }
+}
+
+function updateItemTotal(itemIndex) {
+    const productSelect = document.querySelector(`select[name="product_${itemIndex}_id"]`);
+    const quantityInput = document.querySelector(`input[name="quantity_${itemIndex}"]`);
+    const discountInput = document.querySelector(`input[name="discount_${itemIndex}"]`);
+    const totalDisplay = document.getElementById(`item-total-${itemIndex}`);
+
+    if (productSelect.value && quantityInput.value) {
+        const product = products.find(p => p.id === productSelect.value);
+        if (product) {
+            const quantity = parseInt(quantityInput.value) || 0;
+            const discount = parseFloat(discountInput.value) || 0;
+            // Prices are in the base currency; discounts are in the invoice currency
+            const total = (product.price * currentCurrency().per_base * quantity) - discount;
+            totalDisplay.dataset.net = total;
+            totalDisplay.dataset.taxClass = product.tax_class || 'standard';
+            totalDisplay.textContent = formatMoney(total);
+        }
+    } else {
+        totalDisplay.dataset.net = 0;
+        totalDisplay.textContent = formatMoney(0);
+    }
+
+    updateTotals();
+}
+
+function updateTotals() {
+    let subtotal = 0;
+    let regionTax = 0;
+    const region = document.getElementById('region-select').value;
+    const regionRules = rates.rules[region] || {};
+    const items = document.querySelectorAll('.invoice-item');
+
+    items.forEach(item => {
+        const totalDisplay = item.querySelector('.total-display');
+        const net = parseFloat(totalDisplay.dataset.net) || 0;
+        subtotal += net;
+        regionTax += net * (regionRules[totalDisplay.dataset.taxClass] || 0);
+    });
+
+    const taxInput = document.getElementById('tax-input');
+    const taxDisplay = document.getElementById('tax-display');
+    taxInput.style.display = region ? 'none' : '';
+    taxDisplay.style.display = region ? '' : 'none';
+    const tax = region ? regionTax : (parseFloat(taxInput.value) || 0);
+    const total = subtotal + tax;
+
+    taxDisplay.textContent = formatMoney(tax);
+    document.getElementById('subtotal').textContent = formatMoney(subtotal);
+    document.getElementById('total').textContent = formatMoney(total);
+}
+
+// Add event listeners for tax and currency inputs
+document.getElementById('tax-input').addEventListener('input', updateTotals);
+document.getElementById('region-select').addEventListener('change', updateTotals);
+document.getElementById('currency-select').addEventListener('change', () => {
+    document.querySelectorAll('.product-select').forEach(select => {
+        updateItemTotal(select.name.split('_')[1]);
+    });
+    updateTotals();
+});
+updateTotals();
+
+function showNewCustomerForm() {
+    document.getElementById('new-customer-form').style.display = 'block';
+}
+
+function hideNewCustomerForm() {
+    document.getElementById('new-customer-form').style.display = 'none';
+    // Clear form fields
+    document.querySelector('input[name="new_customer_name"]').value = '';
+    document.querySelector('input[name="new_customer_email"]').value = '';
+    document.querySelector('input[name="new_customer_phone"]').value = '';
+    document.querySelector('textarea[name="new_customer_address"]').value = '';
+}
+
+function addNewCustomer() {
+    const name = document.querySelector('input[name="new_customer_name"]').value;
+    const email = document.querySelector('input[name="new_customer_email"]').value;
+    const phone = document.querySelector('input[name="new_customer_phone"]').value;
+    const address = document.querySelector('textarea[name="new_customer_address"]').value;
+
+    if (!name || !email || !phone || !address) {
+        alert('Please fill in all customer fields');
+        return;
+    }
+
+    // Create a temporary customer option
+    const customerSelect = document.querySelector('select[name="customer_id"]');
+    const tempOption = document.createElement('option');
+    tempOption.value = 'temp_' + Date.now();
+    tempOption.textContent = name + ' (' + email + ')';
+    tempOption.selected = true;
+    customerSelect.appendChild(tempOption);
+
+    // Store the customer data in hidden fields
+    const hiddenName = document.createElement('input');
+    hiddenName.type = 'hidden';
+    hiddenName.name = 'temp_customer_name';
+    hiddenName.value = name;
+
+    const hiddenEmail = document.createElement('input');
+    hiddenEmail.type = 'hidden';
+    hiddenEmail.name = 'temp_customer_email';
+    hiddenEmail.value = email;
+
+    const hiddenPhone = document.createElement('input');
+    hiddenPhone.type = 'hidden';
+    hiddenPhone.name = 'temp_customer_phone';
+    hiddenPhone.value = phone;
+
+    const hiddenAddress = document.createElement('input');
+    hiddenAddress.type = 'hidden';
+    hiddenAddress.name = 'temp_customer_address';
+    hiddenAddress.value = address;
+
+    document.querySelector('form').appendChild(hiddenName);
+    document.querySelector('form').appendChild(hiddenEmail);
+    document.querySelector('form').appendChild(hiddenPhone);
+    document.querySelector('form').appendChild(hiddenAddress);
+
+    hideNewCustomerForm();
+}
+
+function showNewProductForm() {
+    document.getElementById('new-product-form').style.display = 'block';
+}
+
+function hideNewProductForm() {
+    document.getElementById('new-product-form').style.display = 'none';
+    document.getElementById('np_name').value = '';
+    document.getElementById('np_price').value = '';
+    document.getElementById('np_stock').value = '0';
+    document.getElementById('np_desc').value = '';
+}
+
+function addNewProduct() {
+    const name = document.getElementById('np_name').value;
+    const price = parseFloat(document.getElementById('np_price').value);
+    const stock = parseInt(document.getElementById('np_stock').value) || 0;
+    const description = document.getElementById('np_desc').value;
+    if (!name || isNaN(price)) {
+        alert('Please provide at least a name and price for the product');
+        return;
+    }
+
+    // Save the product to the database via API
+    fetch('/api/products/add', {
+        method: 'POST',
+        headers: {
+            'Content-Type': 'application/json',
+        },
+        body: JSON.stringify({ name, price, stock, description })
+    })
+        .then(response => response.json())
+        .then(data => {
+            if (data.success) {
+                // Add the new product to the products array
+                products.push(data.product);
+                // Add it as an invoice item - no need for temp product handling
+                addItem();
+                const select = document.querySelector(`select[name="product_${itemCount}_id"]`);
+                if (select) {
+                    select.value = data.product.id;
+                    updateItemTotal(itemCount);
+                }
+                hideNewProductForm();
+            } else {
+                alert('Failed to add product: ' + (data.error || 'Unknown error'));
+            }
+        })
+        .catch(error => {
+            console.error('Error adding product:', error);
+            alert('Failed to add product. Please try again.');
+        });
+}
@@ -0,0 +1,255 @@
+// Saves the invoice form as a draft while it is filled in (see drafts.py) and creates the
+// invoice through the idempotent finalize endpoint. Only changed fields and lines are sent;
+// edits made offline wait in a queue and go out together when the connection is back.
+// A customer or product added inline (temp_ ids) still goes through the plain form POST.
+
+(function () {
+    const STORAGE_KEY = 'invoiceDraft';
+    const SAVE_DELAY_MS = 800;
+    const form = document.querySelector('.invoice-form');
+    const container = document.getElementById('items-container');
+    const status = document.getElementById('draft-status');
+    const headerFields = {
+        customer_id: form.querySelector('select[name="customer_id"]'),
+        currency: document.getElementById('currency-select'),
+        tax_region: document.getElementById('region-select'),
+        tax: document.getElementById('tax-input'),
+    };
+
+    let draft = JSON.parse(localStorage.getItem(STORAGE_KEY) || 'null');  // {id, version, key}
+    let fields = {};
+    let lines = {};
+    let saving = null;
+    let timer = null;
+
+    function newId() {
+        if (window.crypto && crypto.randomUUID) {
+            return crypto.randomUUID();
+        }
+        return `${Date.now().toString(16)}-${Math.random().toString(16).slice(2, 14)}`;
+    }
+
+    function remember() {
+        if (draft) {
+            localStorage.setItem(STORAGE_KEY, JSON.stringify(draft));
+        } else {
+            localStorage.removeItem(STORAGE_KEY);
+        }
+    }
+
+    function showStatus(text) {
+        status.textContent = text;
+    }
+
+    function fieldValue(name) {
+        const value = headerFields[name].value;
+        return value.startsWith('temp_') ? null : value;
+    }
+
+    function rows() {
+        return Array.from(container.querySelectorAll('.invoice-item'));
+    }
+
+    function lineId(row) {
+        if (!row.dataset.lineId) {
+            row.dataset.lineId = newId();
+        }
+        return row.dataset.lineId;
+    }
+
+    function lineChange(row) {
+        const product = row.querySelector('.product-select').value;
+        return {
+            id: lineId(row),
+            product_id: product.startsWith('temp_') ? null : product,
+            quantity: parseInt(row.querySelector('.quantity-input').value) || 1,
+            discount: row.querySelector('.discount-input').value || '0',
+            position: rows().indexOf(row),
+        };
+    }
+
+    function snapshot() {
+        const body = {};
+        Object.keys(headerFields).forEach(name => { body[name] = fieldValue(name); });
+        body.lines = rows().map(lineChange);
+        return body;
+    }
+
+    function usesTempRecords() {
+        return headerFields.customer_id.value.startsWith('temp_')
+            || rows().some(row => row.querySelector('.product-select').value.startsWith('temp_'));
+    }
+
+    function scheduleSave() {
+        clearTimeout(timer);
+        showStatus('Unsaved changes');
+        timer = setTimeout(save, SAVE_DELAY_MS);
+    }
+
+    function requeue(body) {
+        const { lines: changedLines = [], ...changedFields } = body;
+        fields = { ...changedFields, ...fields };
+        changedLines.forEach(line => { if (!(line.id in lines)) lines[line.id] = line; });
+    }
+
+    async function send(body) {
+        const url = draft ? `/api/v1/drafts/${draft.id}` : '/api/v1/drafts';
+        const response = await fetch(url, {
+            method: draft ? 'PATCH' : 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify(draft ? { ...body, version: draft.version } : body),
+        });
+        const payload = await response.json().catch(() => ({}));
+        if (response.ok) {
+            draft = { ...draft, id: payload.data.id, version: payload.data.version };
+            remember();
+            showStatus('Draft saved');
+        } else if (response.status === 409 && payload.data && !payload.data.invoice_id) {
+            // Saved from another window: keep our changes on top of that version
+            draft.version = payload.data.version;
+            remember();
+            requeue(body);
+            return send(takeQueue());
+        } else if (response.status === 404 || response.status === 409) {
+            // Gone or already turned into an invoice: start a new draft from what is on screen
+            draft = null;
+            remember();
+            return send(snapshot());
+        } else {
+            showStatus(payload.error || 'Draft not saved');
+        }
+    }
+
+    function takeQueue() {
+        const body = draft ? { ...fields, lines: Object.values(lines) } : snapshot();
+        fields = {};
+        lines = {};
+        return body;
+    }
+
+    function save() {
+        clearTimeout(timer);
+        if (saving) {
+            return saving.then(save);
+        }
+        if (draft && !Object.keys(fields).length && !Object.keys(lines).length) {
+            return Promise.resolve();
+        }
+        const body = takeQueue();
+        showStatus('Saving...');
+        saving = send(body)
+            .catch(() => {
+                requeue(body);
+                showStatus(navigator.onLine ? 'Draft not saved; retrying' : 'Offline: changes will be saved when you reconnect');
+                timer = setTimeout(save, navigator.onLine ? 5000 : 60000);
+            })
+            .finally(() => { saving = null; });
+        return saving;
+    }
+
+    async function restore() {
+        const response = await fetch(`/api/v1/drafts/${draft.id}`);
+        if (!response.ok) {
+            draft = null;
+            remember();
+            return;
+        }
+        const data = (await response.json()).data;
+        if (data.invoice_id) {
+            draft = null;
+            remember();
+            return;
+        }
+        draft.version = data.version;
+        remember();
+        headerFields.customer_id.value = data.customer_id || '';
+        headerFields.currency.value = data.currency || headerFields.currency.value;
+        headerFields.tax_region.value = data.tax_region || '';
+        headerFields.tax.value = data.manual_tax;
+        data.lines.forEach(line => {
+            addItem();
+            const row = rows()[rows().length - 1];
+            row.dataset.lineId = line.id;
+            row.querySelector('.product-select').value = line.product_id || '';
+            row.querySelector('.quantity-input').value = line.quantity;
+            row.querySelector('.discount-input').value = line.discount.toFixed(2);
+            updateItemTotal(itemCount);
+        });
+        observer.takeRecords();  // the rows just rebuilt are already saved
+        fields = {};
+        lines = {};
+        showStatus('Draft restored');
+    }
+
+    async function finalize(event) {
+        if (usesTempRecords()) {
+            return;  // the form POST creates the inline customer/product too
+        }
+        event.preventDefault();
+        await save();
+        if (!draft || Object.keys(fields).length || Object.keys(lines).length) {
+            showStatus('Offline: the invoice will be created once the draft is saved');
+            return;
+        }
+        draft.key = draft.key || newId();  // kept across retries, so a lost response can't create a second invoice
+        remember();
+        showStatus('Creating invoice...');
+        let response;
+        try {
+            response = await fetch(`/api/v1/drafts/${draft.id}/finalize`, {
+                method: 'POST',
+                headers: { 'Idempotency-Key': draft.key },
+            });
+        } catch (error) {
+            showStatus('Could not reach the server; press Create Invoice again to retry');
+            return;
+        }
+        const payload = await response.json().catch(() => ({}));
+        if (response.ok) {
+            draft = null;
+            remember();
+            window.location = `/invoice/${payload.data.id}`;
+        } else {
+            showStatus('');
+            alert(payload.error || 'Failed to create invoice');
+        }
+    }
+
+    form.addEventListener('change', event => {
+        const row = event.target.closest('.invoice-item');
+        if (row) {
+            lines[lineId(row)] = lineChange(row);
+        } else {
+            const name = Object.keys(headerFields).find(key => headerFields[key] === event.target);
+            if (!name) {
+                return;
+            }
+            fields[name] = fieldValue(name);
+        }
+        scheduleSave();
+    });
+
+    const observer = new MutationObserver(mutations => {
+        mutations.forEach(mutation => {
+            mutation.addedNodes.forEach(node => {
+                if (node.classList && node.classList.contains('invoice-item')) {
+                    lines[lineId(node)] = lineChange(node);
+                }
+            });
+            mutation.removedNodes.forEach(node => {
+                if (node.dataset && node.dataset.lineId) {
+                    lines[node.dataset.lineId] = { id: node.dataset.lineId, deleted: true };
+                }
+            });
+        });
+        scheduleSave();
+    });
+    observer.observe(container, { childList: true });
+
+    form.addEventListener('submit', finalize);
+    window.addEventListener('online', save);
+
+    if (draft) {
+        restore().catch(() => showStatus('Offline: showing a new form'));
+    }
+})();
@@ -0,0 +1,148 @@
+"""Tax and currency engine.
+
+Tax rules (rate per region and product tax class) and exchange rates (units
+of each currency per unit of ``BASE_CURRENCY``) are read from the CSV files
+named by ``TAX_RULES_FILE`` and ``EXCHANGE_RATES_FILE``. They are parsed
+once into plain dict lookups and cached per worker in
+``app.extensions['rate_tables']``. Once per request (app context) the files'
+modification times are compared with the cached ones, and the tables are
+reloaded if either changed, so editing a file takes effect on the next
+request without a restart. Every other call in the request, such as each
+``money`` filter in a long listing, reuses the tables kept on ``g``.
+
+Product prices are kept in the base currency. An invoice freezes its
+region, currency and exchange rate when it is created. Its ``tax`` and
+``amount`` are stored in that currency, so listings and reports read them
+directly and never recompute. ``compute_totals`` works out those stored
+figures in one pass over the line items, accumulating net amounts per tax
+class and applying each class rate once.
+"""
+import csv
+import os
+import threading
+from collections import defaultdict, namedtuple
+from decimal import Decimal, ROUND_HALF_UP
+
+from flask import current_app, g
+
+CENT = Decimal('0.01')
+
+Currency = namedtuple('Currency', ['code', 'symbol', 'per_base'])
+Totals = namedtuple('Totals', ['subtotal', 'tax', 'amount', 'currency', 'exchange_rate', 'tax_by_class'])
+
+
+class RateTables:
+    def __init__(self, tax_rates, currencies, base_currency, default_region, stamp):
+        self.tax_rates = tax_rates          # {(region, tax_class): Decimal}
+        self.currencies = currencies        # {code: Currency}
+        self.base_currency = base_currency
+        self.default_region = default_region
+        self.stamp = stamp
+        self.regions = sorted({region for region, _ in tax_rates})
+        self.tax_classes = sorted({tax_class for _, tax_class in tax_rates})
+
+    def rate(self, region, tax_class):
+        return self.tax_rates.get((region, tax_class), Decimal('0'))
+
+    def currency(self, code):
+        return self.currencies.get(code) or self.currencies[self.base_currency]
+
+    def as_json(self):
+        """Rules and currencies for the invoice form's live preview."""
+        rules = defaultdict(dict)
+        for (region, tax_class), rate in self.tax_rates.items():
+            rules[region][tax_class] = float(rate)
+        return {
+            'rules': rules,
+            'currencies': {c.code: {'symbol': c.symbol, 'per_base': float(c.per_base)}
+                           for c in self.currencies.values()},
+        }
+
+
+def _file_stamp(*paths):
+    return tuple(os.stat(path).st_mtime_ns for path in paths)
+
+
+def load_rate_tables(tax_rules_path, exchange_rates_path, base_currency, default_region):
+    with open(tax_rules_path, newline='', encoding='utf-8') as f:
+        tax_rates = {
+            (row['region'].strip(), row['tax_class'].strip()): Decimal(row['rate'].strip())
+            for row in csv.DictReader(f)
+        }
+    with open(exchange_rates_path, newline='', encoding='utf-8') as f:
+        currencies = {
+            row['currency'].strip(): Currency(row['currency'].strip(), row['symbol'].strip(),
+                                              Decimal(row['per_base'].strip()))
+            for row in csv.DictReader(f)
+        }
+    currencies.setdefault(base_currency, Currency(base_currency, base_currency, Decimal('1')))
+    return RateTables(tax_rates, currencies, base_currency, default_region,
+                      _file_stamp(tax_rules_path, exchange_rates_path))
+
+
+_lock = threading.Lock()
+
+
+def rate_tables():
+    """The current worker's rate tables, checked for changed source files once per request."""
+    tables = g.get('rate_tables')
+    if tables is None:
+        tables = g.rate_tables = _fresh_rate_tables()
+    return tables
+
+
+def _fresh_rate_tables():
+    config = current_app.config
+    paths = (config['TAX_RULES_FILE'], config['EXCHANGE_RATES_FILE'])
+    tables = current_app.extensions.get('rate_tables')
+    if tables is None or tables.stamp != _file_stamp(*paths):
+        with _lock:
+            tables = current_app.extensions.get('rate_tables')
+            if tables is None or tables.stamp != _file_stamp(*paths):
+                tables = load_rate_tables(*paths, config['BASE_CURRENCY'], config['DEFAULT_TAX_REGION'])
+                current_app.extensions['rate_tables'] = tables
+    return tables
+
+
+def compute_totals(lines, region=None, currency=None, exchange_rate=None):
+    """Totals for ``lines`` of ``(tax_class, base_price, quantity, discount)``.
+
+    Prices are converted to ``currency`` before discounts, which are already in that
+    currency, are taken off. Pass ``exchange_rate`` to reuse the rate an existing invoice
+    was issued at. A ``region`` of ``None`` means no tax.
+    """
+    tables = rate_tables()
+    currency = tables.currency(currency or tables.base_currency)
+    exchange_rate = currency.per_base if exchange_rate is None else exchange_rate
+    net_by_class = defaultdict(Decimal)
+    for tax_class, price, quantity, discount in lines:
+        net_by_class[tax_class] += price * exchange_rate * quantity - discount
+    subtotal, tax, tax_by_class = class_totals(net_by_class, region)
+    return Totals(subtotal, tax, subtotal + tax, currency.code, exchange_rate, tax_by_class)
+
+
+def class_totals(net_by_class, region=None):
+    """``(subtotal, tax, tax_by_class)`` from the unrounded net amount of each tax class.
+
+    Each class's net is rounded half up to the cent, then taxed at the region's rate and rounded again.
+    """
+    tables = rate_tables()
+    subtotal = Decimal('0')
+    tax_by_class = {}
+    for tax_class, net in net_by_class.items():
+        net = net.quantize(CENT, ROUND_HALF_UP)
+        subtotal += net
+        if region is not None:
+            tax_by_class[tax_class] = (net * tables.rate(region, tax_class)).quantize(CENT, ROUND_HALF_UP)
+    return subtotal, sum(tax_by_class.values(), Decimal('0')), tax_by_class
+
+
+def format_money(value, currency=None):
+    """Jinja filter: ``{{ invoice.amount|money(invoice.currency) }}``."""
+    symbol = rate_tables().currency(currency).symbol
+    return f'{symbol}{Decimal(str(value or 0)):.2f}'
+
+
+def init_app(app):
+    app.add_template_filter(format_money, 'money')
+    app.jinja_env.globals['rate_tables'] = rate_tables
@@ -0,0 +1,144 @@
+"""Per-seller (tenant) isolation.
+
+Every row a seller owns carries their ``s_id``. While a seller is signed in,
+each ORM statement run through ``db.session`` (``Model.query``,
+``session.execute(select(...))``, ``session.get``, relationship loads and
+ORM UPDATE/DELETE) gets ``s_id = <seller>`` added for every model that has
+an ``s_id`` column. A page can't read another seller's rows, and its cost
+follows the size of one tenant rather than the whole platform. Jobs and CLI
+commands run with no tenant and see everything; a request can opt a single
+statement out with ``.execution_options(all_tenants=True)``.
+
+Customer and product keys are prefixed with their seller (``S001-C004``,
+``S001-P012``), so a tenant's rows can be copied to a database of its own
+without renumbering. Keys created before tenancy (``C004``, or the UUIDs of
+old products) are left as they are: they were already unique across
+sellers, and renaming them would mean rewriting every invoice line and
+statement that quotes them. ``TENANT_DATABASE_URLS`` (``S042=<url>,...``) exposes
+those databases as binds named ``tenant_<s_id>``, and every statement of that
+seller's requests goes there. Moving the rows is a manual, one-off step.
+"""
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from datetime import datetime
+
+from flask import current_app, g, has_app_context, request, session
+from sqlalchemy import event, func, insert, literal, select, union_all, update
+from sqlalchemy.orm import with_loader_criteria
+
+from models import db, Seller, Customer, Invoice, ArchivedInvoice, RecurringInvoice
+from replicas import RoutingSession
+
+TENANT_BIND_PREFIX = 'tenant_'
+
+# Mapped classes with an ``s_id`` column
+TENANT_MODELS = tuple(mapper.class_ for mapper in db.Model.registry.mappers
+                      if 's_id' in mapper.columns and mapper.class_ is not Seller)
+
+
+def key_prefix(s_id, kind):
+    """``S001-C`` for customers of seller S001, ``S001-P`` for their products."""
+    return f'{s_id}-{kind}'
+
+
+def tenant_key(s_id, kind, number):
+    return f'{key_prefix(s_id, kind)}{number:03d}'
+
+
+def current_tenant():
+    return g.get('tenant_id') if has_app_context() else None
+
+
+def tenant_engines():
+    """Dedicated tenant databases, keyed by seller id."""
+    engines = current_app.extensions['sqlalchemy'].engines
+    return {key[len(TENANT_BIND_PREFIX):]: engine for key, engine in engines.items()
+            if key and key.startswith(TENANT_BIND_PREFIX)}
+
+
+def bind_for(s_id):
+    """The engine holding ``s_id``'s rows: their own database if they have one, otherwise the primary."""
+    return tenant_engines().get(s_id, db.engine)
+
+
+@contextmanager
+def scope(s_id):
+    """Run the block as seller ``s_id`` (for jobs and scripts working on one tenant)."""
+    previous = g.get('tenant_id'), g.get('tenant_engine')
+    g.tenant_id = s_id
+    g.tenant_engine = tenant_engines().get(s_id)
+    try:
+        yield
+    finally:
+        g.tenant_id, g.tenant_engine = previous
+
+
+@event.listens_for(RoutingSession, 'do_orm_execute')
+def _scope_to_tenant(execute_state):
+    tenant_id = current_tenant()
+    if (tenant_id is None or execute_state.is_column_load
+            or execute_state.execution_options.get('all_tenants')):
+        return
+    if execute_state.is_select or execute_state.is_update or execute_state.is_delete:
+        execute_state.statement = execute_state.statement.options(*(
+            with_loader_criteria(model, model.s_id == tenant_id, include_aliases=True)
+            for model in TENANT_MODELS
+        ))
+
+
+def backfill_customer_sellers():
+    """Give customers created before tenancy an owner.
+
+    A customer belongs to the first seller who billed them. Every other seller
+    who billed the same customer gets a copy under their own key, and their
+    invoices are repointed to it. Customers nobody billed go to the only
+    seller when there is just one; otherwise they stay unassigned (and
+    invisible to sellers) and are counted in the return value.
+    """
+    billed = union_all(
+        select(Invoice.c_id, Invoice.s_id, Invoice.invoice_datetime.label('billed_at')),
+        select(ArchivedInvoice.c_id, ArchivedInvoice.s_id, ArchivedInvoice.invoice_datetime),
+        select(RecurringInvoice.c_id, RecurringInvoice.s_id, RecurringInvoice.created_at),
+    ).subquery()
+    first_billed = func.min(billed.c.billed_at)
+    rows = db.session.execute(
+        select(billed.c.c_id, billed.c.s_id)
+        .group_by(billed.c.c_id, billed.c.s_id)
+        .order_by(billed.c.c_id, first_billed, billed.c.s_id)
+    ).all()
+    sellers_by_customer = defaultdict(list)
+    for c_id, s_id in rows:
+        sellers_by_customer[c_id].append(s_id)
+
+    copies = Counter()
+    copied_columns = ('c_name', 'c_email', 'c_phone_no', 'c_address', 'password')
+    for c_id, (owner, *others) in sellers_by_customer.items():
+        db.session.execute(update(Customer).where(Customer.c_id == c_id, Customer.s_id.is_(None)).values(s_id=owner))
+        for s_id in others:
+            copies[s_id] += 1
+            new_id = tenant_key(s_id, 'C', copies[s_id])
+            db.session.execute(insert(Customer).from_select(
+                ['c_id', *copied_columns, 's_id', 'updated_at'],
+                select(literal(new_id), *(getattr(Customer, name) for name in copied_columns),
+                       literal(s_id), literal(datetime.utcnow())).where(Customer.c_id == c_id),
+            ))
+            for model in (Invoice, ArchivedInvoice, RecurringInvoice):
+                db.session.execute(update(model).where(model.c_id == c_id, model.s_id == s_id).values(c_id=new_id))
+
+    seller_ids = db.session.execute(select(Seller.s_id).limit(2)).scalars().all()
+    if len(seller_ids) == 1:
+        db.session.execute(update(Customer).where(Customer.s_id.is_(None)).values(s_id=seller_ids[0]))
+    unassigned = db.session.execute(select(func.count()).select_from(Customer).where(Customer.s_id.is_(None))).scalar()
+    db.session.commit()
+    if unassigned:
+        current_app.logger.warning('%d customer(s) have no seller; set customers.s_id by hand', unassigned)
+    return unassigned
+
+
+def init_app(app):
+    @app.before_request
+    def set_tenant():
+        # Static files skip the session, so their responses don't vary by cookie
+        if request.endpoint != 'static' and session.get('user_role') == 'seller':
+            g.tenant_id = session['user_id']
+            g.tenant_engine = tenant_engines().get(g.tenant_id)
@@ -0,0 +1,70 @@
+"""Shared fixtures: an app on a scratch SQLite database with two sellers."""
+import os
+import sys
+from decimal import Decimal
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import create_app, db  # noqa: E402
+from config import Config  # noqa: E402
+from models import Seller, Customer, Product  # noqa: E402
+import schema  # noqa: E402
+
+
+@pytest.fixture
+def app(tmp_path):
+    class TestConfig(Config):
+        TESTING = True
+        SQLALCHEMY_DATABASE_URI = f"sqlite:///{tmp_path / 'test.db'}"
+        SQLALCHEMY_BINDS = {}
+        SESSION_COOKIE_SECURE = False
+        RATE_LIMIT_ENABLED = False
+        CHANGE_FEED_LAG_SECONDS = 0
+        WEBHOOK_URLS = []
+        REPORTS_SNAPSHOT_DIR = str(tmp_path / 'snapshots')
+
+    app = create_app(TestConfig)
+    with app.app_context():
+        schema.upgrade_database()
+        seed()
+    return app
+
+
+def seed():
+    """Sellers S001 and S002, each with two customers and two products (a standard and a reduced one)."""
+    for s_id in ('S001', 'S002'):
+        seller = Seller(s_id=s_id, s_name=f'Seller {s_id}', s_email=f'{s_id.lower()}@example.com',
+                        s_address='1 Market Street', s_phone='000')
+        seller.set_password('password')
+        db.session.add(seller)
+        for n in (1, 2):
+            db.session.add(Customer(c_id=f'{s_id}-C00{n}', c_name=f'Customer {n} of {s_id}',
+                                    c_email=f'c{n}.{s_id.lower()}@example.com', c_phone_no='555',
+                                    c_address='2 Side Street', password='', s_id=s_id))
+        db.session.add(Product(p_id=f'{s_id}-P001', p_name='Widget', p_price=Decimal('100.00'), p_stock=100,
+                               p_description='', tax_class='standard', s_id=s_id))
+        db.session.add(Product(p_id=f'{s_id}-P002', p_name='Book', p_price=Decimal('10.05'), p_stock=100,
+                               p_description='', tax_class='reduced', s_id=s_id))
+    db.session.commit()
+
+
+def login(client, s_id='S001'):
+    with client.session_transaction() as session:
+        session.update(user_id=s_id, user_role='seller', user_name=f'Seller {s_id}',
+                       user_email=f'{s_id.lower()}@example.com')
+    return client
+
+
+@pytest.fixture
+def client(app):
+    return login(app.test_client())
+
+
+def create_invoice(client, customer_id, lines, **fields):
+    """Submit the invoice form with ``lines`` of ``(product_id, quantity, discount)``."""
+    form = {'customer_id': customer_id, **fields}
+    for n, (p_id, quantity, discount) in enumerate(lines, start=1):
+        form.update({f'product_{n}_id': p_id, f'quantity_{n}': str(quantity), f'discount_{n}': str(discount)})
+    return client.post('/seller/invoices/create', data=form)
@@ -0,0 +1,80 @@
+import threading
+
+from sqlalchemy import func, select
+
+from conftest import login
+from models import db, Invoice, InvoiceItem, InvoiceSequence
+
+
+def _draft(client):
+    body = {'customer_id': 'S001-C001', 'lines': [{'id': 'line-1', 'product_id': 'S001-P001', 'quantity': 2}]}
+    response = client.post('/api/v1/drafts', json=body)
+    assert response.status_code == 201
+    return response.get_json()['data']['id']
+
+
+def _finalize(client, draft_id, key):
+    return client.post(f'/api/v1/drafts/{draft_id}/finalize', headers={'Idempotency-Key': key})
+
+
+def _invoice_count(app):
+    with app.app_context():
+        return db.session.execute(select(func.count()).select_from(Invoice)).scalar()
+
+
+def test_retry_with_the_same_key_returns_the_first_invoice(app, client):
+    draft_id = _draft(client)
+    first = _finalize(client, draft_id, 'key-1')
+    assert first.status_code == 201
+
+    retry = _finalize(client, draft_id, 'key-1')
+    assert retry.status_code == 200
+    assert retry.get_json() == first.get_json()
+    assert _invoice_count(app) == 1
+    with app.app_context():
+        assert db.session.execute(select(func.count()).select_from(InvoiceItem)).scalar() == 1
+        assert db.session.execute(select(InvoiceSequence.last_number)).scalar() == 1  # one number used
+
+
+def test_finalized_draft_refuses_other_keys_and_edits(app, client):
+    draft_id = _draft(client)
+    assert _finalize(client, draft_id, 'key-1').status_code == 201
+
+    assert _finalize(client, draft_id, 'key-2').status_code == 409
+    assert client.patch(f'/api/v1/drafts/{draft_id}', json={'tax': '1.00'}).status_code == 409
+    assert _invoice_count(app) == 1
+
+
+def test_finalize_needs_a_key(app, client):
+    draft_id = _draft(client)
+    assert _finalize(client, draft_id, '').status_code == 400
+    assert _finalize(client, draft_id, 'k' * 65).status_code == 400
+    assert _invoice_count(app) == 0
+
+
+def test_concurrent_retries_create_one_invoice(app, client):
+    draft_id = _draft(client)
+    responses = []
+    start = threading.Barrier(4)
+
+    def attempt():
+        tab = login(app.test_client())
+        start.wait()
+        responses.append(_finalize(tab, draft_id, 'key-1'))
+
+    threads = [threading.Thread(target=attempt) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert _invoice_count(app) == 1
+    created = [response for response in responses if response.status_code == 201]
+    assert len(created) == 1
+    invoice_id = created[0].get_json()['data']['id']
+    for response in responses:
+        # Losers either replay the winner's invoice or are told to retry
+        assert response.status_code in (200, 201, 409)
+        if response.status_code == 200:
+            assert response.get_json()['data']['id'] == invoice_id
+    assert _finalize(client, draft_id, 'key-1').get_json()['data']['id'] == invoice_id
@@ -0,0 +1,80 @@
+from decimal import Decimal
+
+import pytest
+from sqlalchemy import select, update
+from sqlalchemy.orm.exc import StaleDataError
+
+from conftest import create_invoice, login
+from models import db, Customer, Invoice, Product
+
+PRODUCT_FORM = {'name': 'Widget', 'price': '100.00', 'description': '', 'stock': '100', 'tax_class': 'standard'}
+
+
+def _version(app, model, key):
+    with app.app_context():
+        return db.session.get(model, key).version_id
+
+
+def test_stale_product_form_is_refused(app, client):
+    other_tab = login(app.test_client())
+    version = _version(app, Product, 'S001-P001')
+    assert other_tab.post('/seller/products/edit/S001-P001',
+                          data={**PRODUCT_FORM, 'price': '120.00', 'version': version}).status_code == 302
+
+    response = client.post('/seller/products/edit/S001-P001',
+                           data={**PRODUCT_FORM, 'price': '90.00', 'version': version})
+    assert response.status_code == 409
+    assert b'changed by someone else' in response.data
+    assert b'120.00' in response.data  # the form shows what was saved
+    with app.app_context():
+        product = db.session.get(Product, 'S001-P001')
+        assert (product.p_price, product.version_id) == (Decimal('120.00'), version + 1)
+
+
+def test_stale_customer_form_is_refused(app, client):
+    version = _version(app, Customer, 'S001-C001')
+    client.post('/seller/customers/edit/S001-C001', data={'name': 'First', 'version': version})
+
+    response = client.post('/seller/customers/edit/S001-C001', data={'name': 'Second', 'version': version})
+    assert response.status_code == 409
+    with app.app_context():
+        assert db.session.get(Customer, 'S001-C001').c_name == 'First'
+
+
+def test_stale_invoice_form_is_refused(app, client):
+    create_invoice(client, 'S001-C001', [('S001-P001', 2, 0)], tax='0')
+    with app.app_context():
+        invoice_no, version = db.session.execute(select(Invoice.invoice_no, Invoice.version_id)).one()
+    client.post(f'/seller/invoices/edit/{invoice_no}', data={'status': 'pending', 'tax': '5', 'version': version})
+
+    response = client.post(f'/seller/invoices/edit/{invoice_no}',
+                           data={'status': 'paid', 'tax': '0', 'version': version})
+    assert response.status_code == 409
+    with app.app_context():
+        invoice = db.session.get(Invoice, invoice_no)
+        assert (invoice.status, invoice.tax, invoice.amount_paid) == ('pending', Decimal('5.00'), Decimal('0.00'))
+
+
+def test_concurrent_save_raises_stale_data(app):
+    with app.app_context():
+        product = db.session.get(Product, 'S001-P001')
+        product.p_price = Decimal('90.00')
+        # Someone else saves between our read and our write
+        with db.engine.begin() as connection:
+            connection.execute(update(Product.__table__).where(Product.__table__.c.p_id == 'S001-P001')
+                               .values(p_price=Decimal('120.00'), version_id=Product.__table__.c.version_id + 1))
+        with pytest.raises(StaleDataError):
+            db.session.commit()
+        db.session.rollback()
+        assert db.session.get(Product, 'S001-P001').p_price == Decimal('120.00')
+
+
+def test_stale_draft_autosave_returns_409(client):
+    draft = client.post('/api/v1/drafts', json={'customer_id': 'S001-C001'}).get_json()['data']
+    saved = client.patch(f"/api/v1/drafts/{draft['id']}", json={'version': draft['version'], 'tax': '1.00'})
+    assert saved.status_code == 200
+
+    stale = client.patch(f"/api/v1/drafts/{draft['id']}", json={'version': draft['version'], 'tax': '2.00'})
+    assert stale.status_code == 409
+    assert stale.get_json()['data']['manual_tax'] == 1.0
+    assert stale.get_json()['data']['version'] == saved.get_json()['data']['version']
@@ -0,0 +1,75 @@
+from decimal import Decimal
+
+from sqlalchemy import select, update
+
+import integrity
+from models import db, Invoice, Product
+from conftest import create_invoice
+
+
+def _invoice(app, customer_id='S001-C001'):
+    with app.app_context():
+        return db.session.execute(
+            select(Invoice).where(Invoice.c_id == customer_id).order_by(Invoice.invoice_datetime.desc())
+        ).scalars().first()
+
+
+def _reprice(app, p_id, price):
+    with app.app_context():
+        db.session.execute(update(Product).where(Product.p_id == p_id).values(p_price=Decimal(price)))
+        db.session.commit()
+
+
+def test_untouched_invoices_match(app, client):
+    create_invoice(client, 'S001-C001', [('S001-P001', 1, 0), ('S001-P002', 3, '1.00')], tax_region='IN')
+    create_invoice(client, 'S001-C002', [('S001-P002', 1, 0)], tax='2.50')
+    with app.app_context():
+        assert integrity.verify_invoices() == (0, 0)
+
+
+def test_fix_recomputes_tax_of_taxed_invoices(app, client):
+    create_invoice(client, 'S001-C001', [('S001-P001', 1, 0), ('S001-P002', 1, 0)], tax_region='IN')
+    invoice = _invoice(app)
+    assert (invoice.tax, invoice.amount) == (Decimal('19.21'), Decimal('129.26'))
+
+    _reprice(app, 'S001-P001', '120.00')
+    found = []
+    with app.app_context():
+        assert integrity.verify_invoices(fix=True, report=found.append) == (1, 1)
+    assert (found[0].expected_tax, found[0].expected) == (Decimal('22.81'), Decimal('152.86'))
+
+    # What saving the invoice again would store
+    invoice = _invoice(app)
+    assert (invoice.tax, invoice.amount) == (Decimal('22.81'), Decimal('152.86'))
+    with app.app_context():
+        assert integrity.verify_invoices() == (0, 0)
+
+
+def test_fix_keeps_hand_entered_tax(app, client):
+    create_invoice(client, 'S001-C001', [('S001-P001', 2, 0)], tax='7.00')
+    _reprice(app, 'S001-P001', '90.00')
+    with app.app_context():
+        assert integrity.verify_invoices(fix=True) == (1, 1)
+    invoice = _invoice(app)
+    assert (invoice.tax, invoice.amount) == (Decimal('7.00'), Decimal('187.00'))
+
+
+def test_half_cent_lines_round_half_up(app, client):
+    # 10.05 at an exchange rate of 0.5 is 5.025, which rounds up to 5.03 (but is 5.02499... as a float)
+    create_invoice(client, 'S001-C001', [('S001-P002', 1, 0)], tax='0')
+    with app.app_context():
+        db.session.execute(update(Invoice).values(exchange_rate=Decimal('0.5'), amount=Decimal('5.03')))
+        db.session.commit()
+        assert integrity.verify_invoices() == (0, 0)
+
+
+def test_paid_invoices_are_reported_but_not_fixed(app, client):
+    create_invoice(client, 'S001-C001', [('S001-P001', 1, 0)], tax_region='IN')
+    with app.app_context():
+        db.session.execute(update(Invoice).values(status='paid'))
+        db.session.commit()
+    _reprice(app, 'S001-P001', '50.00')
+    with app.app_context():
+        assert integrity.verify_invoices(fix=True) == (1, 0)
+        assert integrity.verify_invoices(fix=True, all_statuses=True) == (1, 1)
+    assert _invoice(app).amount == Decimal('59.00')
@@ -0,0 +1,80 @@
+import threading
+from datetime import datetime
+from decimal import Decimal
+
+from sqlalchemy import select
+from sqlalchemy.exc import OperationalError
+
+import numbering
+from models import db, Invoice
+
+THREADS = 8
+PER_THREAD = 15
+
+
+def _allocate_concurrently(app, s_id, when):
+    """Each thread saves ``PER_THREAD`` invoices, rolling every third back. Returns the committed numbers."""
+    committed, errors = [], []
+    start = threading.Barrier(THREADS)
+
+    def worker():
+        with app.app_context():
+            start.wait()
+            for i in range(PER_THREAD):
+                while True:
+                    try:
+                        invoice_no = numbering.allocate(s_id, when=when)[0]
+                        db.session.add(Invoice(invoice_no=invoice_no, invoice_datetime=when, status='pending',
+                                               amount=Decimal('10.00'), s_id=s_id, c_id=f'{s_id}-C001'))
+                        if i % 3 == 2:
+                            db.session.rollback()  # a failed save hands its number back
+                        else:
+                            db.session.commit()
+                            committed.append(invoice_no)
+                        break
+                    except OperationalError:
+                        db.session.rollback()  # database busy: try again
+                    except Exception as error:
+                        db.session.rollback()
+                        errors.append(error)
+                        break
+
+    threads = [threading.Thread(target=worker) for _ in range(THREADS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+    return committed
+
+
+def _numbers(invoice_nos):
+    return sorted(int(invoice_no.rsplit('-', 1)[1]) for invoice_no in invoice_nos)
+
+
+def test_concurrent_allocation_has_no_duplicates_or_gaps(app):
+    # A fiscal year nobody has numbered yet, so the threads also race to create the counter
+    when = datetime(2031, 6, 1)
+    committed = _allocate_concurrently(app, 'S001', when)
+
+    expected = THREADS * (PER_THREAD - PER_THREAD // 3)
+    assert len(committed) == expected
+    assert _numbers(committed) == list(range(1, expected + 1))
+    with app.app_context():
+        stored = db.session.execute(select(Invoice.invoice_no).where(Invoice.s_id == 'S001')).scalars().all()
+        assert sorted(stored) == sorted(committed)
+        assert numbering.next_number('S001', when) == numbering.format_number(
+            app.config['INVOICE_NUMBER_FORMAT'], 'S001', 2031, expected + 1)
+        db.session.rollback()
+
+
+def test_sellers_and_fiscal_years_have_their_own_series(app):
+    with app.app_context():
+        start_month = app.config['FISCAL_YEAR_START_MONTH']
+        this_year = datetime(2030, start_month, 1)
+        last_year = datetime(2029, start_month, 1)
+        assert _numbers(numbering.allocate('S001', 3, this_year)) == [1, 2, 3]
+        assert _numbers(numbering.allocate('S002', 1, this_year)) == [1]
+        assert _numbers(numbering.allocate('S001', 1, last_year)) == [1]
+        assert _numbers(numbering.allocate('S001', 1, this_year)) == [4]
+        db.session.commit()
@@ -0,0 +1,85 @@
+import io
+from datetime import datetime
+from decimal import Decimal
+
+from sqlalchemy import func, select
+
+import payments
+from conftest import create_invoice, login
+from models import db, Invoice, Payment
+
+
+def _invoice(app, client, s_id='S001'):
+    create_invoice(client, f'{s_id}-C001', [(f'{s_id}-P001', 2, 0)], tax='0')  # 200.00
+    with app.app_context():
+        return db.session.execute(select(Invoice.invoice_no).where(Invoice.s_id == s_id)).scalar_one()
+
+
+def _upload(client, text):
+    response = client.post('/seller/payments/reconcile', headers={'Accept-Encoding': 'identity'},
+                           data={'statement': (io.BytesIO(text.encode()), 'bank.csv')})
+    assert response.status_code == 200
+    return ' '.join(response.get_data(as_text=True).split())
+
+
+def _paid(app, invoice_no):
+    with app.app_context():
+        count = db.session.execute(select(func.count()).select_from(Payment)
+                                   .where(Payment.invoice_no == invoice_no)).scalar()
+        return count, db.session.get(Invoice, invoice_no).amount_paid
+
+
+def test_reimported_statement_records_nothing_new(app, client):
+    invoice_no = _invoice(app, client)
+    statement = f'date,amount,reference\n2026-03-01,50.00,{invoice_no}\n2026-03-02,25.00,{invoice_no}\n'
+    assert 'Matched 2, unmatched 0, already imported 0' in _upload(client, statement)
+    assert _paid(app, invoice_no) == (2, Decimal('75.00'))
+
+    assert 'Matched 0, unmatched 0, already imported 2' in _upload(client, statement)
+    assert _paid(app, invoice_no) == (2, Decimal('75.00'))
+
+
+def test_repeated_line_in_one_file_is_a_duplicate(app, client):
+    invoice_no = _invoice(app, client)
+    line = {'line': 2, 'paid_at': datetime(2026, 3, 1), 'amount': Decimal('50.00'), 'reference': invoice_no}
+    with app.app_context():
+        matched, unmatched, duplicates = payments.reconcile('S001', [line, {**line, 'line': 3}])
+        db.session.commit()
+    assert [(entry['line'], number) for entry, number in matched] == [(2, invoice_no)]
+    assert unmatched == [] and [entry['line'] for entry in duplicates] == [3]
+    assert _paid(app, invoice_no) == (1, Decimal('50.00'))
+
+
+def test_only_the_same_date_amount_and_reference_is_a_duplicate(app, client):
+    invoice_no = _invoice(app, client)
+    first = {'line': 2, 'paid_at': datetime(2026, 3, 1), 'amount': Decimal('50.00'), 'reference': invoice_no}
+    with app.app_context():
+        payments.reconcile('S001', [first])
+        db.session.commit()
+        others = [
+            {**first, 'paid_at': datetime(2026, 3, 2)},
+            {**first, 'amount': Decimal('50.01')},
+            {**first, 'reference': f'{invoice_no} second transfer'},
+        ]
+        matched, _, duplicates = payments.reconcile('S001', others)
+        db.session.commit()
+    assert len(matched) == 3 and duplicates == []
+    assert _paid(app, invoice_no) == (4, Decimal('200.01'))
+
+
+def test_other_payments_are_not_duplicates(app, client):
+    invoice_no = _invoice(app, client)
+    other_seller = _invoice(app, login(app.test_client(), 'S002'), 'S002')
+    paid_at, amount = datetime(2026, 3, 1), Decimal('50.00')
+    with app.app_context():
+        # A manual payment, and another seller's bank payment, with the same date, amount and reference
+        payments.record_payments('S001', [{'invoice_no': invoice_no, 'amount': amount, 'paid_at': paid_at,
+                                           'reference': invoice_no}])
+        payments.record_payments('S002', [{'invoice_no': other_seller, 'amount': amount, 'paid_at': paid_at,
+                                           'method': 'bank', 'reference': invoice_no}])
+        db.session.commit()
+        line = {'line': 2, 'paid_at': paid_at, 'amount': amount, 'reference': invoice_no}
+        matched, _, duplicates = payments.reconcile('S001', [line])
+        db.session.commit()
+    assert len(matched) == 1 and duplicates == []
+    assert _paid(app, invoice_no) == (2, Decimal('100.00'))
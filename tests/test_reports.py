@@ -0,0 +1,46 @@
+import time
+
+import pytest
+
+import reports
+from conftest import create_invoice
+
+pytest.importorskip('pyarrow')
+
+
+def _wait_for_export(app, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        path = reports.current_export(app.config['REPORTS_SNAPSHOT_DIR'])
+        if path is not None:
+            return path
+        time.sleep(0.05)
+    raise AssertionError('no export was written')
+
+
+def test_page_never_exports_by_default(app, client):
+    page = client.get('/seller/reports', headers={'Accept-Encoding': 'identity'})
+    assert b'flask --app app export-snapshot' in page.data
+    assert reports.current_export(app.config['REPORTS_SNAPSHOT_DIR']) is None
+
+
+def test_page_exports_in_the_background_when_stale(app, client):
+    app.config['REPORTS_EXPORT_MAX_AGE_HOURS'] = 24
+    create_invoice(client, 'S001-C001', [('S001-P001', 2, 0)], tax='0')
+
+    page = client.get('/seller/reports', headers={'Accept-Encoding': 'identity'})
+    assert b'being built' in page.data
+    path = _wait_for_export(app)
+
+    page = client.get('/seller/reports', headers={'Accept-Encoding': 'identity'})
+    assert b'Customer 1 of S001' in page.data
+    # Fresh enough: no second export
+    assert reports.current_export(app.config['REPORTS_SNAPSHOT_DIR']) == path
+    with app.test_request_context():
+        assert reports.refresh_if_stale() is False
+
+
+def test_claim_keeps_a_second_worker_out(app, tmp_path):
+    directory = str(tmp_path / 'claims')
+    assert reports._claim(directory)
+    assert not reports._claim(directory)
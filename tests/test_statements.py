@@ -0,0 +1,56 @@
+import csv
+import io
+from datetime import date, datetime, time, timedelta
+from decimal import Decimal
+
+import statements
+from models import db, Invoice, ArchivedInvoice, Payment
+
+END = date(2026, 6, 30)
+
+
+def _add(model, number, age, amount, status='pending', paid=0, currency='INR', rate=1, at=time(12)):
+    """An invoice of S001-C001 issued ``age`` days before ``END``."""
+    db.session.add(model(invoice_no=f'T-{number}', invoice_datetime=datetime.combine(END - timedelta(days=age), at),
+                         status=status, amount=Decimal(amount), amount_paid=Decimal(paid), currency=currency,
+                         exchange_rate=Decimal(rate), s_id='S001', c_id='S001-C001'))
+    if paid:
+        db.session.add(Payment(invoice_no=f'T-{number}', s_id='S001', amount=Decimal(paid), method='manual',
+                               paid_at=datetime.combine(END - timedelta(days=age), at)))
+
+
+def _seed_aging():
+    # Each bucket's edges: 0/30, 31/60, 61/90, 91 and older
+    for number, (age, amount) in enumerate([(0, 1), (30, 2), (31, 4), (60, 8), (61, 16), (90, 32), (91, 64)]):
+        _add(Invoice, number, age, amount, at=time(23, 59) if age in (0, 30) else time(0, 0))
+    _add(ArchivedInvoice, 'archived', 200, 128, status='overdue')
+    _add(Invoice, 'part-paid', 45, 100, paid=40)              # 60 still due
+    _add(Invoice, 'euro', 75, 10, currency='EUR', rate=2)      # 5 in the base currency
+    _add(Invoice, 'paid', 10, 1000, status='paid', paid=1000)
+    _add(Invoice, 'cancelled', 100, 1000, status='cancelled')
+    _add(Invoice, 'future', -1, 1000)                          # after the statement's end
+    db.session.commit()
+
+
+def test_open_balances_fall_into_aging_buckets(app):
+    with app.app_context():
+        _seed_aging()
+        statement, = statements.build_statements('S001', END.replace(day=1), END, 'S001-C001')
+    assert statement.aging == [
+        ('0-30', Decimal('3.00')),
+        ('31-60', Decimal('72.00')),
+        ('61-90', Decimal('53.00')),
+        ('90+', Decimal('192.00')),
+    ]
+    assert sum(value for _, value in statement.aging) == statement.closing_balance
+
+
+def test_statement_csv_has_the_buckets(app, client):
+    with app.app_context():
+        _seed_aging()
+    response = client.get('/seller/customers/S001-C001/statement',
+                          query_string={'format': 'csv', 'start_date': '2026-06-01', 'end_date': END.isoformat()})
+    assert response.status_code == 200
+    header, row = csv.reader(io.StringIO(response.get_data(as_text=True)))
+    assert header[-4:] == ['Aging 0-30', 'Aging 31-60', 'Aging 61-90', 'Aging 90+']
+    assert row[0] == 'S001-C001' and row[-4:] == ['3.00', '72.00', '53.00', '192.00']
@@ -0,0 +1,64 @@
+from sqlalchemy import select
+
+import tenants
+from conftest import create_invoice, login
+from models import db, Customer, Invoice, Product
+
+
+def _own_invoice(app, client, s_id):
+    create_invoice(client, f'{s_id}-C001', [(f'{s_id}-P001', 1, 0)], tax='0')
+    with app.app_context():
+        return db.session.execute(select(Invoice.invoice_no).where(Invoice.s_id == s_id)).scalar_one()
+
+
+def _ids(response):
+    assert response.status_code == 200
+    return sorted(row['id'] for row in response.get_json()['data'])
+
+
+def test_api_lists_only_the_sellers_rows(app, client):
+    other = login(app.test_client(), 'S002')
+    mine, theirs = _own_invoice(app, client, 'S001'), _own_invoice(app, other, 'S002')
+
+    assert _ids(client.get('/api/v1/customers')) == ['S001-C001', 'S001-C002']
+    assert _ids(client.get('/api/v1/products')) == ['S001-P001', 'S001-P002']
+    assert _ids(client.get('/api/v1/invoices')) == [mine]
+    assert _ids(other.get('/api/v1/invoices')) == [theirs]
+
+
+def test_api_hides_other_sellers_rows(app, client):
+    theirs = _own_invoice(app, login(app.test_client(), 'S002'), 'S002')
+
+    assert client.get('/api/v1/customers/S002-C001').status_code == 404
+    assert client.get('/api/v1/products/S002-P001').status_code == 404
+    assert client.get(f'/api/v1/invoices/{theirs}').status_code == 404
+    assert client.get(f'/api/v1/invoices/{theirs}/items').status_code == 404
+    assert client.get('/api/v1/customers/S001-C001').status_code == 200
+
+
+def test_pages_hide_other_sellers_rows(app, client):
+    theirs = _own_invoice(app, login(app.test_client(), 'S002'), 'S002')
+
+    customers = client.get('/seller/customers', headers={'Accept-Encoding': 'identity'}).data
+    assert b'Customer 1 of S001' in customers and b'Customer 1 of S002' not in customers
+    assert b'Invoice not found' in client.get(f'/seller/invoices/edit/{theirs}', follow_redirects=True).data
+    assert b'Customer not found' in client.get('/seller/customers/edit/S002-C001', follow_redirects=True).data
+    assert theirs.encode() not in client.get(f'/invoice/{theirs}', follow_redirects=True).data
+
+
+def test_cannot_bill_another_sellers_customer_or_product(app, client):
+    create_invoice(client, 'S002-C001', [('S001-P001', 1, 0)], tax='0')
+    assert b'Customer not found' in client.get('/seller/invoices/create', headers={'Accept-Encoding': 'identity'}).data
+    create_invoice(client, 'S001-C001', [('S002-P001', 1, 0)], tax='0')
+    with app.app_context():
+        assert db.session.execute(select(Invoice).where(Invoice.s_id == 'S001')).first() is None
+
+
+def test_scope_filters_orm_statements(app):
+    with app.app_context():
+        assert len(db.session.execute(select(Customer)).scalars().all()) == 4  # jobs see every tenant
+        with tenants.scope('S002'):
+            assert {c.s_id for c in db.session.execute(select(Customer)).scalars()} == {'S002'}
+            assert db.session.get(Product, 'S001-P001') is None
+            everyone = select(Customer).execution_options(all_tenants=True)
+            assert len(db.session.execute(everyone).scalars().all()) == 4
@@ -0,0 +1,259 @@
+"""Webhooks for invoice events.
+
+Downstream systems are told when an invoice is created (``invoice.created``),
+edited (``invoice.updated``) or becomes fully paid (``invoice.paid``).
+``publish`` doesn't call anyone. It writes one ``webhook_outbox`` row per
+event and configured endpoint (``WEBHOOK_URLS``) through the current
+session, so the event commits or rolls back with the change itself and no
+request ever waits on a delivery.
+
+A separate dispatcher process delivers the outbox:
+
+    flask --app app dispatch-webhooks [--once]
+
+Each round claims up to ``WEBHOOK_BATCH_SIZE`` due events per endpoint and
+POSTs them as one ``{"events": [...]}`` batch. Up to ``WEBHOOK_CONCURRENCY``
+endpoints are sent to at once, each over its own kept-alive connection.
+When ``WEBHOOK_SECRET`` is set, the batch body is signed in the
+``X-Webhook-Signature: sha256=<hmac>`` header. A batch that fails (network
+error or non-2xx status) is retried after ``WEBHOOK_BACKOFF_SECONDS``,
+doubling on each failure with jitter and capped at six hours. After
+``WEBHOOK_MAX_ATTEMPTS`` failures the event is marked failed. Delivery is
+at least once, so receivers should de-duplicate on the event ``id``.
+
+To try it locally, run a stub receiver next to the dispatcher:
+
+    flask --app app webhook-stub --port 8765 [--fail-rate 0.3]
+    WEBHOOK_URLS=http://127.0.0.1:8765/hooks flask --app app dispatch-webhooks
+"""
+import hashlib
+import hmac
+import json
+import random
+import time
+import uuid
+from collections import Counter
+from datetime import datetime, timedelta
+from urllib.parse import urlsplit
+
+import click
+from flask import current_app
+from sqlalchemy import insert, select, update
+
+from models import db, WebhookEvent
+
+INVOICE_FIELDS = ('invoice_no', 's_id', 'c_id', 'status', 'invoice_datetime', 'tax', 'amount', 'amount_paid',
+                  'currency')
+MAX_BACKOFF_SECONDS = 6 * 3600
+LEASE_SECONDS = 300  # a claimed batch becomes due again if its dispatcher dies mid-delivery
+USER_AGENT = 'invoice-management-webhooks/1'
+
+
+def invoice_payload(values):
+    """Event data for an invoice, from its column values (an ORM row's or a bulk insert's)."""
+    return {
+        'id': values['invoice_no'],
+        'seller_id': values['s_id'],
+        'customer_id': values['c_id'],
+        'status': values['status'],
+        'date': values['invoice_datetime'].isoformat(),
+        'tax': float(values['tax']),
+        'amount': float(values['amount']),
+        'amount_paid': float(values.get('amount_paid') or 0),
+        'currency': values.get('currency') or current_app.config['BASE_CURRENCY'],
+    }
+
+
+def publish(event_type, invoices):
+    """Queue ``event_type`` for each of ``invoices`` (ORM objects or column dicts). The caller commits."""
+    endpoints = current_app.config['WEBHOOK_URLS']
+    if not endpoints or not invoices:
+        return
+    now = datetime.utcnow()
+    rows = []
+    for invoice in invoices:
+        values = invoice if isinstance(invoice, dict) else {field: getattr(invoice, field) for field in INVOICE_FIELDS}
+        event_id = str(uuid.uuid4())
+        payload = json.dumps({'id': event_id, 'type': event_type, 'created_at': now.isoformat(),
+                              'data': invoice_payload(values)})
+        rows.extend({'event_id': event_id, 'event_type': event_type, 'endpoint': endpoint, 's_id': values['s_id'],
+                     'payload': payload, 'created_at': now, 'next_attempt_at': now}
+                    for endpoint in endpoints)
+    db.session.execute(insert(WebhookEvent), rows)
+
+
+def backoff(attempts, base_seconds):
+    """Delay before retry number ``attempts``: doubling from ``base_seconds``, capped, with jitter."""
+    delay = min(base_seconds * 2 ** (attempts - 1), MAX_BACKOFF_SECONDS)
+    return timedelta(seconds=delay * random.uniform(0.5, 1.0))
+
+
+class Dispatcher:
+    def __init__(self, config):
+        # Only the dispatcher process needs these; web workers don't pay for importing them
+        from concurrent.futures import ThreadPoolExecutor
+
+        self.batch_size = config['WEBHOOK_BATCH_SIZE']
+        self.timeout = config['WEBHOOK_TIMEOUT']
+        self.secret = config['WEBHOOK_SECRET'].encode()
+        self.backoff_seconds = config['WEBHOOK_BACKOFF_SECONDS']
+        self.max_attempts = config['WEBHOOK_MAX_ATTEMPTS']
+        self.pool = ThreadPoolExecutor(max_workers=config['WEBHOOK_CONCURRENCY'])
+        # endpoint -> open connection; each endpoint has at most one batch in flight
+        self.connections = {}
+
+    def claim(self):
+        """Lease the next batch of due events for every endpoint. Returns ``{endpoint: rows}``."""
+        now = datetime.utcnow()
+        due = (WebhookEvent.delivered_at.is_(None), WebhookEvent.failed_at.is_(None),
+               WebhookEvent.next_attempt_at <= now)
+        batches = {}
+        for endpoint in db.session.execute(select(WebhookEvent.endpoint).where(*due).distinct()).scalars().all():
+            rows = db.session.execute(
+                select(WebhookEvent.id, WebhookEvent.attempts, WebhookEvent.payload)
+                .where(*due, WebhookEvent.endpoint == endpoint)
+                .order_by(WebhookEvent.id)
+                .limit(self.batch_size)
+                .with_for_update(skip_locked=True)
+            ).all()
+            if rows:
+                batches[endpoint] = rows
+        if batches:
+            db.session.execute(
+                update(WebhookEvent)
+                .where(WebhookEvent.id.in_([row.id for rows in batches.values() for row in rows]))
+                .values(next_attempt_at=now + timedelta(seconds=LEASE_SECONDS))
+            )
+        db.session.commit()
+        return batches
+
+    def post(self, endpoint, rows):
+        """Send one batch. Returns ``None`` on success or a short error description."""
+        import http.client
+
+        body = b'{"events": [' + b', '.join(row.payload.encode() for row in rows) + b']}'
+        headers = {'Content-Type': 'application/json', 'User-Agent': USER_AGENT}
+        if self.secret:
+            headers['X-Webhook-Signature'] = 'sha256=' + hmac.new(self.secret, body, hashlib.sha256).hexdigest()
+        url = urlsplit(endpoint)
+        connection = self.connections.get(endpoint)
+        if connection is None:
+            factory = http.client.HTTPSConnection if url.scheme == 'https' else http.client.HTTPConnection
+            connection = self.connections[endpoint] = factory(url.netloc, timeout=self.timeout)
+        try:
+            connection.request('POST', (url.path or '/') + (f'?{url.query}' if url.query else ''), body, headers)
+            response = connection.getresponse()
+            response.read()
+        except (OSError, http.client.HTTPException) as e:
+            connection.close()
+            del self.connections[endpoint]
+            return f'{type(e).__name__}: {e}'[:500]
+        if response.will_close:
+            connection.close()
+            del self.connections[endpoint]
+        if not 200 <= response.status < 300:
+            return f'HTTP {response.status} {response.reason}'[:500]
+        return None
+
+    def run_once(self):
+        """Deliver one batch per endpoint. Returns a Counter of delivered, retrying and failed events."""
+        batches = self.claim()
+        errors = dict(zip(batches, self.pool.map(lambda item: self.post(*item), batches.items())))
+        now = datetime.utcnow()
+        counts = Counter()
+        for endpoint, rows in batches.items():
+            error = errors[endpoint]
+            if error is None:
+                db.session.execute(
+                    update(WebhookEvent).where(WebhookEvent.id.in_([row.id for row in rows]))
+                    .values(delivered_at=now, attempts=WebhookEvent.attempts + 1, last_error=None)
+                )
+                counts['delivered'] += len(rows)
+                continue
+            retries = []
+            for row in rows:
+                attempts = row.attempts + 1
+                gave_up = attempts >= self.max_attempts
+                retries.append({
+                    'id': row.id,
+                    'attempts': attempts,
+                    'last_error': error,
+                    'failed_at': now if gave_up else None,
+                    'next_attempt_at': now if gave_up else now + backoff(attempts, self.backoff_seconds),
+                })
+                counts['failed' if gave_up else 'retrying'] += 1
+            db.session.execute(update(WebhookEvent), retries)
+        db.session.commit()
+        return counts
+
+    def close(self):
+        self.pool.shutdown()
+        for connection in self.connections.values():
+            connection.close()
+
+
+def stub_server(port, fail_rate=0.0, on_batch=None, host='127.0.0.1'):
+    """A local HTTP receiver for trying the dispatcher out.
+
+    It answers 503 to a ``fail_rate`` share of batches and 200 to the rest. It calls
+    ``on_batch(handler, events, status)`` for each batch it receives.
+    """
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'  # keep-alive, like a real receiver
+
+        def do_POST(self):
+            events = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))['events']
+            status = 503 if random.random() < fail_rate else 200
+            if on_batch:
+                on_batch(self, events, status)
+            self.send_response(status)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+
+        def log_message(self, format, *args):
+            pass
+
+    return ThreadingHTTPServer((host, port), Handler)
+
+
+def init_app(app):
+    @app.cli.command('dispatch-webhooks')
+    @click.option('--once', is_flag=True, help='Deliver everything that is due, then exit.')
+    @click.option('--poll', type=float, default=2.0, show_default=True,
+                  help='Seconds to wait when nothing is due.')
+    def dispatch_webhooks_command(once, poll):
+        """Deliver queued webhook events to their endpoints."""
+        dispatcher = Dispatcher(app.config)
+        try:
+            while True:
+                counts = dispatcher.run_once()
+                if counts:
+                    click.echo(f"Delivered {counts['delivered']}, retrying {counts['retrying']}, "
+                               f"failed {counts['failed']}.")
+                elif once:
+                    break
+                else:
+                    time.sleep(poll)
+        finally:
+            dispatcher.close()
+
+    @app.cli.command('webhook-stub')
+    @click.option('--port', type=int, default=8765, show_default=True)
+    @click.option('--fail-rate', type=float, default=0.0, show_default=True,
+                  help='Share of batches to answer with 503.')
+    def webhook_stub_command(port, fail_rate):
+        """Run a local webhook receiver that prints the batches it gets."""
+        def show(handler, events, status):
+            click.echo(f"{status} from port {handler.client_address[1]}: "
+                       + ', '.join(f"{event['type']} {event['data']['id']}" for event in events))
+
+        server = stub_server(port, fail_rate, show)
+        click.echo(f"Listening on http://127.0.0.1:{port}/")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()